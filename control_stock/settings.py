@@ -47,8 +47,10 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.PresupuestoSQLMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.PerfiladorMiddleware',
 ]
 
 ROOT_URLCONF = 'control_stock.urls'
@@ -87,6 +89,11 @@ database_url = os.environ.get("DATABASE_URL")
 if database_url:
     DATABASES['default'] = dj_database_url.parse(database_url)
 
+# SQLite: las transacciones toman el lock de escritura al empezar (y esperan hasta 20s si otra
+# caja lo tiene) en vez de fallar con "database is locked" al pasar de leer a escribir
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default'].setdefault('OPTIONS', {}).update({'transaction_mode': 'IMMEDIATE', 'timeout': 20})
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -114,6 +121,9 @@ LANGUAGE_CODE = 'en-us'
 
 TIME_ZONE = 'UTC'
 
+# Zona del negocio: define qué es "un día" de ventas (ver core/fechas.py)
+ZONA_HORARIA_NEGOCIO = 'America/Argentina/Buenos_Aires'
+
 USE_I18N = True
 
 USE_TZ = True
@@ -133,4 +143,52 @@ LOGOUT_REDIRECT_URL = '/' # Opcional: Redirige al dashboard después del logout
 
 # Configuración de Archivos Estáticos (CSS, JS, Imágenes)
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
\ No newline at end of file
+STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# Presupuesto de SQL por solicitud (ver core/middleware.py). Las solicitudes que lo superan
+# se loguean en 'core.presupuesto_sql' con el EXPLAIN de sus consultas más lentas.
+PRESUPUESTO_SQL = {
+    'CONSULTAS': int(os.environ.get('PRESUPUESTO_SQL_CONSULTAS', 50)),
+    'MILISEGUNDOS': int(os.environ.get('PRESUPUESTO_SQL_MS', 500)),
+    'LENTAS': 5,
+    'VOLCAR_CADA': 60,
+}
+
+# Perfilador por solicitud (ver core/middleware.py): un superusuario agrega ?perfilar=1 a la URL
+# (o ?perfilar=on para dejar la cookie puesta, ?perfilar=off para sacarla). Los .folded los arma
+# `python manage.py colapsar_perfiles`.
+PERFILADOR = {
+    'DIRECTORIO': os.environ.get('PERFILADOR_DIRECTORIO', os.path.join(BASE_DIR, 'perfiles')),
+}
+
+# Métricas para Prometheus en /metrics (ver core/metricas.py). Cada worker escribe sus totales
+# en DIRECTORIO (compartido entre workers de la misma máquina) y la vista los suma; los de workers
+# que ya terminaron se compactan en acumulado.json. Tests, benchmark y estrés usan un directorio temporal.
+METRICAS = {
+    'DIRECTORIO': os.environ.get('METRICAS_DIRECTORIO', os.path.join(BASE_DIR, 'metricas')),
+    'TOKEN': os.environ.get('METRICAS_TOKEN', ''),
+}
+
+# Cache compartido entre los workers de la máquina, sin servicios externos (ver core/cache_compartido.py):
+# por defecto archivos en CACHE_DIRECTORIO; con CACHE_BACKEND=db, una tabla de la base
+# (crearla con `python manage.py createcachetable`).
+if os.environ.get('CACHE_BACKEND') == 'db':
+    CACHE_ALMACEN = {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'core_cache'}
+else:
+    CACHE_ALMACEN = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                     'LOCATION': os.environ.get('CACHE_DIRECTORIO', os.path.join(BASE_DIR, 'cache'))}
+CACHES = {
+    'default': {**CACHE_ALMACEN, 'KEY_PREFIX': 'stock', 'TIMEOUT': 300, 'OPTIONS': {'MAX_ENTRIES': 10000}},
+}
+# Los tests y los comandos de benchmark/estrés lo reemplazan por uno en memoria (CACHE_AISLADO)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'consola': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core.presupuesto_sql': {'handlers': ['consola'], 'level': 'WARNING', 'propagate': False},
+        'core.perfilador': {'handlers': ['consola'], 'level': 'INFO', 'propagate': False},
+    },
+}
@@ -6,7 +6,7 @@ from django.contrib.auth.models import User
 # Importá TODOS tus modelos aquí
 from .models import (
     Proveedor, Producto, Categoria, Stock, Venta, DetalleVenta, 
-    Configuracion, Sucursal, PerfilUsuario
+    Configuracion, Sucursal, PerfilUsuario, EstadisticaSQLVista
 )
 
 # Configuración para editar PerfilUsuario dentro de User
@@ -41,4 +41,20 @@ admin.site.register(Venta, VentaAdmin) # Podrías quitarlo si ya no lo usás dir
 admin.site.register(DetalleVenta) # Podrías quitarlo si ya no lo usás directo
 admin.site.register(Configuracion)
 admin.site.register(Sucursal) # MUY IMPORTANTE
-# No registres PerfilUsuario aquí, ya está inline en User.
\ No newline at end of file
+# No registres PerfilUsuario aquí, ya está inline en User.
+
+class EstadisticaSQLVistaAdmin(admin.ModelAdmin):
+    # Acumulados del middleware de presupuesto SQL: solo lectura, las peores vistas primero
+    list_display = ('vista', 'solicitudes', 'consultas_promedio', 'consultas_max', 'milisegundos_promedio',
+                    'milisegundos_max', 'excedidas', 'actualizado')
+    ordering = ('-excedidas', '-consultas_max')
+    search_fields = ('vista',)
+    readonly_fields = [f.name for f in EstadisticaSQLVista._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+admin.site.register(EstadisticaSQLVista, EstadisticaSQLVistaAdmin)
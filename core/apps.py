@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # Registra las señales que invalidan lo cacheado: catálogo, sucursales, configuración, widgets y listados
+        from . import catalogo, configuracion, fragmentos, listados, sucursales  # noqa: F401
@@ -0,0 +1,81 @@
+# core/cache_compartido.py
+# Acceso al cache compartido entre workers (settings.CACHES: archivos o tabla en la base, sin
+# servicios externos). Cada uso tiene su espacio de claves con una versión propia: invalidar es
+# escribir una versión nueva y las claves viejas quedan huérfanas hasta que vencen.
+# Las versiones son tokens al azar y no contadores (cache.incr no es atómico en los backends de
+# archivo/base, y si se pierde la clave la que se crea de nuevo nunca coincide con una anterior).
+# Aciertos y fallos se cuentan en /metrics (stock_cache_consultas_total).
+import hashlib
+import re
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+
+from . import metricas
+
+# Para los comandos que arman una base de prueba: lo que cacheen no puede quedar en el cache de la app
+CACHE_AISLADO = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'aislado'}}
+
+_FALTA = object()
+
+
+def _clave_version(nombre):
+    return f'version:{nombre}'
+
+
+def _token():
+    return uuid.uuid4().hex[:12]
+
+
+def versiones(*nombres):
+    """ {nombre: token} de cada versión; las que no existen (primera vez o desalojadas) se crean. """
+    claves = {_clave_version(nombre): nombre for nombre in nombres}
+    valores = cache.get_many(claves)
+    faltan = {clave: _token() for clave in claves if clave not in valores}
+    if faltan:
+        cache.set_many(faltan, None)
+        valores.update(faltan)
+    return {claves[clave]: valor for clave, valor in valores.items()}
+
+
+def version(nombre):
+    return versiones(nombre)[nombre]
+
+
+def invalidar(*nombres):
+    """
+    Cambia las versiones cuando se confirma la transacción en curso (o ya, si no hay ninguna):
+    antes, otro pedido podría guardar los datos viejos bajo la versión nueva.
+    """
+    transaction.on_commit(lambda: cache.set_many({_clave_version(nombre): _token() for nombre in nombres}, None))
+
+
+class Espacio:
+    """ Claves con prefijo y versión propios: `catalogo:<versión>:<partes...>`. """
+
+    def __init__(self, nombre, segundos=300):
+        self.nombre = nombre
+        self.segundos = segundos
+
+    def clave(self, *partes):
+        texto = ':'.join(str(parte) for parte in partes)
+        if len(texto) > 100 or not re.fullmatch(r'[\w:.-]*', texto):
+            # Filtros con espacios, comillas o muy largos: un hash fijo sirve en cualquier backend
+            texto = hashlib.md5(texto.encode()).hexdigest()
+        return f'{self.nombre}:{version(self.nombre)}:{texto}'
+
+    def obtener(self, partes, calcular, segundos=None):
+        """ Valor cacheado de `partes`; si no está, llama a `calcular()` y lo guarda. """
+        clave = self.clave(*partes)
+        valor = cache.get(clave, _FALTA)
+        if valor is not _FALTA:
+            metricas.cache_consultas.inc(espacio=self.nombre, resultado='acierto')
+            return valor
+        metricas.cache_consultas.inc(espacio=self.nombre, resultado='fallo')
+        valor = calcular()
+        cache.set(clave, valor, self.segundos if segundos is None else segundos)
+        return valor
+
+    def invalidar(self):
+        invalidar(self.nombre)
@@ -0,0 +1,280 @@
+# core/canasta.py
+# Análisis de canasta incremental: en vez de correr Apriori sobre todo el historial
+# en cada visita, mantenemos contadores (canastas, soporte por producto y pares)
+# que se actualizan a medida que se confirman ventas.
+import heapq
+import math
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+from itertools import combinations
+from operator import itemgetter
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from .models import (
+    Venta, DetalleVenta, Producto, Stock, CanastaDia, SoporteProductoDia, CoocurrenciaProductosDia, MarcaCanasta
+)
+from .fechas import hoy_local, dia_local
+
+TAMANO_LOTE = 2000
+# Las ventas de cajas concurrentes se confirman fuera del orden de sus ids: una con id menor puede
+# confirmarse después de otra mayor. Solo se vuelcan las que tienen más de este margen, así cuando
+# la marca pasa un id ya no puede aparecer ninguna venta anterior sin contar.
+SEGUNDOS_MARGEN = 300
+
+# Sugerencias para el POS ("los que compran esto también llevan...")
+DIAS_HISTORIA_SUGERENCIAS = 90
+VECINOS_POR_PRODUCTO = 20
+SEGUNDOS_REFRESCO_PARES = 300     # Los pares cambian despacio
+SEGUNDOS_REFRESCO_GONDOLA = 60    # El stock en góndola cambia con cada venta
+
+
+def actualizar_canasta(lote=TAMANO_LOTE, segundos_margen=SEGUNDOS_MARGEN):
+    """
+    Vuelca en los contadores las ventas posteriores a la marca de agua, hasta la primera que tenga
+    menos de `segundos_margen` (ver SEGUNDOS_MARGEN). Devuelve cuántas ventas se procesaron.
+    Lo corre el comando actualizar_canasta (cron), nunca una vista: el primer volcado después de
+    cargar historial puede recorrer miles de ventas.
+
+    La marca se avanza con un UPDATE condicional al principio de cada transacción:
+    si dos procesos corren a la vez, solo uno gana cada lote y el otro se retira,
+    así ninguna venta se cuenta dos veces.
+    """
+    MarcaCanasta.objects.get_or_create(pk=1)
+    procesadas = 0
+
+    while True:
+        with transaction.atomic():
+            desde = MarcaCanasta.objects.values_list('ultima_venta_id', flat=True).get(pk=1)
+            ventas = list(
+                Venta.objects.filter(id__gt=desde).order_by('id').values('id', 'sucursal_id', 'fecha_hora')[:lote]
+            )
+            corte = timezone.now() - timedelta(seconds=segundos_margen)
+            recientes = next((i for i, venta in enumerate(ventas) if venta['fecha_hora'] > corte), None)
+            if recientes is not None:
+                ventas = ventas[:recientes]  # Quedan para la próxima pasada
+            if not ventas:
+                return procesadas
+
+            hasta = ventas[-1]['id']
+            if not MarcaCanasta.objects.filter(pk=1, ultima_venta_id=desde).update(ultima_venta_id=hasta):
+                return procesadas  # Otro proceso está volcando estas mismas ventas
+
+            _volcar(ventas, desde, hasta)
+            procesadas += len(ventas)
+
+
+def _volcar(ventas, desde, hasta):
+    productos_por_venta = {}
+    for venta_id, producto_id in DetalleVenta.objects.filter(
+        venta_id__gt=desde, venta_id__lte=hasta, producto__isnull=False
+    ).values_list('venta_id', 'producto_id'):
+        productos_por_venta.setdefault(venta_id, set()).add(producto_id)
+
+    canastas, soporte, pares = Counter(), Counter(), Counter()
+    for venta in ventas:
+        productos = productos_por_venta.get(venta['id'], ())
+        # Igual que antes: solo cuentan las ventas con más de un producto
+        if len(productos) < 2:
+            continue
+        clave = (venta['sucursal_id'], dia_local(venta['fecha_hora']))
+        canastas[clave] += 1
+        ordenados = sorted(productos)
+        for producto_id in ordenados:
+            soporte[clave + (producto_id,)] += 1
+        for a, b in combinations(ordenados, 2):
+            pares[clave + (a, b)] += 1
+
+    _sumar(CanastaDia, ('sucursal_id', 'fecha'), canastas)
+    _sumar(SoporteProductoDia, ('sucursal_id', 'fecha', 'producto_id'), soporte)
+    _sumar(CoocurrenciaProductosDia, ('sucursal_id', 'fecha', 'producto_a_id', 'producto_b_id'), pares)
+
+
+def _sumar(modelo, campos, contador):
+    """ Suma los valores del contador a las filas existentes y crea las que faltan. """
+    if not contador:
+        return
+
+    # Agrupamos por (sucursal, día) para traer solo las filas que vamos a tocar
+    por_dia = {}
+    for clave in contador:
+        por_dia.setdefault(clave[:2], []).append(clave)
+
+    a_actualizar = []
+    for (sucursal_id, fecha), claves in por_dia.items():
+        filtro = {'sucursal_id': sucursal_id, 'fecha': fecha}
+        for i, campo in enumerate(campos[2:], start=2):
+            filtro[f'{campo}__in'] = {c[i] for c in claves}
+        for fila in modelo.objects.filter(**filtro):
+            clave = tuple(getattr(fila, campo) for campo in campos)
+            if clave in contador:
+                fila.transacciones += contador.pop(clave)
+                a_actualizar.append(fila)
+
+    modelo.objects.bulk_update(a_actualizar, ['transacciones'], batch_size=1000)
+    modelo.objects.bulk_create(
+        [modelo(transacciones=n, **dict(zip(campos, clave))) for clave, n in contador.items()],
+        batch_size=1000,
+    )
+
+
+def reglas_asociacion(sucursal=None, desde=None, hasta=None,
+                      min_soporte=0.01, min_confianza=0.1, min_lift=1.1, limite=100):
+    """
+    Reglas simples A -> B calculadas con NumPy a partir de los contadores.
+    `desde`/`hasta` son fechas (inclusive). Devuelve una lista de dicts ordenada por confianza.
+    """
+    filtro = {}
+    if sucursal:
+        filtro['sucursal'] = sucursal
+    if desde:
+        filtro['fecha__gte'] = desde
+    if hasta:
+        filtro['fecha__lte'] = hasta
+
+    total = CanastaDia.objects.filter(**filtro).aggregate(n=Sum('transacciones'))['n'] or 0
+    if not total:
+        return []
+
+    items = np.array(
+        SoporteProductoDia.objects.filter(**filtro).values('producto_id').annotate(
+            n=Sum('transacciones')
+        ).order_by('producto_id').values_list('producto_id', 'n'),
+        dtype=np.int64,
+    ).reshape(-1, 2)
+
+    # El soporte mínimo se aplica en SQL (HAVING) para no traer pares irrelevantes
+    pares = np.array(
+        CoocurrenciaProductosDia.objects.filter(**filtro).values('producto_a_id', 'producto_b_id').annotate(
+            n=Sum('transacciones')
+        ).filter(n__gte=max(1, math.ceil(min_soporte * total))).order_by().values_list(
+            'producto_a_id', 'producto_b_id', 'n'
+        ),
+        dtype=np.int64,
+    ).reshape(-1, 3)
+    if not len(pares):
+        return []
+
+    ids_items, n_items = items[:, 0], items[:, 1].astype(float)
+    a, b, n_ab = pares[:, 0], pares[:, 1], pares[:, 2].astype(float)
+    n_a = n_items[np.searchsorted(ids_items, a)]
+    n_b = n_items[np.searchsorted(ids_items, b)]
+
+    # Cada par genera dos reglas: A -> B y B -> A
+    base = np.concatenate([a, b])
+    agregado = np.concatenate([b, a])
+    soporte = np.concatenate([n_ab, n_ab]) / total
+    confianza = np.concatenate([n_ab / n_a, n_ab / n_b])
+    lift = confianza / (np.concatenate([n_b, n_a]) / total)
+
+    validas = (confianza >= min_confianza) & (lift >= min_lift)
+    orden = np.argsort(-confianza[validas], kind='stable')[:limite]
+    base, agregado = base[validas][orden], agregado[validas][orden]
+    soporte, confianza, lift = soporte[validas][orden], confianza[validas][orden], lift[validas][orden]
+
+    nombres = dict(Producto.objects.filter(id__in=set(base) | set(agregado)).values_list('id', 'nombre'))
+    return [
+        {
+            'base': nombres.get(int(base[i]), '?'),
+            'add': nombres.get(int(agregado[i]), '?'),
+            'soporte': round(float(soporte[i]) * 100, 2),  # % de todas las canastas
+            'confianza': round(float(confianza[i]) * 100, 2),  # % de veces que B se compra si se compra A
+            'lift': round(float(lift[i]), 2),
+        }
+        for i in range(len(base))
+    ]
+
+
+class IndiceSugerencias:
+    """
+    Estructura en memoria (por proceso) para responder en ~1ms desde el POS:
+    - vecinos: producto_id -> [(otro_id, confianza A->B)], solo los mejores VECINOS_POR_PRODUCTO
+    - gondola: sucursal_id -> set de producto_id con stock en góndola
+    - productos: producto_id -> (nombre, precio) de los candidatos
+    Se reconstruye sola cuando vence (ver SEGUNDOS_REFRESCO_*).
+    """
+
+    def __init__(self):
+        # (vecinos, productos) se reemplazan juntos para que un request nunca vea una mezcla
+        self.pares = ({}, {})
+        self.gondola = {}
+        self._pares_hasta = 0
+        self._gondola_hasta = 0
+        self._lock = threading.Lock()
+
+    def _cargar_pares(self):
+        desde = hoy_local() - timedelta(days=DIAS_HISTORIA_SUGERENCIAS)
+        soporte = dict(
+            SoporteProductoDia.objects.filter(fecha__gte=desde).values('producto_id').annotate(
+                n=Sum('transacciones')
+            ).order_by().values_list('producto_id', 'n')
+        )
+        pares = CoocurrenciaProductosDia.objects.filter(fecha__gte=desde).values(
+            'producto_a_id', 'producto_b_id'
+        ).annotate(n=Sum('transacciones')).order_by().values_list('producto_a_id', 'producto_b_id', 'n')
+
+        candidatos = defaultdict(list)
+        for a, b, n in pares:
+            candidatos[a].append((b, n / soporte[a]))
+            candidatos[b].append((a, n / soporte[b]))
+
+        vecinos = {
+            producto_id: heapq.nlargest(VECINOS_POR_PRODUCTO, lista, key=itemgetter(1))
+            for producto_id, lista in candidatos.items()
+        }
+        ids = {otro for lista in vecinos.values() for otro, _ in lista}
+        productos = {
+            p['id']: (p['nombre'], p['precio_venta'])
+            for p in Producto.objects.filter(id__in=ids).values('id', 'nombre', 'precio_venta')
+        }
+        self.pares = (vecinos, productos)
+
+    def _cargar_gondola(self):
+        gondola = defaultdict(set)
+        for sucursal_id, producto_id in Stock.objects.filter(
+            ubicacion='gondola', cantidad__gt=0
+        ).values_list('sucursal_id', 'producto_id').distinct():
+            gondola[sucursal_id].add(producto_id)
+        self.gondola = dict(gondola)
+
+    def refrescar_si_vencido(self):
+        ahora = time.monotonic()
+        if ahora < self._pares_hasta and ahora < self._gondola_hasta:
+            return
+        with self._lock:
+            if ahora >= self._pares_hasta:
+                self._cargar_pares()
+                self._pares_hasta = ahora + SEGUNDOS_REFRESCO_PARES
+            if ahora >= self._gondola_hasta:
+                self._cargar_gondola()
+                self._gondola_hasta = ahora + SEGUNDOS_REFRESCO_GONDOLA
+
+    def sugerir(self, carrito_ids, sucursal_id, n=5):
+        """ Los `n` productos que más se compran junto al carrito y hay en góndola. """
+        self.refrescar_si_vencido()
+        vecinos, productos = self.pares
+        carrito = set(carrito_ids)
+        gondola = self.gondola.get(sucursal_id, ())
+
+        puntajes = defaultdict(float)
+        for producto_id in carrito:
+            for otro, confianza in vecinos.get(producto_id, ()):
+                if otro not in carrito and otro in gondola:
+                    puntajes[otro] += confianza
+
+        return [
+            {
+                'id': producto_id,
+                'nombre': productos[producto_id][0],
+                'precio': productos[producto_id][1],
+                'puntaje': round(puntaje, 3),
+            }
+            for producto_id, puntaje in heapq.nlargest(n, puntajes.items(), key=itemgetter(1))
+        ]
+
+
+indice_sugerencias = IndiceSugerencias()
@@ -0,0 +1,81 @@
+# core/catalogo.py
+# Listado del catálogo de productos paginado en SQL: filtros, orden y página se resuelven
+# en la base y solo viajan las columnas que se muestran.
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .cache_compartido import Espacio
+from .models import Producto
+
+POR_PAGINA = 25
+POR_PAGINA_MAXIMO = 100
+SEGUNDOS_CACHE_TOTAL = 300
+
+# Columnas por las que se puede ordenar (nombre público -> campo)
+ORDENES = {
+    'nombre': 'nombre',
+    'codigo_barras': 'codigo_barras',
+    'proveedor': 'proveedor__nombre',
+    'categoria': 'categoria__nombre',
+    'precio_venta': 'precio_venta',
+    'stock_minimo': 'stock_minimo',
+}
+
+CAMPOS = (
+    'id', 'nombre', 'codigo_barras', 'precio_venta', 'stock_minimo', 'es_favorito',
+    'proveedor__nombre', 'categoria__nombre',
+)
+
+TOTALES = Espacio('catalogo', SEGUNDOS_CACHE_TOTAL)
+
+
+def filtrar_catalogo(texto=None, categoria_id=None, proveedor_id=None, favorito=None):
+    productos = Producto.objects.all()
+    if texto:
+        productos = productos.filter(Q(nombre__icontains=texto) | Q(codigo_barras__startswith=texto))
+    if categoria_id:
+        productos = productos.filter(categoria_id=categoria_id)
+    if proveedor_id:
+        productos = productos.filter(proveedor_id=proveedor_id)
+    if favorito is not None:
+        productos = productos.filter(es_favorito=favorito)
+    return productos
+
+
+def contar(productos, *filtros):
+    """
+    COUNT(*) cacheado por combinación de filtros. La clave incluye una versión que cambia
+    cada vez que se crea, edita o borra un producto, así el total nunca queda desactualizado.
+    """
+    return TOTALES.obtener(('total', repr(filtros)), productos.count)
+
+
+def pagina_catalogo(texto=None, categoria_id=None, proveedor_id=None, favorito=None,
+                    orden='nombre', pagina=1, por_pagina=POR_PAGINA):
+    """
+    Devuelve (filas, total_filtrado, total_catalogo). `orden` es una clave de ORDENES,
+    con '-' adelante para descendente. `pagina` empieza en 1.
+    """
+    descendente = orden.startswith('-')
+    campo = ORDENES.get(orden.lstrip('-'), 'nombre')
+    # El id desempata para que el orden sea estable entre páginas
+    orden_sql = [f'-{campo}', '-id'] if descendente else [campo, 'id']
+
+    por_pagina = max(1, min(por_pagina, POR_PAGINA_MAXIMO))
+    inicio = (max(pagina, 1) - 1) * por_pagina
+
+    filtros = (texto, categoria_id, proveedor_id, favorito)
+    productos = filtrar_catalogo(*filtros)
+    filas = list(productos.order_by(*orden_sql).values(*CAMPOS)[inicio:inicio + por_pagina])
+
+    total_catalogo = contar(Producto.objects.all())
+    total = total_catalogo if not any(f is not None and f != '' for f in filtros) else contar(productos, *filtros)
+    return filas, total, total_catalogo
+
+
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+def invalidar_totales(sender, **kwargs):
+    # Cambiar la versión deja huérfanas (y luego vencidas) todas las claves anteriores
+    TOTALES.invalidar()
@@ -0,0 +1,61 @@
+# core/configuracion.py
+# Configuración de precios (descuento en efectivo, recargos de crédito y QR) en memoria del proceso.
+# registrar_venta la necesita en cada GET y POST: en vez de ir a la base cada vez, cada worker guarda
+# su copia junto con la versión con la que la leyó. Al guardar la Configuración se cambia la versión
+# en el cache y todos los procesos que compartan ese cache la releen en la próxima venta.
+import threading
+from decimal import Decimal
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import cache_compartido
+from .models import Configuracion
+
+VERSION = 'configuracion'
+
+_lock = threading.Lock()
+_cache = {'version': None, 'config': None, 'multiplicadores': {}}
+
+
+def _multiplicadores(config):
+    """ Factor a aplicar sobre el subtotal de productos por método de pago (sin división en cada venta). """
+    cien = Decimal('100')
+    multiplicadores = {}
+    if config.descuento_efectivo_porcentaje > 0:
+        multiplicadores['efectivo'] = -(config.descuento_efectivo_porcentaje / cien)
+    if config.recargo_credito_porcentaje > 0:
+        multiplicadores['credito'] = config.recargo_credito_porcentaje / cien
+    if config.recargo_qr_porcentaje > 0:
+        multiplicadores['qr'] = config.recargo_qr_porcentaje / cien
+    return multiplicadores
+
+
+def _vigente():
+    version = cache_compartido.version(VERSION)
+    with _lock:
+        if _cache['version'] == version:
+            return _cache['config'], _cache['multiplicadores']
+    # La versión se lee antes que la fila: si alguien guarda en el medio, la próxima llamada relee.
+    # Si todavía no se cargó ninguna, valen los valores por defecto (sin escribir en la base)
+    config = Configuracion.objects.filter(pk=1).first() or Configuracion(pk=1)
+    multiplicadores = _multiplicadores(config)
+    with _lock:
+        _cache.update(version=version, config=config, multiplicadores=multiplicadores)
+    return config, multiplicadores
+
+
+def configuracion_vigente():
+    """ La Configuración (pk=1) cacheada. Es compartida entre solicitudes: solo lectura. """
+    return _vigente()[0]
+
+
+def multiplicador_pago(metodo_pago):
+    """ Decimal por el que se multiplica el subtotal de productos para obtener el descuento/recargo. """
+    return _vigente()[1].get(metodo_pago, Decimal('0'))
+
+
+@receiver(post_save, sender=Configuracion)
+@receiver(post_delete, sender=Configuracion)
+def invalidar_configuracion(sender, **kwargs):
+    cache_compartido.invalidar(VERSION)
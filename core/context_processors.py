@@ -1,25 +1,31 @@
 # core/context_processors.py
 from django.utils import timezone
 from django.db.models import Sum, F, Q
-from .models import Stock, Producto, PerfilUsuario, Sucursal
+from django.db.models.functions import Coalesce
+from .models import Stock, Producto
+from .fechas import hoy_local
+from . import metricas
+from .sucursales import sucursal_activa, todas_las_sucursales
 
 def alertas_globales(request):
+    with metricas.alertas_segundos.medir():
+        return _alertas_globales(request)
+
+
+def _alertas_globales(request):
     # Si el usuario no está logueado, no mostramos alertas
     if not request.user.is_authenticated:
         return {'alertas_count': 0}
 
     usuario = request.user
-    sucursal_usuario = None
-    
-    # Intentamos obtener la sucursal
-    if hasattr(usuario, 'perfilusuario') and usuario.perfilusuario.sucursal:
-        sucursal_usuario = usuario.perfilusuario.sucursal
+    # La misma sucursal que ve la vista, ya resuelta para esta solicitud (core/sucursales.py)
+    sucursal_usuario = sucursal_activa(request)
 
     # Si no tiene sucursal y no es superadmin, no calculamos nada
     if not sucursal_usuario and not usuario.is_superuser:
          return {'alertas_count': 0}
 
-    hoy = timezone.now().date()
+    hoy = hoy_local()
     total_alertas = 0
 
     # 1. ALERTAS DE VENCIMIENTO (Vencidos o vencen en 20 días)
@@ -40,21 +46,16 @@ def alertas_globales(request):
     # Anotamos la suma de stock (filtrada por sucursal si es necesario)
     if sucursal_usuario and not usuario.is_superuser:
         productos_con_stock = productos_query.annotate(
-            stock_total=Sum('lotes__cantidad', filter=Q(lotes__sucursal=sucursal_usuario))
+            stock_total=Coalesce(Sum('lotes__cantidad', filter=Q(lotes__sucursal=sucursal_usuario)), 0)
         )
     else:
         productos_con_stock = productos_query.annotate(
-            stock_total=Sum('lotes__cantidad')
+            stock_total=Coalesce(Sum('lotes__cantidad'), 0)
         )
     
-    # Contamos cuántos tienen stock total (o 0 si es nulo) menor al mínimo
-    # Coalesce es para tratar el NULL como 0, pero en Python simple:
-    # Filtramos donde stock_total < stock_minimo OR stock_total es None
-    stock_bajo = 0
-    for p in productos_con_stock:
-        actual = p.stock_total or 0
-        if actual < p.stock_minimo:
-            stock_bajo += 1
+    # Contamos en la base cuántos tienen stock total (NULL = sin lotes = 0) menor al mínimo:
+    # un solo COUNT en lugar de traer todo el catálogo y comparar en Python
+    stock_bajo = productos_con_stock.filter(stock_total__lt=F('stock_minimo')).count()
             
     total_alertas += stock_bajo
 
@@ -77,19 +78,12 @@ def alertas_globales(request):
     todas_sucursales = []
     sucursal_actual_nombre = "Sin Asignar"
 
-    if request.user.is_authenticated:
-        if request.user.is_superuser:
-            todas_sucursales = Sucursal.objects.all()
+    if request.user.is_superuser:
+        # Desde la memoria del proceso: el selector de sucursal no consulta la base
+        todas_sucursales = list(todas_las_sucursales().values())
 
-        # Tratamos de averiguar el nombre de la sucursal actual para mostrarlo
-        # (Repetimos lógica de vista por limitación de context processor, o usamos una variable de sesión si ya la seteamos)
-        if request.user.is_superuser and request.session.get('sucursal_seleccionada_id'):
-             try:
-                 s = Sucursal.objects.get(id=request.session.get('sucursal_seleccionada_id'))
-                 sucursal_actual_nombre = s.nombre
-             except: pass
-        elif hasattr(request.user, 'perfilusuario') and request.user.perfilusuario.sucursal:
-             sucursal_actual_nombre = request.user.perfilusuario.sucursal.nombre
+    if sucursal_usuario:
+        sucursal_actual_nombre = sucursal_usuario.nombre
 
     # Añadimos al return existente
     return {
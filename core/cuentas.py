@@ -0,0 +1,93 @@
+# core/cuentas.py
+# Cuentas corrientes de clientes: cada venta fiada o pago se agrega al libro
+# (MovimientoCuentaCliente) y el saldo se actualiza en la base con F(), nunca leyendo
+# y escribiendo desde Python. Cada CADA_MOVIMIENTOS_CORTE movimientos se guarda un corte
+# de saldo para que el estado de cuenta no tenga que sumar toda la historia.
+from decimal import Decimal
+
+from django.core.paginator import Paginator
+from django.db.models import F, Sum, Window
+
+from .models import Cliente, MovimientoCuentaCliente, CorteSaldoCliente
+
+CADA_MOVIMIENTOS_CORTE = 100
+MOVIMIENTOS_POR_PAGINA = 50
+
+
+def bloquear_cliente(cliente_id):
+    """
+    Trae el cliente con su fila bloqueada hasta el fin de la transacción. Llamarlo antes de
+    insertar cualquier movimiento: así los movimientos de un cliente se confirman en orden de id
+    y un corte nunca deja atrás uno con id menor todavía sin confirmar.
+    """
+    return Cliente.objects.select_for_update().get(pk=cliente_id)
+
+
+def registrar_movimiento(cliente_id, tipo, monto, sucursal=None, venta=None, pago=None, fecha=None):
+    """
+    Agrega el movimiento al libro y actualiza el saldo. `monto` positivo suma deuda,
+    negativo la descuenta. Llamar dentro de la transacción que registra la venta o el pago,
+    con el cliente ya bloqueado (bloquear_cliente).
+    """
+    datos = {'fecha': fecha} if fecha else {}
+    movimiento = MovimientoCuentaCliente.objects.create(
+        cliente_id=cliente_id, tipo=tipo, monto=monto, sucursal=sucursal, venta=venta, pago=pago, **datos
+    )
+    Cliente.objects.filter(pk=cliente_id).update(
+        saldo_actual=F('saldo_actual') + monto,
+        movimientos_desde_corte=F('movimientos_desde_corte') + 1,
+    )
+    pendientes = Cliente.objects.filter(pk=cliente_id).values_list('movimientos_desde_corte', flat=True).get()
+    if pendientes >= CADA_MOVIMIENTOS_CORTE:
+        tomar_corte(cliente_id, movimiento.id)
+    return movimiento
+
+
+def tomar_corte(cliente_id, hasta_movimiento_id):
+    """ Guarda el saldo del libro hasta `hasta_movimiento_id` partiendo del corte anterior. """
+    anterior = _corte_anterior(cliente_id, hasta_movimiento_id + 1)
+    desde_id, saldo = (anterior.hasta_movimiento_id, anterior.saldo) if anterior else (0, Decimal('0'))
+    suma = MovimientoCuentaCliente.objects.filter(
+        cliente_id=cliente_id, id__gt=desde_id, id__lte=hasta_movimiento_id
+    ).aggregate(total=Sum('monto'))['total'] or 0
+
+    CorteSaldoCliente.objects.create(cliente_id=cliente_id, hasta_movimiento_id=hasta_movimiento_id, saldo=saldo + suma)
+    Cliente.objects.filter(pk=cliente_id).update(movimientos_desde_corte=0)
+
+
+def _corte_anterior(cliente_id, antes_de_id):
+    return CorteSaldoCliente.objects.filter(
+        cliente_id=cliente_id, hasta_movimiento_id__lt=antes_de_id
+    ).order_by('-hasta_movimiento_id').first()
+
+
+def estado_de_cuenta(cliente, numero_pagina=1, por_pagina=MOVIMIENTOS_POR_PAGINA):
+    """
+    Página del estado de cuenta (más nuevo primero) con el saldo después de cada movimiento.
+    El saldo corrido sale de un SUM() OVER (ORDER BY id) en SQL que arranca en el último corte
+    anterior a la página, así la consulta recorre a lo sumo una página más un intervalo de corte.
+    Devuelve (page, movimientos) donde cada movimiento tiene el atributo `saldo`.
+    """
+    ids = cliente.movimientos.order_by('-id').values_list('id', flat=True)
+    pagina = Paginator(ids, por_pagina).get_page(numero_pagina)
+    ids_pagina = list(pagina.object_list)
+    if not ids_pagina:
+        return pagina, []
+
+    desde, hasta = ids_pagina[-1], ids_pagina[0]
+    corte = _corte_anterior(cliente.id, desde)
+    base = corte.saldo if corte else Decimal('0')
+
+    movimientos = MovimientoCuentaCliente.objects.filter(
+        cliente=cliente, id__gt=corte.hasta_movimiento_id if corte else 0, id__lte=hasta
+    ).annotate(
+        saldo_libro=Window(Sum('monto'), order_by=F('id').asc())
+    ).select_related('sucursal').order_by('-id')
+
+    filas = []
+    for movimiento in movimientos:
+        if movimiento.id < desde:
+            break
+        movimiento.saldo = base + movimiento.saldo_libro
+        filas.append(movimiento)
+    return pagina, filas
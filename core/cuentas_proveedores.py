@@ -0,0 +1,94 @@
+# core/cuentas_proveedores.py
+# Deuda con proveedores: saldo con F(), imputación de pagos a facturas (la más vieja primero)
+# y antigüedad de la deuda calculada en una sola consulta agrupada.
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import F, Q, Sum
+
+from . import listados
+from .models import Proveedor, FacturaProveedor, PagoProveedor
+from .fechas import hoy_local
+
+# (clave, título, días de atraso desde, hasta); None = sin límite
+TRAMOS_ANTIGUEDAD = [
+    ('corriente', 'Al día', None, 0),
+    ('d1_30', '1-30 días', 1, 30),
+    ('d31_60', '31-60 días', 31, 60),
+    ('d61_90', '61-90 días', 61, 90),
+    ('d90_mas', '+90 días', 91, None),
+]
+
+ORDEN_IMPUTACION = (F('fecha_vencimiento').asc(nulls_last=True), 'fecha_factura', 'id')
+
+
+def sumar_saldo(proveedor_id, monto):
+    # UPDATE ... SET saldo_actual = saldo_actual + monto: no se pisan pagos/facturas simultáneos
+    Proveedor.objects.filter(pk=proveedor_id).update(saldo_actual=F('saldo_actual') + monto)
+    # El listado cacheado muestra el saldo y el UPDATE no dispara post_save
+    listados.PROVEEDORES.invalidar()
+
+
+def imputar_a_facturas(proveedor_id, monto):
+    """
+    Descuenta `monto` de las facturas pendientes empezando por la que vence primero.
+    Devuelve lo que sobró (crédito a favor). Llamar dentro de una transacción.
+    """
+    restante = Decimal(monto)
+    facturas = FacturaProveedor.objects.select_for_update().filter(
+        proveedor_id=proveedor_id, pagada=False
+    ).order_by(*ORDEN_IMPUTACION)
+
+    modificadas = []
+    for factura in facturas.iterator():
+        if restante <= 0:
+            break
+        aplicado = min(restante, factura.monto_pendiente)
+        factura.monto_pendiente -= aplicado
+        factura.pagada = factura.monto_pendiente == 0
+        restante -= aplicado
+        modificadas.append(factura)
+
+    FacturaProveedor.objects.bulk_update(modificadas, ['monto_pendiente', 'pagada'])
+    return restante
+
+
+def credito_sin_imputar(proveedor_id):
+    """ Pagos que no se pudieron imputar (se pagó de más): pagado - (facturado - pendiente). """
+    facturas = FacturaProveedor.objects.filter(proveedor_id=proveedor_id).aggregate(
+        facturado=Sum('monto_total'), pendiente=Sum('monto_pendiente')
+    )
+    pagado = PagoProveedor.objects.filter(proveedor_id=proveedor_id).aggregate(total=Sum('monto'))['total'] or 0
+    return max(Decimal('0'), pagado - ((facturas['facturado'] or 0) - (facturas['pendiente'] or 0)))
+
+
+def antiguedad_deuda(sucursal=None, hoy=None):
+    """
+    Deuda pendiente por sucursal y proveedor, repartida en TRAMOS_ANTIGUEDAD según los días
+    de atraso respecto de fecha_vencimiento. Una sola consulta: GROUP BY con SUM(... FILTER ...).
+    Las facturas sin vencimiento cuentan como al día.
+    """
+    hoy = hoy or hoy_local()
+    tramos = {}
+    for clave, _, desde, hasta in TRAMOS_ANTIGUEDAD:
+        if desde is None:
+            condicion = Q(fecha_vencimiento__isnull=True) | Q(fecha_vencimiento__gte=hoy - timedelta(days=hasta))
+        else:
+            condicion = Q(fecha_vencimiento__lte=hoy - timedelta(days=desde))
+            if hasta is not None:
+                condicion &= Q(fecha_vencimiento__gte=hoy - timedelta(days=hasta))
+        tramos[clave] = Sum('monto_pendiente', filter=condicion)
+
+    facturas = FacturaProveedor.objects.filter(pagada=False)
+    if sucursal:
+        facturas = facturas.filter(sucursal=sucursal)
+
+    filas = list(
+        facturas.values('sucursal_id', 'sucursal__nombre', 'proveedor_id', 'proveedor__nombre').annotate(
+            total=Sum('monto_pendiente'), **tramos
+        ).order_by('sucursal__nombre', 'proveedor__nombre')
+    )
+    for fila in filas:
+        for clave in tramos:
+            fila[clave] = fila[clave] or Decimal('0')
+    return filas
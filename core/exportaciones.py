@@ -0,0 +1,167 @@
+# core/exportaciones.py
+# Exportaciones masivas (ventas, detalle, stock por lote y cuentas corrientes) en CSV o XLSX.
+# Las filas se leen de a bloques con .iterator() y se escriben a medida que llegan,
+# así la memoria no crece con el tamaño del período exportado.
+import csv
+import tempfile
+
+from django.http import StreamingHttpResponse, FileResponse
+from django.utils import timezone
+from openpyxl import Workbook
+
+from .models import Venta, DetalleVenta, Stock, MovimientoCuentaCliente
+from .fechas import ZONA_NEGOCIO
+
+TAMANO_BLOQUE = 2000
+
+
+def _fecha_local(valor):
+    # openpyxl no acepta datetimes con zona horaria: exportamos la hora del local "naive"
+    return timezone.localtime(valor, ZONA_NEGOCIO).replace(tzinfo=None) if valor else None
+
+
+# ==========================================================
+# DATASETS: cada uno devuelve (encabezado, generador de filas)
+# ==========================================================
+
+def filas_ventas(desde=None, hasta=None, sucursal=None):
+    ventas = Venta.objects.all()
+    if desde:
+        ventas = ventas.filter(fecha_hora__gte=desde)
+    if hasta:
+        ventas = ventas.filter(fecha_hora__lt=hasta)
+    if sucursal:
+        ventas = ventas.filter(sucursal=sucursal)
+
+    encabezado = ['ID', 'Fecha y Hora', 'Sucursal', 'Método de Pago', 'Cliente',
+                  'Subtotal', 'Descuento/Recargo', 'Total', 'Cuotas']
+    nombres_metodos = dict(Venta.METODO_PAGO_CHOICES)
+    filas = (
+        (id_, _fecha_local(fecha), sucursal_nombre, nombres_metodos.get(metodo, metodo), cliente or '',
+         subtotal, descuento_recargo, total, cuotas)
+        for id_, fecha, sucursal_nombre, metodo, cliente, subtotal, descuento_recargo, total, cuotas
+        in ventas.order_by('fecha_hora', 'id').values_list(
+            'id', 'fecha_hora', 'sucursal__nombre', 'metodo_pago', 'cliente__nombre_completo',
+            'subtotal', 'descuento_recargo', 'total', 'cuotas',
+        ).iterator(chunk_size=TAMANO_BLOQUE)
+    )
+    return encabezado, filas
+
+
+def filas_detalles(desde=None, hasta=None, sucursal=None):
+    detalles = DetalleVenta.objects.all()
+    if desde:
+        detalles = detalles.filter(venta__fecha_hora__gte=desde)
+    if hasta:
+        detalles = detalles.filter(venta__fecha_hora__lt=hasta)
+    if sucursal:
+        detalles = detalles.filter(venta__sucursal=sucursal)
+
+    encabezado = ['Venta', 'Fecha y Hora', 'Sucursal', 'Método de Pago', 'Producto ID', 'Producto',
+                  'Código de Barras', 'Cantidad', 'Precio Unitario', 'Subtotal']
+    nombres_metodos = dict(Venta.METODO_PAGO_CHOICES)
+    filas = (
+        (venta_id, _fecha_local(fecha), sucursal_nombre, nombres_metodos.get(metodo, metodo),
+         producto_id or '', producto or 'Devolución de envase', codigo or '', cantidad, precio, subtotal)
+        for venta_id, fecha, sucursal_nombre, metodo, producto_id, producto, codigo, cantidad, precio, subtotal
+        in detalles.order_by('venta__fecha_hora', 'venta_id', 'id').values_list(
+            'venta_id', 'venta__fecha_hora', 'venta__sucursal__nombre', 'venta__metodo_pago',
+            'producto_id', 'producto__nombre', 'producto__codigo_barras',
+            'cantidad', 'precio_unitario', 'subtotal',
+        ).iterator(chunk_size=TAMANO_BLOQUE)
+    )
+    return encabezado, filas
+
+
+def filas_stock(desde=None, hasta=None, sucursal=None):
+    # El stock es una foto del momento: el rango de fechas no aplica
+    lotes = Stock.objects.filter(cantidad__gt=0)
+    if sucursal:
+        lotes = lotes.filter(sucursal=sucursal)
+
+    encabezado = ['Lote', 'Sucursal', 'Producto ID', 'Producto', 'Código de Barras',
+                  'Ubicación', 'Vencimiento', 'Cantidad']
+    ubicaciones = dict(Stock.UBICACION_CHOICES)
+    filas = (
+        (id_, sucursal_nombre, producto_id, producto, codigo or '', ubicaciones.get(ubicacion, ubicacion),
+         vencimiento, cantidad)
+        for id_, sucursal_nombre, producto_id, producto, codigo, ubicacion, vencimiento, cantidad
+        in lotes.order_by('sucursal_id', 'producto__nombre', 'fecha_vencimiento', 'id').values_list(
+            'id', 'sucursal__nombre', 'producto_id', 'producto__nombre', 'producto__codigo_barras',
+            'ubicacion', 'fecha_vencimiento', 'cantidad',
+        ).iterator(chunk_size=TAMANO_BLOQUE)
+    )
+    return encabezado, filas
+
+
+def filas_cuentas_clientes(desde=None, hasta=None, sucursal=None):
+    """ Libro de cuentas corrientes (MovimientoCuentaCliente) agrupado por cliente. """
+    movimientos = MovimientoCuentaCliente.objects.all()
+    if desde:
+        movimientos = movimientos.filter(fecha__gte=desde)
+    if hasta:
+        movimientos = movimientos.filter(fecha__lt=hasta)
+    if sucursal:
+        movimientos = movimientos.filter(sucursal=sucursal)
+
+    encabezado = ['Cliente ID', 'Fecha', 'Cliente', 'DNI', 'Sucursal', 'Movimiento', 'Referencia', 'Debe', 'Haber']
+    tipos = dict(MovimientoCuentaCliente.TIPO_CHOICES)
+    filas = (
+        (cliente_id, _fecha_local(fecha), nombre, dni or '', suc or '', tipos.get(tipo, tipo),
+         f'Venta #{venta_id}' if venta_id else (f'Pago #{pago_id}' if pago_id else ''),
+         monto if monto > 0 else None, -monto if monto < 0 else None)
+        for cliente_id, fecha, nombre, dni, suc, tipo, venta_id, pago_id, monto
+        in movimientos.order_by('cliente_id', 'id').values_list(
+            'cliente_id', 'fecha', 'cliente__nombre_completo', 'cliente__dni', 'sucursal__nombre',
+            'tipo', 'venta_id', 'pago_id', 'monto',
+        ).iterator(chunk_size=TAMANO_BLOQUE)
+    )
+    return encabezado, filas
+
+
+DATASETS = {
+    'ventas': filas_ventas,
+    'detalles': filas_detalles,
+    'stock': filas_stock,
+    'cuentas_clientes': filas_cuentas_clientes,
+}
+
+
+# ==========================================================
+# FORMATOS
+# ==========================================================
+
+class _Eco:
+    """ 'Archivo' que devuelve lo que se le escribe, para que csv.writer produzca texto de a una línea. """
+    def write(self, valor):
+        return valor
+
+
+def respuesta_csv(nombre, encabezado, filas):
+    writer = csv.writer(_Eco())
+
+    def contenido():
+        yield '\ufeff'  # BOM: Excel abre bien los acentos
+        yield writer.writerow(encabezado)
+        for fila in filas:
+            yield writer.writerow(fila)
+
+    response = StreamingHttpResponse(contenido(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{nombre}.csv"'
+    return response
+
+
+def respuesta_xlsx(nombre, encabezado, filas):
+    # En modo write-only openpyxl vuelca cada fila a disco en vez de armar la hoja en memoria.
+    # El zip final se arma en un archivo temporal que después se envía por partes.
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet(title=nombre[:31])
+    hoja.append(encabezado)
+    for fila in filas:
+        hoja.append(fila)
+
+    archivo = tempfile.TemporaryFile()
+    libro.save(archivo)
+    archivo.seek(0)
+    return FileResponse(archivo, as_attachment=True, filename=f'{nombre}.xlsx',
+                        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
@@ -0,0 +1,59 @@
+# core/fechas.py
+# Días "del negocio". La base guarda en UTC (TIME_ZONE='UTC'), pero una venta de las 22 hs
+# en Argentina es de ese día, no del siguiente. Para filtrar por día convertimos los días
+# locales en rangos semiabiertos [inicio, fin) en UTC y comparamos fecha_hora directamente:
+# nada de fecha_hora__date, que envuelve la columna en una función y no usa los índices.
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+ZONA_NEGOCIO = ZoneInfo(getattr(settings, 'ZONA_HORARIA_NEGOCIO', 'America/Argentina/Buenos_Aires'))
+
+
+def hoy_local():
+    """ Fecha de hoy en el local. """
+    return timezone.localdate(timezone=ZONA_NEGOCIO)
+
+
+def dia_local(fecha_hora):
+    """ Día local al que pertenece un datetime aware (p. ej. Venta.fecha_hora). """
+    return timezone.localdate(fecha_hora, timezone=ZONA_NEGOCIO)
+
+
+def inicio_dia(dia):
+    """ Primer instante del día local `dia` (datetime aware; Django lo pasa a UTC al consultar). """
+    return datetime.combine(dia, time.min, tzinfo=ZONA_NEGOCIO)
+
+
+def rango_dias(desde=None, hasta=None):
+    """ (inicio, fin) semiabierto que cubre los días locales desde..hasta inclusive. None = sin límite. """
+    inicio = inicio_dia(desde) if desde else None
+    fin = inicio_dia(hasta + timedelta(days=1)) if hasta else None
+    return inicio, fin
+
+
+def filtro_dias(campo, desde=None, hasta=None):
+    """
+    Kwargs para .filter() con los días locales desde..hasta inclusive:
+    filtro_dias('fecha_hora', hoy, hoy) -> {'fecha_hora__gte': 00:00 local, 'fecha_hora__lt': 00:00 de mañana}
+    """
+    inicio, fin = rango_dias(desde, hasta)
+    filtro = {}
+    if inicio:
+        filtro[f'{campo}__gte'] = inicio
+    if fin:
+        filtro[f'{campo}__lt'] = fin
+    return filtro
+
+
+def parsear_dia(texto):
+    """ 'AAAA-MM-DD' -> date. Lanza ValueError si el formato no es válido. """
+    return datetime.strptime(texto, '%Y-%m-%d').date()
+
+
+def dia_truncado(campo):
+    """ TruncDate en la zona del negocio, para agrupar ventas por día local. """
+    return TruncDate(campo, tzinfo=ZONA_NEGOCIO)
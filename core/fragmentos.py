@@ -0,0 +1,53 @@
+# core/fragmentos.py
+# Versión de los datos que muestran los widgets del dashboard y de stock_detalle, para cachear
+# esos pedazos del template con {% cache %}. La clave de cada fragmento lleva la versión de su
+# sucursal (o la de "todas" en las vistas globales), la del catálogo y el día: mientras nadie
+# toque Stock, Venta o Producto el HTML sale del cache y la vista ni siquiera hace las consultas.
+# Al guardar o borrar, las señales cambian la versión y el próximo pedido vuelve a calcular.
+# Los UPDATE por queryset no disparan señales: quien los haga llama a invalidar() a mano
+# (ver inventario.descontar_fefo).
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import cache_compartido
+from .models import Producto, Stock, Sucursal, Venta
+
+TODAS = 'todas'
+CATALOGO = 'productos'
+
+
+def _version(ambito):
+    return f'fragmentos:{ambito}'
+
+
+def version(sucursal, hoy):
+    """ Texto para la clave de {% cache %}: cambia cuando cambian los datos de `sucursal` (None = todas) o el día. """
+    ambito = sucursal.id if sucursal else TODAS
+    valores = cache_compartido.versiones(_version(ambito), _version(CATALOGO))
+    return f"{ambito}:{valores[_version(ambito)]}:{valores[_version(CATALOGO)]}:{hoy:%Y%m%d}"
+
+
+def invalidar(*ambitos):
+    """ Cambia la versión de los ámbitos (ids de sucursal, TODAS o CATALOGO) al confirmarse la transacción. """
+    cache_compartido.invalidar(*(_version(ambito) for ambito in ambitos))
+
+
+@receiver(post_save, sender=Stock)
+@receiver(post_delete, sender=Stock)
+@receiver(post_save, sender=Venta)
+@receiver(post_delete, sender=Venta)
+def invalidar_sucursal(sender, instance, **kwargs):
+    invalidar(instance.sucursal_id, TODAS)
+
+
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+def invalidar_catalogo(sender, **kwargs):
+    invalidar(CATALOGO)
+
+
+@receiver(post_save, sender=Sucursal)
+@receiver(post_delete, sender=Sucursal)
+def invalidar_resumen_global(sender, **kwargs):
+    # El resumen del superusuario muestra el nombre de cada sucursal
+    invalidar(TODAS)
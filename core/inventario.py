@@ -0,0 +1,88 @@
+# core/inventario.py
+# Descuento de stock FEFO (primero vence, primero sale) seguro con varias cajas a la vez.
+# En vez de leer el lote, restar en Python y hacer save() (dos cajas leen 5, las dos guardan 4
+# y se vendió una unidad de más), cada descuento es un UPDATE condicional:
+#     UPDATE stock SET cantidad = cantidad - n WHERE id = ... AND cantidad >= n
+# Si otra caja se llevó parte del lote entre la lectura y el UPDATE, no se actualiza ninguna fila:
+# releemos lo que quedó y reintentamos. La cantidad nunca puede quedar negativa ni venderse dos veces.
+import random
+import threading
+import time
+from collections import Counter
+
+from django.db import OperationalError, transaction
+from django.db.models import F
+
+from . import fragmentos, metricas
+from .models import Stock
+
+INTENTOS_TRANSACCION = 5
+
+_lock = threading.Lock()
+_contadores = Counter()
+
+
+def contar(clave, cantidad=1):
+    with _lock:
+        _contadores[clave] += cantidad
+    metricas.reintentos.inc(cantidad, tipo=clave)
+
+
+def contadores():
+    """ Copia de los contadores de contención del proceso (reintentos por lote y por transacción). """
+    with _lock:
+        return dict(_contadores)
+
+
+class StockInsuficiente(Exception):
+    pass
+
+
+def descontar_fefo(producto, sucursal, cantidad, ubicacion='gondola'):
+    """
+    Descuenta `cantidad` unidades de los lotes de `producto` en `sucursal`/`ubicacion`, empezando
+    por el que vence primero. Llamar dentro de una transacción: si no alcanza el stock lanza
+    StockInsuficiente y la transacción deshace lo que ya se había descontado.
+    """
+    with metricas.fefo_segundos.medir():
+        lotes = Stock.objects.filter(
+            producto=producto, sucursal=sucursal, ubicacion=ubicacion, cantidad__gt=0
+        ).order_by('fecha_vencimiento', 'id').values_list('id', 'cantidad')
+
+        restante = cantidad
+        for lote_id, disponible in lotes:
+            while restante and disponible > 0:
+                tomar = min(disponible, restante)
+                if Stock.objects.filter(pk=lote_id, cantidad__gte=tomar).update(cantidad=F('cantidad') - tomar):
+                    restante -= tomar
+                    break
+                # Otra venta tocó el lote desde que lo leímos: vemos cuánto quedó y volvemos a intentar
+                contar('reintentos_lote')
+                disponible = Stock.objects.filter(pk=lote_id).values_list('cantidad', flat=True).first() or 0
+            if not restante:
+                break
+
+        if restante:
+            raise StockInsuficiente(
+                f"Stock insuficiente en esta sucursal para {producto.nombre} "
+                f"(necesitas {cantidad}, disponibles {cantidad - restante})"
+            )
+        # El UPDATE con F() no dispara post_save: los widgets de la sucursal se invalidan a mano
+        fragmentos.invalidar(getattr(sucursal, 'pk', sucursal), fragmentos.TODAS)
+
+
+def en_transaccion_con_reintentos(funcion, intentos=INTENTOS_TRANSACCION):
+    """
+    Corre `funcion()` dentro de transaction.atomic() y la repite entera si la base la rechaza por
+    contención ("database is locked" en SQLite, deadlock/serialización en PostgreSQL).
+    """
+    for intento in range(1, intentos + 1):
+        try:
+            with transaction.atomic():
+                return funcion()
+        except OperationalError:
+            if intento == intentos or transaction.get_connection().in_atomic_block:
+                # Dentro de otra transacción no podemos reintentar solo nuestra parte
+                raise
+            contar('reintentos_transaccion')
+            time.sleep(random.uniform(0.01, 0.05) * intento)
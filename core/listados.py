@@ -0,0 +1,45 @@
+# core/listados.py
+# Listados chicos que se leen mucho y cambian poco (proveedores, categorías, envases), guardados
+# en el cache compartido entre workers. Guardar o borrar una fila invalida su listado; los UPDATE
+# por queryset no disparan señales y se invalidan a mano (ver cuentas_proveedores.sumar_saldo).
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .cache_compartido import Espacio
+from .models import Proveedor, Categoria, EnvaseRetornable
+
+SEGUNDOS_CACHE = 3600
+
+PROVEEDORES = Espacio('proveedores', SEGUNDOS_CACHE)
+CATEGORIAS = Espacio('categorias', SEGUNDOS_CACHE)
+ENVASES = Espacio('envases', SEGUNDOS_CACHE)
+
+
+def proveedores():
+    return PROVEEDORES.obtener(('listado',), lambda: list(Proveedor.objects.order_by('nombre')))
+
+
+def categorias():
+    return CATEGORIAS.obtener(('listado',), lambda: list(Categoria.objects.order_by('nombre')))
+
+
+def envases():
+    return ENVASES.obtener(('listado',), lambda: list(EnvaseRetornable.objects.order_by('nombre')))
+
+
+@receiver(post_save, sender=Proveedor)
+@receiver(post_delete, sender=Proveedor)
+def invalidar_proveedores(sender, **kwargs):
+    PROVEEDORES.invalidar()
+
+
+@receiver(post_save, sender=Categoria)
+@receiver(post_delete, sender=Categoria)
+def invalidar_categorias(sender, **kwargs):
+    CATEGORIAS.invalidar()
+
+
+@receiver(post_save, sender=EnvaseRetornable)
+@receiver(post_delete, sender=EnvaseRetornable)
+def invalidar_envases(sender, **kwargs):
+    ENVASES.invalidar()
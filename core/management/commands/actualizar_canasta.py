@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+from core.canasta import actualizar_canasta, TAMANO_LOTE, SEGUNDOS_MARGEN
+from core.models import MarcaCanasta
+
+
+class Command(BaseCommand):
+    help = ('Vuelca en los contadores de canasta las ventas posteriores a la marca de agua (Venta.id). '
+            'Correrlo cada pocos minutos (cron) y después de cargar historial.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE, help='Ventas por transacción.')
+        parser.add_argument('--margen', type=int, default=SEGUNDOS_MARGEN,
+                            help='Segundos de antigüedad mínima de una venta para volcarla (ventas aún sin confirmar).')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        procesadas = actualizar_canasta(lote=options['lote'], segundos_margen=options['margen'])
+        marca = MarcaCanasta.objects.get(pk=1).ultima_venta_id
+
+        self.stdout.write(self.style.SUCCESS(
+            f"¡Listo! Se procesaron {procesadas} ventas en {time.perf_counter() - inicio:.1f}s. "
+            f"Marca de agua: Venta #{marca}."
+        ))
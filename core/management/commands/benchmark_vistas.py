@@ -0,0 +1,202 @@
+import io
+import json
+import time
+import tracemalloc
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from core import metricas
+from core.cache_compartido import CACHE_AISLADO
+from core.models import PerfilUsuario, Producto, Stock, Sucursal
+
+# Parámetros del dataset por defecto: chico para correr en segundos, grande para que se noten los N+1
+DATASET_POR_DEFECTO = {
+    'sucursales': 2, 'productos': 1000, 'dias': 90, 'ventas_dia': 60, 'clientes': 100, 'semilla': 42,
+}
+
+
+class Command(BaseCommand):
+    help = ('Mide las vistas más usadas (p50/p95, consultas y pico de memoria) sobre una base de prueba '
+            'temporal con datos generados. Compara contra una base guardada y falla si hay regresiones.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeticiones', type=int, default=20, help='Mediciones por vista.')
+        parser.add_argument('--calentamiento', type=int, default=2, help='Llamadas previas que no se miden.')
+        parser.add_argument('--salida', help='Archivo JSON donde guardar el resultado (por defecto, stdout).')
+        parser.add_argument('--base', help='Resultado anterior (JSON) contra el que comparar.')
+        parser.add_argument('--tolerancia', type=float, default=0.25,
+                            help='Empeoramiento relativo permitido en p95 y memoria (0.25 = 25%%).')
+        parser.add_argument('--margen-ms', type=float, default=2.0,
+                            help='Diferencias de p95 menores a esto no cuentan como regresión (ruido).')
+        parser.add_argument('--keepdb', action='store_true', help='Reusar la base de prueba (y sus datos) si ya existe.')
+        for clave, valor in DATASET_POR_DEFECTO.items():
+            parser.add_argument(f"--{clave.replace('_', '-')}", type=type(valor), default=valor,
+                                help=f'Dataset: {clave} para generar_datos_prueba.')
+
+    def handle(self, *args, **options):
+        if options['repeticiones'] < 2:
+            raise CommandError('--repeticiones tiene que ser al menos 2.')
+        base = self.leer_base(options['base']) if options['base'] else None
+
+        # Base temporal, como en los tests: nunca se tocan los datos reales (ni el cache compartido ni las métricas)
+        with metricas.aisladas():
+            setup_test_environment()
+            cache_aislado = override_settings(CACHES=CACHE_AISLADO)
+            cache_aislado.enable()
+            nombre_original = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+            try:
+                dataset = {clave: options[clave] for clave in DATASET_POR_DEFECTO}
+                if not options['keepdb'] or not Producto.objects.exists():
+                    self.stderr.write(f"Generando dataset {dataset}...")
+                    call_command('generar_datos_prueba', stdout=io.StringIO(), **dataset)
+                resultado = {
+                    'fecha': timezone.now().isoformat(timespec='seconds'),
+                    'motor': connection.vendor,
+                    'dataset': dataset,
+                    'repeticiones': options['repeticiones'],
+                    'vistas': self.medir_vistas(options),
+                }
+            finally:
+                connection.creation.destroy_test_db(nombre_original, verbosity=0, keepdb=options['keepdb'])
+                cache_aislado.disable()
+                teardown_test_environment()
+
+        salida = json.dumps(resultado, indent=2, ensure_ascii=False)
+        if options['salida']:
+            with open(options['salida'], 'w', encoding='utf-8') as archivo:
+                archivo.write(salida + '\n')
+            self.stderr.write(f"Resultado guardado en {options['salida']}.")
+        else:
+            self.stdout.write(salida)
+
+        self.informar(resultado['vistas'])
+        if base:
+            regresiones = self.comparar(base, resultado, options)
+            if regresiones:
+                raise CommandError(f"{len(regresiones)} regresiones contra {options['base']}:\n" + '\n'.join(regresiones))
+            self.stderr.write(self.style.SUCCESS(f"Sin regresiones contra {options['base']}."))
+
+    def leer_base(self, ruta):
+        try:
+            with open(ruta, encoding='utf-8') as archivo:
+                return json.load(archivo)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"No se pudo leer la base {ruta}: {e}")
+
+    # ==========================================================
+    # ESCENARIOS
+    # ==========================================================
+
+    def escenarios(self):
+        """ (nombre, método, url, kwargs) de cada vista; los kwargs pueden depender del número de llamada. """
+        sucursal = Sucursal.objects.order_by('id').first()
+        productos = list(Producto.objects.order_by('id').values_list('id', 'nombre', 'codigo_barras', 'precio_venta')[:200])
+        if not sucursal or not productos:
+            raise CommandError('El dataset no tiene sucursales o productos.')
+
+        # Un lote enorme en góndola para que registrar_venta nunca se quede sin stock durante la medición
+        producto_id, _, _, precio = productos[0]
+        Stock.objects.create(producto_id=producto_id, sucursal=sucursal, ubicacion='gondola', cantidad=10**7)
+        venta = json.dumps({'carrito': [{'id': producto_id, 'cantidad': 1, 'precio': str(precio)}],
+                            'metodo_pago': 'efectivo'})
+        terminos = [nombre.split()[-1][-3:] for _, nombre, _, _ in productos[:50]]
+        codigos = [codigo for _, _, codigo, _ in productos if codigo] or ['inexistente']
+
+        return [
+            ('dashboard', 'get', reverse('dashboard'), lambda i: {}),
+            ('stock_detalle', 'get', reverse('stock_detalle'), lambda i: {}),
+            ('registrar_venta', 'post', reverse('registrar_venta'),
+             lambda i: {'data': venta, 'content_type': 'application/json'}),
+            ('buscar_productos', 'get', reverse('buscar_productos'),
+             lambda i: {'data': {'term': terminos[i % len(terminos)]}}),
+            ('buscar_por_codigo', 'get', reverse('buscar_por_codigo'),
+             lambda i: {'data': {'codigo': codigos[i % len(codigos)]}}),
+            ('reportes_dashboard', 'get', reverse('reportes_dashboard'), lambda i: {}),
+            ('cerrar_turno', 'get', reverse('cerrar_turno'), lambda i: {}),
+        ], sucursal
+
+    def medir_vistas(self, options):
+        escenarios, sucursal = self.escenarios()
+        usuario = User.objects.create_user('benchmark', password='benchmark')
+        PerfilUsuario.objects.create(usuario=usuario, sucursal=sucursal)
+        cliente = Client()
+        cliente.force_login(usuario)
+
+        # El middleware de presupuesto SQL sigue midiendo (es parte del costo real), pero sin volcar
+        # estadísticas ni loguear EXPLAIN: agregarían consultas y demoras al azar a la medición
+        sin_limite = float('inf')
+        presupuesto = {**getattr(settings, 'PRESUPUESTO_SQL', {}),
+                       'CONSULTAS': sin_limite, 'MILISEGUNDOS': sin_limite, 'VOLCAR_CADA': sin_limite}
+        resultados = {}
+        with override_settings(PRESUPUESTO_SQL=presupuesto):
+            for nombre, metodo, url, argumentos in escenarios:
+                llamar = getattr(cliente, metodo)
+                for i in range(options['calentamiento']):
+                    self.verificar(nombre, llamar(url, **argumentos(i)))
+
+                tiempos = []
+                for i in range(options['repeticiones']):
+                    kwargs = argumentos(i)
+                    inicio = time.perf_counter()
+                    respuesta = llamar(url, **kwargs)
+                    tiempos.append((time.perf_counter() - inicio) * 1000)
+                    self.verificar(nombre, respuesta)
+
+                # Consultas y memoria en una llamada aparte: tracemalloc y la captura de SQL agregan demora
+                tracemalloc.start()
+                try:
+                    with CaptureQueriesContext(connection) as consultas:
+                        llamar(url, **argumentos(0))
+                    _, pico = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+
+                resultados[nombre] = {
+                    'p50_ms': round(float(np.percentile(tiempos, 50)), 2),
+                    'p95_ms': round(float(np.percentile(tiempos, 95)), 2),
+                    'consultas': len(consultas),
+                    'memoria_pico_kb': round(pico / 1024, 1),
+                }
+        return resultados
+
+    def verificar(self, nombre, respuesta):
+        if respuesta.status_code >= 400:
+            raise CommandError(f"{nombre} respondió {respuesta.status_code}: la medición no sería válida.")
+
+    # ==========================================================
+    # INFORME Y COMPARACIÓN
+    # ==========================================================
+
+    def informar(self, vistas):
+        self.stderr.write(f"{'Vista':<22}{'p50 ms':>10}{'p95 ms':>10}{'consultas':>11}{'memoria KB':>12}")
+        for nombre, r in vistas.items():
+            self.stderr.write(f"{nombre:<22}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['consultas']:>11}{r['memoria_pico_kb']:>12}")
+
+    def comparar(self, base, actual, options):
+        """ Lista de regresiones (texto) de las vistas presentes en ambos resultados. """
+        if base.get('dataset') != actual['dataset'] or base.get('motor') != actual['motor']:
+            self.stderr.write(self.style.WARNING("La base se midió con otro dataset o motor: la comparación es orientativa."))
+
+        tolerancia = 1 + options['tolerancia']
+        regresiones = []
+        for nombre, r in actual['vistas'].items():
+            anterior = base.get('vistas', {}).get(nombre)
+            if not anterior:
+                continue
+            if r['consultas'] > anterior['consultas']:
+                regresiones.append(f"  {nombre}: {anterior['consultas']} -> {r['consultas']} consultas")
+            if r['p95_ms'] > anterior['p95_ms'] * tolerancia and r['p95_ms'] - anterior['p95_ms'] > options['margen_ms']:
+                regresiones.append(f"  {nombre}: p95 {anterior['p95_ms']} -> {r['p95_ms']} ms")
+            if r['memoria_pico_kb'] > anterior['memoria_pico_kb'] * tolerancia:
+                regresiones.append(f"  {nombre}: memoria {anterior['memoria_pico_kb']} -> {r['memoria_pico_kb']} KB")
+        return regresiones
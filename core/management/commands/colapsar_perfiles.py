@@ -0,0 +1,37 @@
+import glob
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.middleware import colapsar, perfilador
+
+
+class Command(BaseCommand):
+    help = ('Arma el .folded (pilas colapsadas para flamegraph.pl o speedscope) de los perfiles .prof '
+            'que guardó el perfilador. Sin argumentos procesa los de PERFILADOR["DIRECTORIO"] que todavía no lo tienen.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('perfiles', nargs='*', help='Archivos .prof (por defecto, los pendientes del directorio).')
+        parser.add_argument('--profundidad', type=int, help='Tope de frames por pila.')
+        parser.add_argument('--pilas', type=int, help='Tope de líneas del .folded.')
+
+    def handle(self, *args, **options):
+        config = perfilador()
+        for clave in ('profundidad', 'pilas'):
+            if options[clave]:
+                config[clave.upper()] = options[clave]
+
+        perfiles = options['perfiles'] or [
+            ruta for ruta in sorted(glob.glob(os.path.join(config['DIRECTORIO'], '*.prof')))
+            if not os.path.exists(os.path.splitext(ruta)[0] + '.folded')
+        ]
+        if not perfiles:
+            self.stdout.write("No hay perfiles pendientes.")
+            return
+
+        for ruta_prof in perfiles:
+            inicio = time.perf_counter()
+            ruta, cantidad = colapsar(ruta_prof, config)
+            self.stdout.write(f"  {os.path.basename(ruta)}: {cantidad} pilas en {time.perf_counter() - inicio:.2f}s")
+        self.stdout.write(self.style.SUCCESS(f"¡Listo! {len(perfiles)} perfiles colapsados."))
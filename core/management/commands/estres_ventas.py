@@ -0,0 +1,215 @@
+import json
+import logging
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Sum
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from core import inventario, turnos
+from core import metricas
+from core.cache_compartido import CACHE_AISLADO
+from core.fechas import hoy_local
+from core.models import PerfilUsuario, Producto, Stock, Sucursal, Venta, DetalleVenta, TurnoAbierto
+
+
+def _cajero(numero, ventas, productos, items_max, semilla):
+    """
+    Una caja: registra `ventas` carritos al azar por la vista real (Client + middleware + registrar_venta).
+    Devuelve los resultados y cuántos reintentos hizo este hilo/proceso.
+    """
+    rng = random.Random(semilla * 1000 + numero)
+    cliente = Client()
+    cliente.force_login(User.objects.get(username='estres'))
+    antes = inventario.contadores()
+    resultado = {'ok': 0, 'sin_stock': 0, 'errores': [], 'latencias': [], 'vendido': {}}
+    try:
+        for _ in range(ventas):
+            elegidos = rng.sample(productos, k=rng.randint(1, min(items_max, len(productos))))
+            carrito = [{'id': p['id'], 'cantidad': rng.randint(1, 3), 'precio': p['precio']} for p in elegidos]
+            inicio = time.perf_counter()
+            respuesta = cliente.post(reverse('registrar_venta'), data=json.dumps({'carrito': carrito, 'metodo_pago': 'efectivo'}),
+                                     content_type='application/json')
+            resultado['latencias'].append((time.perf_counter() - inicio) * 1000)
+            cuerpo = respuesta.json()
+            if respuesta.status_code == 200 and cuerpo.get('success'):
+                resultado['ok'] += 1
+                for item in carrito:
+                    resultado['vendido'][item['id']] = resultado['vendido'].get(item['id'], 0) + item['cantidad']
+            elif 'Stock insuficiente' in cuerpo.get('error', ''):
+                resultado['sin_stock'] += 1
+            else:
+                resultado['errores'].append(cuerpo.get('error', str(respuesta.status_code)))
+    finally:
+        connection.close()
+    despues = inventario.contadores()
+    resultado['reintentos'] = {k: despues.get(k, 0) - antes.get(k, 0) for k in despues}
+    return resultado
+
+
+def _cajero_proceso(argumentos):
+    # En el proceso hijo: conexiones propias (las heredadas del padre no se comparten)
+    connections.close_all()
+    return _cajero(*argumentos)
+
+
+class Command(BaseCommand):
+    help = ('Prueba de estrés del cobro: N cajas (hilos o procesos) venden a la vez los mismos productos '
+            'sobre una base de prueba compartida. Mide ventas/segundo, latencia y reintentos por contención, '
+            'y verifica que ningún lote quede negativo ni se venda dos veces la misma unidad.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cajas', type=int, default=8, help='Cajas vendiendo en paralelo.')
+        parser.add_argument('--procesos', action='store_true', help='Una caja por proceso en lugar de por hilo.')
+        parser.add_argument('--ventas', type=int, default=50, help='Ventas que intenta cada caja.')
+        parser.add_argument('--productos', type=int, default=5, help='Productos "calientes" que se disputan las cajas.')
+        parser.add_argument('--lotes', type=int, default=3, help='Lotes en góndola por producto.')
+        parser.add_argument('--stock-lote', type=int, default=40, help='Unidades por lote (poco stock = más contención).')
+        parser.add_argument('--items-max', type=int, default=3, help='Productos distintos por carrito.')
+        parser.add_argument('--semilla', type=int, default=1)
+
+    def handle(self, *args, **options):
+        if options['procesos'] and 'fork' not in multiprocessing.get_all_start_methods():
+            raise CommandError('--procesos necesita fork (Linux/macOS).')
+
+        # Base de prueba compartida entre cajas: en SQLite un archivo (la de memoria no se comparte bien).
+        # El cache compartido y las métricas de la app no se tocan: cache en memoria, métricas en un temporal
+        with metricas.aisladas():
+            setup_test_environment()
+            cache_aislado = override_settings(CACHES=CACHE_AISLADO)
+            cache_aislado.enable()
+            nombre_original = connection.settings_dict['NAME']
+            if connection.vendor == 'sqlite':
+                archivo = os.path.join(tempfile.gettempdir(), f'estres_ventas_{os.getpid()}.sqlite3')
+                connection.settings_dict.setdefault('TEST', {})['NAME'] = archivo
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                sucursal, productos, inicial = self.preparar(options)
+                resultados, segundos = self.correr(options, productos)
+                self.informar(options, resultados, segundos)
+                self.verificar(sucursal, productos, inicial, resultados)
+            finally:
+                connections.close_all()
+                connection.creation.destroy_test_db(nombre_original, verbosity=0)
+                cache_aislado.disable()
+                teardown_test_environment()
+
+    def preparar(self, options):
+        sucursal = Sucursal.objects.create(nombre='Sucursal Estrés')
+        usuario = User.objects.create_user('estres', password='estres')
+        PerfilUsuario.objects.create(usuario=usuario, sucursal=sucursal)
+        turnos.obtener_turno(sucursal.id)
+
+        hoy = hoy_local()
+        productos = []
+        for i in range(options['productos']):
+            producto = Producto.objects.create(nombre=f'Producto Estrés {i + 1}', codigo_barras=f'EST{i + 1:06d}',
+                                               costo=Decimal('50'), precio_venta=Decimal('100'))
+            Stock.objects.bulk_create([
+                Stock(producto=producto, sucursal=sucursal, ubicacion='gondola', cantidad=options['stock_lote'],
+                      fecha_vencimiento=hoy + timedelta(days=10 * (lote + 1)))
+                for lote in range(options['lotes'])
+            ])
+            productos.append({'id': producto.id, 'precio': '100'})
+        inicial = options['productos'] * options['lotes'] * options['stock_lote']
+        return sucursal, productos, inicial
+
+    def correr(self, options, productos):
+        argumentos = [(n, options['ventas'], productos, options['items_max'], options['semilla'])
+                      for n in range(options['cajas'])]
+        # Las ventas rechazadas por falta de stock responden 500 y las esperas de lock pasan el
+        # presupuesto SQL: ninguna de las dos cosas es un error acá, no las queremos en la consola
+        loggers = [logging.getLogger(nombre) for nombre in ('django.request', 'core.presupuesto_sql')]
+        niveles = [logger.level for logger in loggers]
+        for logger in loggers:
+            logger.setLevel(logging.CRITICAL)
+        try:
+            return self._correr(options, argumentos)
+        finally:
+            for logger, nivel in zip(loggers, niveles):
+                logger.setLevel(nivel)
+
+    def _correr(self, options, argumentos):
+        inicio = time.perf_counter()
+        if options['procesos']:
+            connections.close_all()
+            with multiprocessing.get_context('fork').Pool(options['cajas']) as pool:
+                resultados = pool.map(_cajero_proceso, argumentos)
+        else:
+            resultados = [None] * options['cajas']
+
+            def correr_hilo(n):
+                resultados[n] = _cajero(*argumentos[n])
+
+            hilos = [threading.Thread(target=correr_hilo, args=(n,)) for n in range(options['cajas'])]
+            for hilo in hilos:
+                hilo.start()
+            for hilo in hilos:
+                hilo.join()
+        return resultados, time.perf_counter() - inicio
+
+    def informar(self, options, resultados, segundos):
+        ok = sum(r['ok'] for r in resultados)
+        sin_stock = sum(r['sin_stock'] for r in resultados)
+        errores = [e for r in resultados for e in r['errores']]
+        latencias = [l for r in resultados for l in r['latencias']]
+        reintentos = {}
+        for r in resultados:
+            for clave, valor in r['reintentos'].items():
+                reintentos[clave] = reintentos.get(clave, 0) + valor
+
+        modo = 'procesos' if options['procesos'] else 'hilos'
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{options['cajas']} cajas ({modo}) x {options['ventas']} ventas sobre {connection.vendor}"
+        ))
+        self.stdout.write(f"  Ventas confirmadas: {ok}  |  rechazadas por falta de stock: {sin_stock}  |  errores: {len(errores)}")
+        self.stdout.write(f"  Rendimiento: {ok / segundos:.1f} ventas/s ({segundos:.2f}s en total)")
+        if latencias:
+            self.stdout.write(f"  Latencia: p50 {np.percentile(latencias, 50):.1f} ms, p95 {np.percentile(latencias, 95):.1f} ms, "
+                              f"máx {max(latencias):.1f} ms")
+        self.stdout.write(f"  Reintentos: {reintentos.get('reintentos_lote', 0)} por lote tocado por otra caja, "
+                          f"{reintentos.get('reintentos_transaccion', 0)} de transacción por bloqueo")
+        for error in sorted(set(errores))[:10]:
+            self.stdout.write(self.style.WARNING(f"  Error: {error}"))
+
+    def verificar(self, sucursal, productos, inicial, resultados):
+        """ Conservación: stock inicial = stock final + vendido, sin lotes negativos ni ventas fantasma. """
+        fallas = []
+        ids = [p['id'] for p in productos]
+        if Stock.objects.filter(producto_id__in=ids, cantidad__lt=0).exists():
+            fallas.append("Hay lotes con cantidad negativa.")
+
+        final = Stock.objects.filter(producto_id__in=ids).aggregate(total=Sum('cantidad'))['total'] or 0
+        vendido_db = DetalleVenta.objects.filter(producto_id__in=ids).aggregate(total=Sum('cantidad'))['total'] or 0
+        vendido_cajas = sum(c for r in resultados for c in r['vendido'].values())
+        if inicial - final != vendido_db:
+            fallas.append(f"Stock descontado ({inicial - final}) distinto de lo vendido en DetalleVenta ({vendido_db}).")
+        if vendido_db != vendido_cajas:
+            fallas.append(f"DetalleVenta ({vendido_db}) no coincide con lo que confirmaron las cajas ({vendido_cajas}).")
+
+        ventas_ok = sum(r['ok'] for r in resultados)
+        if Venta.objects.filter(sucursal=sucursal).count() != ventas_ok:
+            fallas.append("La cantidad de ventas guardadas no coincide con las confirmadas.")
+
+        turno = TurnoAbierto.objects.get(sucursal=sucursal)
+        recalculado = turnos.totales_desde(sucursal.id, turno.fecha_inicio)['total_ventas_efectivo']
+        if turno.total_ventas_efectivo != recalculado:
+            fallas.append(f"Acumulado del turno ({turno.total_ventas_efectivo}) distinto del recalculado ({recalculado}).")
+
+        if fallas:
+            raise CommandError("Fallaron las verificaciones de conservación:\n  " + "\n  ".join(fallas))
+        self.stdout.write(self.style.SUCCESS(
+            f"¡Conservación OK! {inicial} unidades iniciales = {final} en góndola + {vendido_db} vendidas."
+        ))
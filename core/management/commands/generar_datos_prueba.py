@@ -1,79 +1,305 @@
+import math
 import random
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
 from datetime import timedelta
-from django.core.management.base import BaseCommand
-from django.utils import timezone
-from core.models import Producto, Venta, DetalleVenta, Sucursal, Cliente
 from decimal import Decimal
+from itertools import accumulate
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from core.fechas import hoy_local, inicio_dia
+from core.models import (
+    Producto, Categoria, Proveedor, Venta, DetalleVenta, Sucursal, Stock, Cliente, PagoCliente,
+    MovimientoCuentaCliente
+)
+
+# Peso de cada método de pago en las ventas sin cliente (la cuenta corriente va aparte, con --fiado)
+METODOS_PAGO = [('efectivo', 45), ('debito', 22), ('credito', 10), ('qr', 23)]
+# Variación por día de la semana (lunes..domingo) que se escala con --estacionalidad
+PESO_SEMANA = [-0.6, -0.5, -0.3, 0.0, 0.5, 1.0, -0.1]
+HORA_APERTURA, HORA_CIERRE = 8, 22
+
+
+@contextmanager
+def sin_auto_now_add(modelo, campo):
+    """ Apaga auto_now_add mientras dura el bloque, para poder escribir fechas históricas con bulk_create. """
+    field = modelo._meta.get_field(campo)
+    anterior = field.auto_now_add
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = anterior
+
 
 class Command(BaseCommand):
-    help = 'Genera ventas ficticias para los últimos 30 días para probar gráficos e IA'
+    help = ('Genera un historial de ventas ficticio (varias sucursales, catálogo, lotes de stock, clientes '
+            'con cuenta corriente y pagos) para probar gráficos, IA y rendimiento. '
+            'Ej.: generar_datos_prueba --sucursales 5 --productos 5000 --dias 365 --ventas-dia 300')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sucursales', type=int, default=1, help='Sucursales a usar (se crean las que falten).')
+        parser.add_argument('--productos', type=int, default=0,
+                            help='Tamaño del catálogo; se crean productos de prueba si hay menos. 0 = usar los existentes.')
+        parser.add_argument('--dias', type=int, default=30, help='Días de historia hasta hoy.')
+        parser.add_argument('--ventas-dia', type=float, default=3, help='Ventas promedio por sucursal y día.')
+        parser.add_argument('--items-promedio', type=float, default=2.5,
+                            help='Productos distintos promedio por venta (distribución geométrica).')
+        parser.add_argument('--items-max', type=int, default=15, help='Tope de productos distintos por venta.')
+        parser.add_argument('--estacionalidad', type=float, default=0.3,
+                            help='Amplitud de la variación semanal y anual (0 = ventas parejas).')
+        parser.add_argument('--popularidad', type=float, default=1.0,
+                            help='Exponente Zipf de la popularidad de productos (0 = todos igual de vendidos).')
+        parser.add_argument('--clientes', type=int, default=0, help='Clientes con cuenta corriente a crear.')
+        parser.add_argument('--fiado', type=float, default=0.05, help='Fracción de ventas a cuenta corriente (si hay clientes).')
+        parser.add_argument('--semilla', type=int, default=None, help='Semilla para repetir exactamente el mismo set.')
+        parser.add_argument('--lote', type=int, default=5000, help='Filas por bulk_create.')
 
     def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        self.options = options
+        self.rng = random.Random(options['semilla'])
+        self.np_rng = np.random.default_rng(options['semilla'])
+        if options['items_promedio'] < 1:
+            raise CommandError('--items-promedio tiene que ser al menos 1.')
+
         self.stdout.write("Iniciando generación de datos de prueba...")
+        with transaction.atomic():
+            sucursales = self.preparar_sucursales(options['sucursales'])
+            productos = self.preparar_productos(options['productos'])
+            if not productos:
+                raise CommandError("Necesitás al menos un Producto (o pasá --productos N para crearlos).")
+            lotes = self.generar_lotes(sucursales, productos)
+            clientes = self.preparar_clientes(options['clientes'])
+
+            with sin_auto_now_add(Venta, 'fecha_hora'):
+                ventas, detalles, pagos = self.generar_historial(sucursales, productos, clientes)
+
+        segundos = time.perf_counter() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f"¡Listo en {segundos:.1f}s! {ventas} ventas, {detalles} líneas de detalle, {lotes} lotes, "
+            f"{len(clientes)} clientes y {pagos} pagos."
+        ))
+        self.stdout.write(self.style.SUCCESS(
+            "Ahora corre 'python manage.py actualizar_canasta' (contadores de canasta) y "
+            "'python manage.py generar_predicciones' para ver la magia."
+        ))
+
+    # ==========================================================
+    # CATÁLOGO, SUCURSALES Y CLIENTES
+    # ==========================================================
+
+    def preparar_sucursales(self, cantidad):
+        nombres = set(Sucursal.objects.values_list('nombre', flat=True))
+        numero = len(nombres)
+        nuevas = []
+        while len(nombres) + len(nuevas) < cantidad:
+            numero += 1
+            # El nombre es único: salteamos los que ya existan de corridas anteriores
+            if f"Sucursal Prueba {numero}" not in nombres:
+                nuevas.append(Sucursal(nombre=f"Sucursal Prueba {numero}"))
+        Sucursal.objects.bulk_create(nuevas)
+        return list(Sucursal.objects.order_by('id')[:cantidad])
+
+    def preparar_productos(self, cantidad):
+        existentes = Producto.objects.count()
+        faltan = cantidad - existentes
+        if faltan > 0:
+            categorias = self.asegurar(Categoria, [f"Categoría Prueba {i}" for i in range(1, 21)],
+                                       margen_ganancia_porcentaje=Decimal('35'))
+            proveedores = list(Proveedor.objects.filter(nombre__startswith='Proveedor Prueba'))
+            if not proveedores:
+                proveedores = Proveedor.objects.bulk_create([
+                    Proveedor(nombre=f"Proveedor Prueba {i}", dia_semana_reparto=i % 6, frecuencia_reparto=7)
+                    for i in range(1, 11)
+                ])
+            desde = Producto.objects.filter(codigo_barras__startswith='PRB').count()
+            nuevos = []
+            for i in range(desde, desde + faltan):
+                costo = Decimal(self.rng.randint(200, 20000)) / 10
+                nuevos.append(Producto(
+                    nombre=f"Producto Prueba {i + 1:05d}", codigo_barras=f"PRB{i + 1:09d}",
+                    categoria=categorias[i % len(categorias)], proveedor=proveedores[i % len(proveedores)],
+                    costo=costo, precio_venta=(costo * Decimal('1.35')).quantize(Decimal('0.01')),
+                    stock_minimo=self.rng.choice([3, 5, 10, 20]), es_perecedero=self.rng.random() < 0.7,
+                ))
+            Producto.objects.bulk_create(nuevos, batch_size=self.options['lote'])
+            self.stdout.write(f"Creados {len(nuevos)} productos de prueba.")
+
+        productos = list(Producto.objects.order_by('id').values_list('id', 'precio_venta', 'es_perecedero'))
+        return productos[:cantidad] if cantidad else productos
+
+    def asegurar(self, modelo, nombres, **extra):
+        """ Crea las filas que falten por nombre (único) y las devuelve en el mismo orden. """
+        modelo.objects.bulk_create([modelo(nombre=n, **extra) for n in nombres], ignore_conflicts=True)
+        por_nombre = {o.nombre: o for o in modelo.objects.filter(nombre__in=nombres)}
+        return [por_nombre[n] for n in nombres]
 
-        # Verificar requisitos
-        if not Producto.objects.exists():
-            self.stdout.write(self.style.ERROR("Error: Necesitas crear al menos un Producto primero."))
-            return
-        
-        if not Sucursal.objects.exists():
-            self.stdout.write(self.style.ERROR("Error: Necesitas crear al menos una Sucursal primero."))
-            return
-
-        sucursal = Sucursal.objects.first()
-        productos = list(Producto.objects.all())
-        
-        # Vamos a generar datos para los últimos 30 días
-        hoy = timezone.now()
-        
-        ventas_creadas = 0
-
-        for i in range(30, -1, -1): # Desde hace 30 días hasta hoy
-            fecha = hoy - timedelta(days=i)
-            
-            # Generar entre 1 y 5 ventas por día aleatoriamente
-            cantidad_ventas_dia = random.randint(1, 5)
-            
-            self.stdout.write(f"Generando {cantidad_ventas_dia} ventas para el día {fecha.date()}...")
-
-            for _ in range(cantidad_ventas_dia):
-                # Elegir productos al azar para esta venta
-                productos_venta = random.sample(productos, k=random.randint(1, min(len(productos), 3)))
-                
-                subtotal_venta = 0
-                
-                # Crear la venta
-                venta = Venta.objects.create(
-                    sucursal=sucursal,
-                    metodo_pago=random.choice(['efectivo', 'debito', 'credito', 'qr']),
-                    fecha_hora=fecha # Usamos la fecha simulada
-                    # Los totales se actualizan abajo
-                )
-                
-                # Forzamos la fecha (porque auto_now_add a veces la sobreescribe al crear)
-                venta.fecha_hora = fecha
-                venta.save()
-
-                for prod in productos_venta:
-                    cantidad = random.randint(1, 3)
-                    precio = prod.precio_venta
-                    subtotal_linea = precio * cantidad
-                    subtotal_venta += subtotal_linea
-                    
-                    DetalleVenta.objects.create(
-                        venta=venta,
-                        producto=prod,
-                        cantidad=cantidad,
-                        precio_unitario=precio,
-                        subtotal=subtotal_linea
+    def generar_lotes(self, sucursales, productos):
+        """ Un lote en góndola y otro en depósito por producto y sucursal, con vencimiento si es perecedero. """
+        hoy = hoy_local()
+        lote = self.options['lote']
+        creados = 0
+        buffer = []
+        for sucursal in sucursales:
+            for producto_id, _, perecedero in productos:
+                for ubicacion, minimo, maximo in (('gondola', 0, 30), ('deposito', 0, 120)):
+                    cantidad = self.rng.randint(minimo, maximo)
+                    if not cantidad:
+                        continue
+                    vencimiento = hoy + timedelta(days=self.rng.randint(-10, 240)) if perecedero else None
+                    buffer.append(Stock(producto_id=producto_id, sucursal=sucursal, ubicacion=ubicacion,
+                                        cantidad=cantidad, fecha_vencimiento=vencimiento))
+                if len(buffer) >= lote:
+                    Stock.objects.bulk_create(buffer)
+                    creados += len(buffer)
+                    buffer = []
+        Stock.objects.bulk_create(buffer)
+        return creados + len(buffer)
+
+    def preparar_clientes(self, cantidad):
+        nuevos = [
+            Cliente(nombre_completo=f"Cliente Prueba {i + 1}",
+                    limite_credito=Decimal(self.rng.choice([20000, 50000, 100000, 300000])))
+            for i in range(cantidad)
+        ]
+        return Cliente.objects.bulk_create(nuevos, batch_size=self.options['lote'])
+
+    # ==========================================================
+    # HISTORIAL DE VENTAS Y PAGOS
+    # ==========================================================
+
+    def factor_dia(self, dia):
+        """ Multiplicador de ventas: onda anual (pico a fin de año) + patrón semanal (pico el sábado). """
+        amplitud = self.options['estacionalidad']
+        anual = math.cos(2 * math.pi * (dia.timetuple().tm_yday - 355) / 365)
+        return max(0.05, 1 + amplitud * (0.5 * anual + 0.5 * PESO_SEMANA[dia.weekday()]))
+
+    def generar_historial(self, sucursales, productos, clientes):
+        opciones = self.options
+        dias = opciones['dias']
+        hoy = hoy_local()
+
+        # Popularidad tipo Zipf en un orden al azar: pocos productos explican gran parte de las ventas
+        orden = list(range(len(productos)))
+        self.rng.shuffle(orden)
+        pesos = [0.0] * len(productos)
+        for rango, indice in enumerate(orden, start=1):
+            pesos[indice] = 1 / rango ** opciones['popularidad']
+        acumulado = list(accumulate(pesos))
+        metodos, pesos_metodos = zip(*METODOS_PAGO)
+        prob_fiado = opciones['fiado'] if clientes else 0
+        # Geométrica con media items_promedio: p = 1 / media
+        p_items = 1 / opciones['items_promedio']
+
+        saldos = {c.id: Decimal('0') for c in clientes}
+        movimientos = dict.fromkeys(saldos, 0)
+        pendiente = {'ventas': [], 'detalles': [], 'pagos': [], 'fiado': []}
+        totales = {'ventas': 0, 'detalles': 0, 'pagos': 0}
+
+        for atras in range(dias - 1, -1, -1):
+            dia = hoy - timedelta(days=atras)
+            apertura = inicio_dia(dia) + timedelta(hours=HORA_APERTURA)
+            segundos_abierto = (HORA_CIERRE - HORA_APERTURA) * 3600
+            if atras == 0:
+                # Hoy solo hasta la hora actual: nada de ventas en el futuro
+                transcurridos = int((timezone.now() - apertura).total_seconds())
+                segundos_abierto = max(1, min(segundos_abierto, transcurridos))
+            factor = self.factor_dia(dia)
+
+            for sucursal in sucursales:
+                cantidad_ventas = int(self.np_rng.poisson(opciones['ventas_dia'] * factor))
+                horarios = sorted(self.rng.randrange(segundos_abierto) for _ in range(cantidad_ventas))
+                for segundo in horarios:
+                    items = min(int(self.np_rng.geometric(p_items)), opciones['items_max'], len(productos))
+                    elegidos = {bisect_left(acumulado, self.rng.random() * acumulado[-1]) for _ in range(items)}
+
+                    lineas, subtotal = [], Decimal('0')
+                    for indice in elegidos:
+                        producto_id, precio, _ = productos[indice]
+                        cantidad = 1 if self.rng.random() < 0.7 else self.rng.randint(2, 4)
+                        linea = precio * cantidad
+                        subtotal += linea
+                        lineas.append(DetalleVenta(producto_id=producto_id, cantidad=cantidad,
+                                                   precio_unitario=precio, subtotal=linea))
+
+                    cliente = None
+                    if prob_fiado and self.rng.random() < prob_fiado:
+                        cliente = self.rng.choice(clientes)
+                        metodo = 'cuenta_corriente'
+                    else:
+                        metodo = self.rng.choices(metodos, weights=pesos_metodos)[0]
+                    venta = Venta(
+                        sucursal=sucursal, fecha_hora=apertura + timedelta(seconds=segundo), metodo_pago=metodo,
+                        cliente=cliente, subtotal=subtotal, total=subtotal,
+                        cuotas=self.rng.choice([1, 1, 3, 6]) if metodo == 'credito' else 1,
                     )
-                
-                # Actualizamos totales de la venta
-                venta.subtotal = subtotal_venta
-                venta.total = subtotal_venta # Simplificado sin descuentos para la prueba
-                venta.save()
-                
-                ventas_creadas += 1
-
-        self.stdout.write(self.style.SUCCESS(f"¡Listo! Se crearon {ventas_creadas} ventas históricas."))
-        self.stdout.write(self.style.SUCCESS("Ahora corre 'python manage.py generar_predicciones' para ver la magia."))
\ No newline at end of file
+                    pendiente['ventas'].append((venta, lineas))
+                    if cliente:
+                        saldos[cliente.id] += subtotal
+                        movimientos[cliente.id] += 1
+                        pendiente['fiado'].append(venta)
+
+            # Los domingos cada cliente con deuda paga una parte (la mayoría), como en el local
+            if clientes and dia.weekday() == 6:
+                for cliente in clientes:
+                    deuda = saldos[cliente.id]
+                    if deuda <= 0 or self.rng.random() < 0.3:
+                        continue
+                    monto = (deuda * Decimal(self.rng.uniform(0.3, 1))).quantize(Decimal('0.01'))
+                    saldos[cliente.id] -= monto
+                    movimientos[cliente.id] += 1
+                    pendiente['pagos'].append(PagoCliente(
+                        cliente=cliente, sucursal=self.rng.choice(sucursales), monto=monto,
+                        fecha=apertura + timedelta(seconds=segundos_abierto - 60),
+                    ))
+
+            if len(pendiente['ventas']) >= opciones['lote'] or atras == 0:
+                self.volcar(pendiente, totales)
+                self.stdout.write(f"  {dia}: {totales['ventas']} ventas generadas...")
+
+        # Saldos finales en una pasada. No se generan cortes: con movimientos_desde_corte al día,
+        # el primer movimiento real de cada cliente con historia larga toma el corte de saldo.
+        Cliente.objects.bulk_update(
+            [Cliente(id=id_, saldo_actual=saldo, movimientos_desde_corte=movimientos[id_]) for id_, saldo in saldos.items()],
+            ['saldo_actual', 'movimientos_desde_corte'], batch_size=opciones['lote'],
+        )
+        return totales['ventas'], totales['detalles'], totales['pagos']
+
+    def volcar(self, pendiente, totales):
+        """ Escribe lo acumulado con bulk_create en orden cronológico (los ids quedan en orden de fecha). """
+        lote = self.options['lote']
+        ventas = [venta for venta, _ in pendiente['ventas']]
+        Venta.objects.bulk_create(ventas, batch_size=lote)  # necesita devolver ids (SQLite 3.35+/PostgreSQL)
+
+        detalles = []
+        for venta, lineas in pendiente['ventas']:
+            for linea in lineas:
+                linea.venta_id = venta.id
+                detalles.append(linea)
+        DetalleVenta.objects.bulk_create(detalles, batch_size=lote)
+        PagoCliente.objects.bulk_create(pendiente['pagos'], batch_size=lote)
+
+        # Libro de cuentas corrientes: ventas fiadas (debe) y pagos (haber) ordenados por fecha
+        movimientos = [
+            MovimientoCuentaCliente(cliente_id=v.cliente_id, sucursal_id=v.sucursal_id, fecha=v.fecha_hora,
+                                    tipo='venta', monto=v.total, venta=v)
+            for v in pendiente['fiado']
+        ] + [
+            MovimientoCuentaCliente(cliente_id=p.cliente_id, sucursal_id=p.sucursal_id, fecha=p.fecha,
+                                    tipo='pago', monto=-p.monto, pago=p)
+            for p in pendiente['pagos']
+        ]
+        movimientos.sort(key=lambda m: m.fecha)
+        MovimientoCuentaCliente.objects.bulk_create(movimientos, batch_size=lote)
+
+        totales['ventas'] += len(ventas)
+        totales['detalles'] += len(detalles)
+        totales['pagos'] += len(pendiente['pagos'])
+        for lista in pendiente.values():
+            lista.clear()
@@ -1,10 +1,20 @@
+import os
+import socket
+import time
+
 import pandas as pd
-from prophet import Prophet
-from django.core.management.base import BaseCommand
-from django.utils import timezone
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 from django.db.models import Sum
-from django.db.models.functions import TruncDate
-from core.models import Producto, Sucursal, Venta, DetalleVenta, PrediccionVenta
+from core.models import (
+    Producto, Sucursal, Venta, DetalleVenta, PrediccionVenta, CorridaPrediccion, PrediccionVentaBorrador
+)
+from core.predicciones import (
+    PrediccionJerarquica, predecir_serie, MIN_DIAS_HISTORIA,
+    planificar_corrida, tomar_fragmento, renovar_lease, completar_fragmento, series_fragmento, publicar_corrida,
+)
+from core.fechas import hoy_local, dia_truncado
+from core import metricas
 import logging
 
 # Configuramos el logger de Prophet para que no llene la consola de mensajes técnicos
@@ -16,16 +26,70 @@ logger.setLevel(logging.CRITICAL)
 class Command(BaseCommand):
     help = 'Genera las predicciones de ventas para los próximos 7 días usando Prophet'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--jerarquico', action='store_true',
+            help='Un modelo por (categoría, sucursal) + modelos propios solo para los más vendidos.'
+        )
+        parser.add_argument(
+            '--top-vendedores', type=int, default=20,
+            help='(Modo jerárquico) Cantidad de productos por sucursal con modelo propio.'
+        )
+        parser.add_argument(
+            '--dias-participacion', type=int, default=28,
+            help='(Modo jerárquico) Días de ventas recientes usados para repartir la predicción de la categoría.'
+        )
+        parser.add_argument(
+            '--forzar', action='store_true',
+            help='Corre aunque hoy no sea el día programado.'
+        )
+        # --- Modo distribuido (varios procesos o máquinas contra la misma base) ---
+        parser.add_argument(
+            '--distribuido', choices=['planificar', 'trabajar', 'publicar'],
+            help="planificar: crea la corrida y sus fragmentos. trabajar: toma fragmentos hasta que no "
+                 "queden. publicar: hace visibles las predicciones de una corrida completa."
+        )
+        parser.add_argument('--corrida', type=int, help='ID de la corrida (por defecto, la última en curso).')
+        parser.add_argument('--tamano-fragmento', type=int, default=200, help='Productos por fragmento.')
+        parser.add_argument('--lease-segundos', type=int, default=300, help='Duración del lease de cada fragmento.')
+        parser.add_argument('--worker', default='', help='Nombre del worker (por defecto host:pid).')
+
     def handle(self, *args, **options):
+        if options['distribuido'] in ('trabajar', 'publicar'):
+            # Trabajan sobre una corrida ya planificada: no dependen del día
+            corrida = self.obtener_corrida(options['corrida'])
+            if options['distribuido'] == 'trabajar':
+                self.trabajar(corrida, options['worker'] or f"{socket.gethostname()}:{os.getpid()}", options['lease_segundos'])
+            else:
+                try:
+                    publicadas = publicar_corrida(corrida)
+                except ValueError as e:
+                    raise CommandError(str(e))
+                self.stdout.write(self.style.SUCCESS(f"¡Corrida #{corrida.id} publicada! {publicadas} predicciones visibles."))
+            return
+
         DIA_ELEGIDO = 1
-        hoy = timezone.now().date()
+        hoy = hoy_local()
 
-        if hoy.weekday() != DIA_ELEGIDO:
+        if hoy.weekday() != DIA_ELEGIDO and not options['forzar']:
             self.stdout.write(self.style.WARNING(f"Hoy es {hoy.strftime('%A')}. La IA solo corre los Lunes. Ahorrando energía... 💤"))
             return # Se detiene acá y no gasta CPU
         # ------------------------------------
 
         self.stdout.write(self.style.MIGRATE_HEADING(f"--- Iniciando IA de Predicción (Semanal) para {hoy} ---"))
+
+        if options['distribuido'] == 'planificar':
+            corrida = planificar_corrida(hoy, options['tamano_fragmento'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Corrida #{corrida.id} creada con {corrida.fragmentos.count()} fragmentos. "
+                f"Lanzá workers con: manage.py generar_predicciones --distribuido trabajar --corrida {corrida.id}"
+            ))
+            return
+
+        if options['jerarquico']:
+            self.predecir_jerarquico(hoy, options['top_vendedores'], options['dias_participacion'])
+            return
+
         sucursales = Sucursal.objects.all()
         productos = Producto.objects.all()
 
@@ -41,14 +105,14 @@ class Command(BaseCommand):
                     producto=producto,
                     venta__sucursal=sucursal
                 ).annotate(
-                    fecha=TruncDate('venta__fecha_hora')
+                    fecha=dia_truncado('venta__fecha_hora')
                 ).values('fecha').annotate(
                     cantidad_total=Sum('cantidad')
                 ).order_by('fecha')
 
                 # Necesitamos un mínimo de datos históricos para que la IA funcione
                 # (mínimo 5 días con ventas para que no falle matemáticamente)
-                if ventas_diarias.count() < 5:
+                if ventas_diarias.count() < MIN_DIAS_HISTORIA:
                     continue
 
                 # 2. Preparar datos para Prophet (Pandas DataFrame)
@@ -61,32 +125,18 @@ class Command(BaseCommand):
                 df = df.rename(columns={'fecha': 'ds', 'cantidad_total': 'y'})
 
                 try:
-                    # 3. Configurar y Entrenar el Modelo
-                    # daily_seasonality=False porque no tenemos datos hora a hora suficientes
-                    # weekly_seasonality=True es CLAVE para kioscos (viernes != lunes)
-                    m = Prophet(daily_seasonality=False, weekly_seasonality=True, yearly_seasonality=False)
-                    m.fit(df)
-
-                    # 4. Predecir el Futuro (7 días)
-                    future = m.make_future_dataframe(periods=7)
-                    forecast = m.predict(future)
+                    # 3 y 4. Entrenar el modelo y predecir el futuro (7 días)
+                    predicciones_futuras = predecir_serie(df, hoy)
 
                     # 5. Procesar y Guardar Resultados
-                    # Filtramos solo las predicciones futuras
-                    predicciones_futuras = forecast[forecast['ds'].dt.date >= hoy]
-
                     nuevas_predicciones = []
-                    for index, row in predicciones_futuras.iterrows():
-                        fecha_prediccion = row['ds'].date()
-                        # 'yhat' es el valor predicho. Usamos max(0, ...) porque no existen ventas negativas
-                        cantidad = round(max(0, row['yhat']), 2)
-
+                    for fecha_prediccion, cantidad in predicciones_futuras:
                         nuevas_predicciones.append(
                             PrediccionVenta(
                                 producto=producto,
                                 sucursal=sucursal,
                                 fecha=fecha_prediccion,
-                                cantidad_predicha=cantidad
+                                cantidad_predicha=round(cantidad, 2)
                             )
                         )
 
@@ -106,4 +156,99 @@ class Command(BaseCommand):
                 except Exception as e:
                     self.stderr.write(f"   -> Error en {producto.nombre}: {e}")
 
-        self.stdout.write(self.style.SUCCESS(f"¡Listo! Se generaron predicciones para {total_predicciones} productos/sucursal."))
\ No newline at end of file
+        self.stdout.write(self.style.SUCCESS(f"¡Listo! Se generaron predicciones para {total_predicciones} productos/sucursal."))
+
+    def predecir_jerarquico(self, hoy, top_vendedores, dias_participacion):
+        modelo = PrediccionJerarquica(hoy, top_vendedores=top_vendedores, dias_participacion=dias_participacion)
+
+        # Pocas consultas grandes en vez de una por producto/sucursal
+        ranking_por_sucursal = modelo.participaciones()
+        top_ids = {
+            sucursal_id: {p for p, _, _ in ranking[:top_vendedores]}
+            for sucursal_id, ranking in ranking_por_sucursal.items()
+        }
+        df_cat = modelo.series_categoria()
+        df_top = modelo.series_top(top_ids)
+
+        total_predicciones = 0
+        for sucursal in Sucursal.objects.filter(id__in=ranking_por_sucursal.keys()):
+            self.stdout.write(f"Analizando Sucursal: {sucursal.nombre}...")
+            nuevas_predicciones = modelo.predecir_sucursal(
+                sucursal.id, ranking_por_sucursal[sucursal.id], df_cat, df_top
+            )
+
+            # Reemplazamos de una vez solo los productos que se predijeron: los que quedaron sin
+            # modelo (error de Prophet, sin ventas en la ventana) conservan su predicción anterior
+            predichos = {p.producto_id for p in nuevas_predicciones}
+            with transaction.atomic():
+                PrediccionVenta.objects.filter(sucursal=sucursal, fecha__gte=hoy, producto_id__in=predichos).delete()
+                PrediccionVenta.objects.bulk_create(nuevas_predicciones, batch_size=1000)
+            total_predicciones += len(predichos)
+
+        for error in modelo.errores:
+            self.stderr.write(f"   -> Error en {error}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"¡Listo! Se entrenaron {modelo.modelos_entrenados} modelos y se generaron predicciones "
+            f"para {total_predicciones} productos/sucursal."
+        ))
+
+    def obtener_corrida(self, corrida_id):
+        corridas = CorridaPrediccion.objects.all()
+        if corrida_id:
+            corrida = corridas.filter(id=corrida_id).first()
+        else:
+            corrida = corridas.filter(estado='en_curso').order_by('-id').first()
+        if not corrida:
+            raise CommandError("No hay ninguna corrida en curso. Creala con --distribuido planificar.")
+        return corrida
+
+    def trabajar(self, corrida, worker, segundos_lease):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"--- Worker {worker} trabajando en la corrida #{corrida.id} ---"))
+        fragmentos_hechos = 0
+
+        while True:
+            fragmento = tomar_fragmento(corrida, worker, segundos_lease)
+            if fragmento is None:
+                break
+
+            self.stdout.write(f"Fragmento {fragmento.id}: sucursal {fragmento.sucursal_id}, "
+                              f"productos {fragmento.producto_desde}-{fragmento.producto_hasta} (intento {fragmento.intentos})")
+            predicciones = []
+            ultima_renovacion = time.monotonic()
+            lease_perdido = False
+
+            for producto_id, filas in series_fragmento(fragmento).items():
+                if len(filas) < MIN_DIAS_HISTORIA:
+                    continue
+                try:
+                    df = pd.DataFrame(filas).rename(columns={'fecha': 'ds', 'cantidad_total': 'y'})[['ds', 'y']]
+                    for fecha, cantidad in predecir_serie(df, corrida.fecha):
+                        predicciones.append(PrediccionVentaBorrador(
+                            corrida=corrida, producto_id=producto_id, sucursal_id=fragmento.sucursal_id,
+                            fecha=fecha, cantidad_predicha=round(cantidad, 2),
+                        ))
+                except Exception as e:
+                    self.stderr.write(f"   -> Error en producto {producto_id}: {e}")
+
+                # Renovamos el lease cada tanto (no en cada producto, para no martillar la base)
+                if time.monotonic() - ultima_renovacion > segundos_lease / 3:
+                    if not renovar_lease(fragmento, worker, segundos_lease):
+                        lease_perdido = True
+                        break
+                    ultima_renovacion = time.monotonic()
+
+            if lease_perdido or not completar_fragmento(fragmento, worker, predicciones):
+                self.stderr.write(f"   -> Perdimos el lease del fragmento {fragmento.id}; lo termina otro worker.")
+                continue
+            fragmentos_hechos += 1
+            # El avance de la corrida se ve en /metrics mientras el worker sigue trabajando
+            metricas.predicciones_fragmentos.inc()
+            metricas.volcar()
+
+        pendientes = corrida.fragmentos.exclude(estado='completado').count()
+        self.stdout.write(self.style.SUCCESS(
+            f"¡Listo! Este worker completó {fragmentos_hechos} fragmentos. Quedan {pendientes} sin completar."
+        ))
+        if not pendientes:
+            self.stdout.write("Todos los fragmentos están completos: ya se puede correr --distribuido publicar.")
@@ -0,0 +1,147 @@
+import argparse
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Sum
+
+from core import listados
+from core.cuentas import bloquear_cliente, registrar_movimiento
+from core.models import (
+    Cliente, Venta, PagoCliente, MovimientoCuentaCliente, Proveedor, FacturaProveedor, PagoProveedor
+)
+
+
+def monto_no_negativo(texto):
+    """ Tipo para argparse: Decimal >= 0 (un valor inválido es un error de uso, no un traceback). """
+    try:
+        valor = Decimal(texto)
+    except InvalidOperation:
+        raise argparse.ArgumentTypeError(f"'{texto}' no es un monto válido.")
+    if not valor.is_finite() or valor < 0:
+        raise argparse.ArgumentTypeError(f"'{texto}' tiene que ser un monto mayor o igual a cero.")
+    return valor
+
+
+def _sumas(queryset, campo_grupo, campo_monto):
+    """ {id: suma} con un solo GROUP BY. """
+    return dict(
+        queryset.values(campo_grupo).annotate(total=Sum(campo_monto)).order_by().values_list(campo_grupo, 'total')
+    )
+
+
+def desvios(modelo, debe, haber, tolerancia):
+    """
+    Compara saldo_actual de todas las filas de `modelo` contra debe - haber ({id: suma}).
+    Devuelve [(id, saldo_actual, saldo_esperado)] de las que difieren más que la tolerancia.
+    """
+    resultado = []
+    for id_, saldo in modelo.objects.values_list('id', 'saldo_actual').iterator(chunk_size=5000):
+        esperado = (debe.get(id_) or Decimal('0')) - (haber.get(id_) or Decimal('0'))
+        if abs(saldo - esperado) > tolerancia:
+            resultado.append((id_, saldo, esperado))
+    return resultado
+
+
+class Command(BaseCommand):
+    help = ('Recalcula los saldos de clientes y proveedores desde las ventas fiadas, facturas y pagos, '
+            'informa las diferencias y opcionalmente las corrige. Conviene correrlo fuera del horario de atención.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corregir', action='store_true', help='Guarda el saldo recalculado donde haya diferencias.')
+        parser.add_argument('--tolerancia', type=monto_no_negativo, default=Decimal('0.009'), help='Diferencia que se ignora.')
+        parser.add_argument('--mostrar', type=int, default=20, help='Cuántas diferencias listar (las más grandes).')
+        parser.add_argument('--solo', choices=['clientes', 'proveedores'], help='Revisar solo una de las dos cuentas.')
+
+    def handle(self, *args, **options):
+        inicio_total = time.perf_counter()
+        tolerancia = options['tolerancia']
+
+        with transaction.atomic():
+            if options['solo'] != 'proveedores':
+                inicio = time.perf_counter()
+                debe = _sumas(Venta.objects.filter(metodo_pago='cuenta_corriente', cliente__isnull=False), 'cliente_id', 'total')
+                haber = _sumas(PagoCliente.objects, 'cliente_id', 'monto')
+                diferencias = desvios(Cliente, debe, haber, tolerancia)
+                self.informar('Clientes', Cliente, diferencias, options, time.perf_counter() - inicio)
+
+                # El libro de movimientos también tiene que cerrar contra las ventas y pagos
+                # (normalmente cierra: la migración 0015 lo armó con ellas y solo se desfasa el saldo)
+                libro = _sumas(MovimientoCuentaCliente.objects, 'cliente_id', 'monto')
+                libro_desfasado = {}
+                for id_ in debe.keys() | haber.keys() | libro.keys():
+                    esperado = (debe.get(id_) or 0) - (haber.get(id_) or 0)
+                    if abs((libro.get(id_) or 0) - esperado) > tolerancia:
+                        libro_desfasado[id_] = esperado - (libro.get(id_) or 0)
+                if libro_desfasado:
+                    self.stdout.write(self.style.WARNING(
+                        f"  {len(libro_desfasado)} clientes tienen el libro de movimientos desfasado de sus ventas y pagos."
+                    ))
+                if options['corregir'] and (diferencias or libro_desfasado):
+                    self.corregir_clientes(diferencias, libro_desfasado)
+
+            if options['solo'] != 'clientes':
+                inicio = time.perf_counter()
+                debe = _sumas(FacturaProveedor.objects, 'proveedor_id', 'monto_total')
+                haber = _sumas(PagoProveedor.objects, 'proveedor_id', 'monto')
+                diferencias = desvios(Proveedor, debe, haber, tolerancia)
+                self.informar('Proveedores', Proveedor, diferencias, options, time.perf_counter() - inicio)
+                if options['corregir'] and diferencias:
+                    self.corregir_proveedores(diferencias)
+
+        self.stdout.write(self.style.SUCCESS(f"¡Listo! Tiempo total: {time.perf_counter() - inicio_total:.2f}s."))
+
+    def informar(self, titulo, modelo, diferencias, options, segundos):
+        revisados = modelo.objects.count()
+        desvio_total = sum((abs(saldo - esperado) for _, saldo, esperado in diferencias), Decimal('0'))
+        estilo = self.style.WARNING if diferencias else self.style.SUCCESS
+        self.stdout.write(estilo(
+            f"{titulo}: {revisados} revisados en {segundos:.2f}s, {len(diferencias)} con diferencias "
+            f"(desvío total ${desvio_total})."
+        ))
+
+        for id_, saldo, esperado in sorted(diferencias, key=lambda d: -abs(d[1] - d[2]))[:options['mostrar']]:
+            self.stdout.write(f"  #{id_}: guardado ${saldo}, recalculado ${esperado} (diferencia ${saldo - esperado})")
+
+    def corregir_clientes(self, diferencias, libro_desfasado):
+        """
+        `diferencias`: [(id, saldo guardado, saldo esperado)]; `libro_desfasado`: {id: lo que le falta
+        al libro para cerrar con ventas y pagos}. Solo el libro desfasado recibe un movimiento 'ajuste'
+        (registrar_movimiento, que además le suma el ajuste al saldo); el resto del desvío del saldo se
+        corrige con un solo bulk_update, así el saldo termina igual a la suma del libro.
+        """
+        inicio = time.perf_counter()
+        for id_, ajuste in libro_desfasado.items():
+            bloquear_cliente(id_)
+            registrar_movimiento(id_, 'ajuste', ajuste)
+
+        # Se corrige con la diferencia (saldo = saldo + ajuste) para no pisar movimientos
+        # que entren mientras corre el comando
+        saldos = {id_: (saldo, esperado) for id_, saldo, esperado in diferencias}
+        objetos = []
+        for id_, (saldo, esperado) in saldos.items():
+            delta = esperado - saldo - libro_desfasado.get(id_, 0)
+            if delta:
+                objetos.append(Cliente(id=id_, saldo_actual=F('saldo_actual') + delta))
+        for id_, ajuste in libro_desfasado.items():
+            if id_ not in saldos:
+                # El saldo estaba bien: el ajuste recién registrado no tiene que moverlo
+                objetos.append(Cliente(id=id_, saldo_actual=F('saldo_actual') - ajuste))
+        Cliente.objects.bulk_update(objetos, ['saldo_actual'], batch_size=1000)
+        self.stdout.write(self.style.SUCCESS(
+            f"  Corregidos {len(saldos)} saldos y {len(libro_desfasado)} libros (con un ajuste) "
+            f"en {time.perf_counter() - inicio:.2f}s."
+        ))
+
+    def corregir_proveedores(self, diferencias):
+        inicio = time.perf_counter()
+        # Se corrige con la diferencia (saldo = saldo + ajuste) para no pisar movimientos
+        # que entren mientras corre el comando
+        objetos = [Proveedor(id=id_, saldo_actual=F('saldo_actual') + (esperado - saldo)) for id_, saldo, esperado in diferencias]
+        Proveedor.objects.bulk_update(objetos, ['saldo_actual'], batch_size=1000)
+        # bulk_update no dispara post_save: el listado cacheado seguiría mostrando el saldo viejo
+        listados.PROVEEDORES.invalidar()
+        self.stdout.write(self.style.SUCCESS(
+            f"  Corregidos {len(objetos)} saldos en {time.perf_counter() - inicio:.2f}s."
+        ))
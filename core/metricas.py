@@ -0,0 +1,360 @@
+# core/metricas.py
+# Métricas de la app (contadores e histogramas) en el formato de texto de Prometheus, sin
+# servicios externos. Cada proceso (worker de gunicorn, comando de manage.py) acumula en memoria
+# y cada tanto escribe su foto completa a un JSON propio en METRICAS['DIRECTORIO']; la vista
+# /metrics lee todos los archivos y los suma. Como cada archivo tiene los totales del proceso
+# desde que arrancó, reescribirlo nunca cuenta dos veces, y los de procesos que ya terminaron
+# se siguen sumando (un contador nunca baja): /metrics los compacta en un solo acumulado.json,
+# así el directorio no crece con cada reinicio de workers. Borrar el directorio pone todo en cero.
+import atexit
+import glob
+import json
+import math
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Sin flock (Windows) no se compacta: solo crece el directorio
+
+METRICAS_POR_DEFECTO = {
+    'ACTIVO': True,
+    'DIRECTORIO': 'metricas',   # relativo a BASE_DIR si no es absoluto
+    'VOLCAR_CADA': 10,          # segundos entre escrituras del archivo del proceso
+    'TOKEN': '',                # si se define, /metrics también acepta "Authorization: Bearer <token>"
+}
+
+# Segundos: de una búsqueda rápida a un entrenamiento de Prophet
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+ACUMULADO = 'acumulado.json'
+
+# Directorio temporal mientras hay un aisladas() activo (tests, benchmark, estrés)
+_aislado = {'directorio': None}
+
+
+def configuracion():
+    config = {**METRICAS_POR_DEFECTO, **getattr(settings, 'METRICAS', {})}
+    if _aislado['directorio']:
+        config['DIRECTORIO'] = _aislado['directorio']
+    if not os.path.isabs(config['DIRECTORIO']):
+        config['DIRECTORIO'] = os.path.join(settings.BASE_DIR, config['DIRECTORIO'])
+    return config
+
+
+def _clave(etiquetas):
+    return tuple(sorted((k, str(v)) for k, v in etiquetas.items()))
+
+
+class _Registro:
+    """ Valores de este proceso. Un solo lock: cada actualización es un par de sumas. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.definiciones = {}   # nombre -> (tipo, ayuda, buckets)
+        self.contadores = {}     # (nombre, etiquetas) -> valor
+        self.histogramas = {}    # (nombre, etiquetas) -> [conteos por bucket..., suma, cantidad]
+        # Un archivo por vida de proceso: si el pid se reutiliza no pisa los totales del anterior
+        self.archivo = f"{socket.gethostname()}_{os.getpid()}_{uuid.uuid4().hex[:8]}.json"
+        self._ultimo_volcado = time.monotonic()
+
+    def reiniciar(self):
+        """
+        Arranca de cero con un archivo nuevo (el anterior conserva lo ya volcado). Después de un
+        fork, para que el hijo no herede los totales del padre; al salir de aisladas(), para descartarlos.
+        """
+        definiciones = self.definiciones
+        self.__init__()
+        self.definiciones = definiciones
+
+    def definir(self, nombre, tipo, ayuda, buckets=None):
+        self.definiciones[nombre] = (tipo, ayuda, buckets)
+
+    def sumar(self, nombre, etiquetas, cantidad):
+        with self._lock:
+            clave = (nombre, _clave(etiquetas))
+            self.contadores[clave] = self.contadores.get(clave, 0) + cantidad
+        self._volcar_si_corresponde()
+
+    def observar(self, nombre, etiquetas, valor):
+        buckets = self.definiciones[nombre][2]
+        with self._lock:
+            clave = (nombre, _clave(etiquetas))
+            fila = self.histogramas.get(clave)
+            if fila is None:
+                fila = self.histogramas[clave] = [0] * (len(buckets) + 2)
+            for i, limite in enumerate(buckets):
+                if valor <= limite:
+                    fila[i] += 1
+                    break
+            fila[-2] += valor
+            fila[-1] += 1
+        self._volcar_si_corresponde()
+
+    def foto(self):
+        with self._lock:
+            return {
+                'definiciones': self.definiciones,
+                'contadores': [[n, dict(e), v] for (n, e), v in self.contadores.items()],
+                'histogramas': [[n, dict(e), list(f)] for (n, e), f in self.histogramas.items()],
+            }
+
+    def _volcar_si_corresponde(self):
+        if time.monotonic() - self._ultimo_volcado >= configuracion()['VOLCAR_CADA']:
+            volcar()
+
+    def volcar(self, directorio):
+        self._ultimo_volcado = time.monotonic()
+        if not self.contadores and not self.histogramas:
+            return
+        os.makedirs(directorio, exist_ok=True)
+        ruta = os.path.join(directorio, self.archivo)
+        temporal = f"{ruta}.{threading.get_ident()}.tmp"
+        with open(temporal, 'w', encoding='utf-8') as archivo:
+            json.dump(self.foto(), archivo)
+        os.replace(temporal, ruta)  # atómico: /metrics nunca lee un archivo a medio escribir
+
+
+registro = _Registro()
+os.register_at_fork(after_in_child=registro.reiniciar)
+
+
+def volcar():
+    """ Escribe los totales de este proceso al directorio compartido (los comandos lo llaman al terminar). """
+    config = configuracion()
+    if config['ACTIVO']:
+        try:
+            registro.volcar(config['DIRECTORIO'])
+        except OSError:
+            pass  # Las métricas nunca pueden romper una venta
+
+
+atexit.register(volcar)
+
+
+@contextmanager
+def aisladas():
+    """
+    Para los tests y los comandos que arman una base de prueba (benchmark_vistas, estres_ventas):
+    mientras dura, las métricas van a un directorio temporal que se borra al salir, y lo acumulado
+    por el proceso en ese lapso se descarta (el volcado de atexit no lo lleva al directorio real).
+    """
+    volcar()  # Lo de antes queda en el directorio real
+    registro.reiniciar()
+    anterior, _aislado['directorio'] = _aislado['directorio'], tempfile.mkdtemp(prefix='metricas_')
+    try:
+        yield _aislado['directorio']
+    finally:
+        registro.reiniciar()
+        shutil.rmtree(_aislado['directorio'], ignore_errors=True)
+        _aislado['directorio'] = anterior
+
+
+# ==========================================================
+# TIPOS DE MÉTRICA
+# ==========================================================
+
+class Contador:
+    def __init__(self, nombre, ayuda):
+        self.nombre = nombre
+        registro.definir(nombre, 'counter', ayuda)
+
+    def inc(self, cantidad=1, **etiquetas):
+        registro.sumar(self.nombre, etiquetas, cantidad)
+
+
+class Histograma:
+    def __init__(self, nombre, ayuda, buckets=BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        registro.definir(nombre, 'histogram', ayuda, tuple(buckets))
+
+    def observar(self, valor, **etiquetas):
+        registro.observar(self.nombre, etiquetas, valor)
+
+    @contextmanager
+    def medir(self, **etiquetas):
+        """ Observa los segundos que tarda el bloque (también si termina con una excepción). """
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **etiquetas)
+
+
+# ==========================================================
+# AGREGACIÓN Y EXPOSICIÓN
+# ==========================================================
+
+def _sumar_fotos(rutas):
+    """ Suma las fotos de los archivos `rutas`. Devuelve (definiciones, contadores, histogramas). """
+    definiciones, contadores, histogramas = {}, {}, {}
+    for ruta in rutas:
+        try:
+            with open(ruta, encoding='utf-8') as archivo:
+                foto = json.load(archivo)
+        except (OSError, ValueError):
+            continue  # Archivo borrado o corrupto: lo salteamos
+        for nombre, (tipo, ayuda, buckets) in foto['definiciones'].items():
+            definiciones[nombre] = (tipo, ayuda, tuple(buckets) if buckets else None)
+        for nombre, etiquetas, valor in foto['contadores']:
+            clave = (nombre, _clave(etiquetas))
+            contadores[clave] = contadores.get(clave, 0) + valor
+        for nombre, etiquetas, fila in foto['histogramas']:
+            clave = (nombre, _clave(etiquetas))
+            actual = histogramas.get(clave)
+            if actual is None or len(actual) != len(fila):
+                # Si cambiaron los buckets entre versiones, se queda la forma más nueva
+                histogramas[clave] = list(fila)
+            else:
+                histogramas[clave] = [a + b for a, b in zip(actual, fila)]
+    return definiciones, contadores, histogramas
+
+
+@contextmanager
+def _bloqueo(directorio, exclusivo):
+    """
+    flock sobre <directorio>/.bloqueo: compactar (exclusivo) no puede correr mientras alguien suma
+    (compartido), si no vería un archivo ya borrado y su total todavía no escrito en el acumulado.
+    Devuelve False si el exclusivo está tomado (compactar no espera).
+    """
+    if fcntl is None:
+        yield not exclusivo
+        return
+    os.makedirs(directorio, exist_ok=True)
+    with open(os.path.join(directorio, '.bloqueo'), 'a') as archivo:
+        try:
+            fcntl.flock(archivo, (fcntl.LOCK_EX | fcntl.LOCK_NB) if exclusivo else fcntl.LOCK_SH)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(archivo, fcntl.LOCK_UN)
+
+
+def _proceso_terminado(nombre_archivo):
+    """ True si el archivo es de un proceso de esta máquina que ya no existe. """
+    partes = os.path.splitext(nombre_archivo)[0].rsplit('_', 2)  # <host>_<pid>_<uuid>
+    if len(partes) != 3 or partes[0] != socket.gethostname() or not partes[1].isdigit():
+        return False  # De otra máquina (o el acumulado): no sabemos si sigue vivo
+    try:
+        os.kill(int(partes[1]), 0)
+    except ProcessLookupError:
+        return True
+    except (PermissionError, OverflowError):
+        pass
+    return False
+
+
+def compactar(directorio):
+    """
+    Suma al acumulado los archivos de procesos terminados y los borra. Devuelve cuántos compactó.
+    Si hay otra compactación en curso no hace nada.
+    """
+    with _bloqueo(directorio, exclusivo=True) as tomado:
+        if not tomado:
+            return 0
+        muertos = [ruta for ruta in glob.glob(os.path.join(directorio, '*.json'))
+                   if _proceso_terminado(os.path.basename(ruta))]
+        if not muertos:
+            return 0
+        acumulado = os.path.join(directorio, ACUMULADO)
+        definiciones, contadores, histogramas = _sumar_fotos([acumulado] + muertos)
+        temporal = f"{acumulado}.{os.getpid()}.tmp"
+        with open(temporal, 'w', encoding='utf-8') as archivo:
+            json.dump({
+                'definiciones': definiciones,
+                'contadores': [[n, dict(e), v] for (n, e), v in contadores.items()],
+                'histogramas': [[n, dict(e), f] for (n, e), f in histogramas.items()],
+            }, archivo)
+        os.replace(temporal, acumulado)
+        for ruta in muertos:
+            os.remove(ruta)
+        return len(muertos)
+
+
+def agregar(directorio):
+    """ Suma las fotos de todos los procesos del directorio. Devuelve (definiciones, contadores, histogramas). """
+    with _bloqueo(directorio, exclusivo=False):
+        return _sumar_fotos(glob.glob(os.path.join(directorio, '*.json')))
+
+
+def _etiquetas_texto(etiquetas, extra=()):
+    pares = list(etiquetas) + list(extra)
+    if not pares:
+        return ''
+    escapar = lambda v: v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escapar(v)}"' for k, v in pares) + '}'
+
+
+def _numero(valor):
+    if isinstance(valor, float) and math.isinf(valor):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+def exposicion():
+    """ Texto para Prometheus con lo de todos los procesos (incluido este, recién volcado). """
+    volcar()
+    directorio = configuracion()['DIRECTORIO']
+    try:
+        compactar(directorio)
+    except OSError:
+        pass  # Se reintenta en el próximo scrape; sumar igual funciona
+    definiciones, contadores, histogramas = agregar(directorio)
+    # Las métricas definidas en este proceso aparecen aunque todavía valgan cero
+    for nombre, definicion in registro.definiciones.items():
+        definiciones.setdefault(nombre, definicion)
+
+    lineas = []
+    for nombre in sorted(definiciones):
+        tipo, ayuda, buckets = definiciones[nombre]
+        lineas.append(f"# HELP {nombre} {ayuda}")
+        lineas.append(f"# TYPE {nombre} {tipo}")
+        if tipo == 'counter':
+            for (n, etiquetas), valor in sorted(contadores.items()):
+                if n == nombre:
+                    lineas.append(f"{nombre}{_etiquetas_texto(etiquetas)} {_numero(valor)}")
+        else:
+            for (n, etiquetas), fila in sorted(histogramas.items()):
+                if n != nombre:
+                    continue
+                acumulado = 0
+                for limite, conteo in zip(buckets, fila):
+                    acumulado += conteo
+                    lineas.append(f"{nombre}_bucket{_etiquetas_texto(etiquetas, [('le', _numero(float(limite)))])} {acumulado}")
+                lineas.append(f"{nombre}_bucket{_etiquetas_texto(etiquetas, [('le', '+Inf')])} {fila[-1]}")
+                lineas.append(f"{nombre}_sum{_etiquetas_texto(etiquetas)} {_numero(float(fila[-2]))}")
+                lineas.append(f"{nombre}_count{_etiquetas_texto(etiquetas)} {fila[-1]}")
+    return '\n'.join(lineas) + '\n'
+
+
+# ==========================================================
+# MÉTRICAS DE LA APP
+# ==========================================================
+
+ventas_registradas = Contador('stock_ventas_registradas_total', 'Ventas confirmadas por método de pago.')
+ventas_rechazadas = Contador('stock_ventas_rechazadas_total', 'Ventas que no se pudieron registrar, por motivo.')
+venta_segundos = Histograma('stock_venta_segundos', 'Duración del POST de registrar_venta (transacción completa).')
+reintentos = Contador('stock_reintentos_total', 'Reintentos por contención entre cajas (lote o transacción).')
+fefo_segundos = Histograma('stock_fefo_descuento_segundos', 'Tiempo de descontar un ítem de los lotes FEFO.')
+ocr_segundos = Histograma('stock_ocr_segundos', 'Latencia de la llamada a Google Vision por factura.')
+ocr_facturas = Contador('stock_ocr_facturas_total', 'Facturas procesadas con OCR, por resultado.')
+importacion_filas = Contador('stock_importacion_filas_total', 'Filas de importación de stock, por etapa y tipo.')
+importacion_segundos = Histograma('stock_importacion_segundos', 'Duración de cada etapa de la importación de stock.')
+predicciones_series = Contador('stock_predicciones_series_total', 'Series entrenadas con Prophet, por resultado.')
+predicciones_segundos = Histograma('stock_predicciones_modelo_segundos', 'Tiempo de entrenar y predecir una serie.')
+predicciones_fragmentos = Contador('stock_predicciones_fragmentos_total', 'Fragmentos de corrida distribuida completados.')
+alertas_segundos = Histograma('stock_alertas_globales_segundos', 'Tiempo del context processor alertas_globales.')
+cache_consultas = Contador('stock_cache_consultas_total', 'Lecturas del cache compartido por espacio y resultado.')
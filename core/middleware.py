@@ -0,0 +1,343 @@
+# core/middleware.py
+# Presupuesto de SQL por solicitud: cuenta las consultas, su tiempo total y las más lentas
+# de cada request (agrupado por url_name). A los superusuarios les agrega los números en
+# el header X-Presupuesto-SQL; si una solicitud se pasa del presupuesto se loguea con el
+# EXPLAIN de sus consultas más lentas. Los acumulados por vista se guardan en memoria y se
+# vuelcan cada tanto a EstadisticaSQLVista (admin) con UPDATE ... F(), sin pisar otros workers.
+#
+# Perfilador por solicitud: un superusuario agrega ?perfilar=1 (o deja la cookie "perfilar") y
+# esa solicitud corre bajo cProfile. En la solicitud solo se guarda el .prof (para pstats/snakeviz)
+# en PERFILADOR['DIRECTORIO']; las pilas colapsadas (.folded, para flamegraph.pl o speedscope) las
+# arma después el comando colapsar_perfiles, fuera del worker que atiende.
+import cProfile
+import heapq
+import itertools
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection, DatabaseError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+logger = logging.getLogger('core.presupuesto_sql')
+logger_perfilador = logging.getLogger('core.perfilador')
+
+PRESUPUESTO_POR_DEFECTO = {
+    'ACTIVO': True,
+    'CONSULTAS': 50,        # más consultas que esto = solicitud excedida
+    'MILISEGUNDOS': 500,    # o más tiempo total de SQL que esto
+    'LENTAS': 5,            # cuántas consultas lentas guardar/explicar por solicitud
+    'VOLCAR_CADA': 60,      # segundos entre volcados de los acumulados a la base
+}
+
+
+def presupuesto():
+    return {**PRESUPUESTO_POR_DEFECTO, **getattr(settings, 'PRESUPUESTO_SQL', {})}
+
+
+class MedidorSQL:
+    """ execute_wrapper que mide cada consulta y se queda con las `lentas` más lentas. """
+
+    def __init__(self, lentas):
+        self.lentas = lentas
+        self.cantidad = 0
+        self.milisegundos = 0.0
+        self.mas_lentas = []  # heap de (ms, orden, sql, params)
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            ms = (time.perf_counter() - inicio) * 1000
+            self.cantidad += 1
+            self.milisegundos += ms
+            item = (ms, self.cantidad, sql, params)
+            if len(self.mas_lentas) < self.lentas:
+                heapq.heappush(self.mas_lentas, item)
+            elif ms > self.mas_lentas[0][0]:
+                heapq.heapreplace(self.mas_lentas, item)
+
+    def ordenadas(self):
+        return sorted(self.mas_lentas, reverse=True)
+
+
+def explicar(sql, params):
+    """ Plan de una consulta SELECT (texto), o '' si no se puede explicar. """
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return ''
+    prefijo = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(prefijo + sql, params)
+            return '\n'.join(' '.join(str(c) for c in fila) for fila in cursor.fetchall())
+    except DatabaseError as e:
+        return f'(sin EXPLAIN: {e})'
+
+
+class _Acumulados:
+    """ Totales por vista desde el último volcado (en memoria, por proceso). """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._por_vista = {}
+        self._ultimo_volcado = time.monotonic()
+
+    def sumar(self, vista, medidor, excedida):
+        lenta = medidor.ordenadas()[0] if medidor.mas_lentas else (0.0, 0, '', None)
+        with self._lock:
+            a = self._por_vista.setdefault(vista, {
+                'solicitudes': 0, 'consultas_total': 0, 'consultas_max': 0, 'milisegundos_total': 0.0,
+                'milisegundos_max': 0.0, 'excedidas': 0, 'consulta_mas_lenta': '', 'consulta_mas_lenta_ms': 0.0,
+            })
+            a['solicitudes'] += 1
+            a['consultas_total'] += medidor.cantidad
+            a['consultas_max'] = max(a['consultas_max'], medidor.cantidad)
+            a['milisegundos_total'] += medidor.milisegundos
+            a['milisegundos_max'] = max(a['milisegundos_max'], medidor.milisegundos)
+            a['excedidas'] += int(excedida)
+            if lenta[0] > a['consulta_mas_lenta_ms']:
+                a['consulta_mas_lenta_ms'], a['consulta_mas_lenta'] = lenta[0], lenta[2]
+
+    def tomar_si_corresponde(self, cada_segundos):
+        """ Devuelve los acumulados y los reinicia si ya pasó el intervalo; si no, None. """
+        with self._lock:
+            if not self._por_vista or time.monotonic() - self._ultimo_volcado < cada_segundos:
+                return None
+            datos, self._por_vista = self._por_vista, {}
+            self._ultimo_volcado = time.monotonic()
+            return datos
+
+
+acumulados = _Acumulados()
+
+
+def volcar(datos):
+    """ Suma los acumulados a EstadisticaSQLVista (una fila por vista). """
+    from .models import EstadisticaSQLVista
+
+    for vista, a in datos.items():
+        with transaction.atomic():
+            EstadisticaSQLVista.objects.get_or_create(vista=vista)
+            cambios = {
+                'solicitudes': F('solicitudes') + a['solicitudes'],
+                'consultas_total': F('consultas_total') + a['consultas_total'],
+                'consultas_max': Greatest('consultas_max', a['consultas_max']),
+                'milisegundos_total': F('milisegundos_total') + a['milisegundos_total'],
+                'milisegundos_max': Greatest('milisegundos_max', a['milisegundos_max']),
+                'excedidas': F('excedidas') + a['excedidas'],
+            }
+            filas = EstadisticaSQLVista.objects.filter(vista=vista)
+            filas.update(**cambios)
+            # La consulta más lenta solo se reemplaza si la nueva es peor
+            filas.filter(consulta_mas_lenta_ms__lt=a['consulta_mas_lenta_ms']).update(
+                consulta_mas_lenta=a['consulta_mas_lenta'], consulta_mas_lenta_ms=a['consulta_mas_lenta_ms']
+            )
+
+
+class PresupuestoSQLMiddleware:
+    """ Va después de AuthenticationMiddleware (usa request.user para el header). """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        config = presupuesto()
+        if not config['ACTIVO']:
+            return self.get_response(request)
+
+        medidor = MedidorSQL(config['LENTAS'])
+        with connection.execute_wrapper(medidor):
+            response = self.get_response(request)
+
+        coincidencia = getattr(request, 'resolver_match', None)
+        # Las URLs que no resuelven (404) van juntas: no queremos una fila por path inventado
+        vista = coincidencia.view_name if coincidencia else '(sin ruta)'
+        excedida = medidor.cantidad > config['CONSULTAS'] or medidor.milisegundos > config['MILISEGUNDOS']
+
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_superuser:
+            lenta = medidor.ordenadas()[0][0] if medidor.mas_lentas else 0
+            response['X-Presupuesto-SQL'] = (
+                f"consultas={medidor.cantidad}; ms={medidor.milisegundos:.1f}; lenta_ms={lenta:.1f}"
+            )
+
+        if excedida:
+            self.loguear_excedida(request, vista, medidor, config)
+
+        acumulados.sumar(vista, medidor, excedida)
+        datos = acumulados.tomar_si_corresponde(config['VOLCAR_CADA'])
+        if datos:
+            try:
+                volcar(datos)
+            except DatabaseError:
+                logger.exception("No se pudieron guardar las estadísticas SQL por vista.")
+        return response
+
+    def loguear_excedida(self, request, vista, medidor, config):
+        detalle = []
+        for ms, _, sql, params in medidor.ordenadas():
+            detalle.append(f"  {ms:.1f} ms: {sql}\n    params={params!r}")
+            plan = explicar(sql, params)
+            if plan:
+                detalle.append('    ' + plan.replace('\n', '\n    '))
+        logger.warning(
+            "Presupuesto SQL excedido en %s (%s %s): %d consultas (máx. %d), %.1f ms (máx. %d)\n%s",
+            vista, request.method, request.path, medidor.cantidad, config['CONSULTAS'],
+            medidor.milisegundos, config['MILISEGUNDOS'], '\n'.join(detalle),
+        )
+
+
+# ==========================================================
+# PERFILADOR (cProfile por solicitud, solo superusuarios)
+# ==========================================================
+
+PERFILADOR_POR_DEFECTO = {
+    'DIRECTORIO': 'perfiles',   # relativo a BASE_DIR si no es absoluto
+    'PARAMETRO': 'perfilar',    # ?perfilar=1 perfila esta solicitud; =on/off prende/apaga la cookie
+    'COOKIE': 'perfilar',
+    'PROFUNDIDAD': 80,          # tope de frames por pila en el .folded
+    'PILAS': 5000,              # tope de líneas del .folded
+}
+
+
+def perfilador():
+    config = {**PERFILADOR_POR_DEFECTO, **getattr(settings, 'PERFILADOR', {})}
+    if not os.path.isabs(config['DIRECTORIO']):
+        config['DIRECTORIO'] = os.path.join(settings.BASE_DIR, config['DIRECTORIO'])
+    return config
+
+
+def _nombre_funcion(funcion):
+    archivo, linea, nombre = funcion
+    if archivo == '~':
+        return nombre  # funciones de C: "<built-in method ...>"
+    return f"{os.path.basename(archivo)}:{linea}:{nombre}"
+
+
+def pilas_colapsadas(stats, profundidad=PERFILADOR_POR_DEFECTO['PROFUNDIDAD'], maximo=PERFILADOR_POR_DEFECTO['PILAS']):
+    """
+    Pilas "a;b;c microsegundos" a partir de un pstats.Stats. cProfile solo guarda pares
+    llamador -> llamado, así que el tiempo propio de cada función se reparte entre sus pilas
+    en proporción al tiempo acumulado que le aportó cada llamador.
+
+    Los caminos posibles crecen exponencialmente con la profundidad (un ORM tiene miles): se
+    expanden primero las pilas con más tiempo y, cuando se llega a `maximo` pilas, las que
+    faltan quedan con todo su tiempo acumulado en su último frame. El total no cambia; solo se
+    pierde el detalle de las más chicas.
+    """
+    datos = stats.stats
+    llamados = {}
+    for funcion, (_, _, _, _, llamadores) in datos.items():
+        for llamador, arista in llamadores.items():
+            llamados.setdefault(llamador, []).append((funcion, arista[3]))
+
+    nombres = {}
+    pilas = {}
+
+    def anotar(pila, micros):
+        if micros < 1:
+            return
+        clave = ';'.join(nombres.get(f) or nombres.setdefault(f, _nombre_funcion(f)) for f in pila)
+        pilas[clave] = pilas.get(clave, 0) + micros
+
+    orden = itertools.count()  # desempate del heap (las tuplas de funciones no se comparan)
+    pendientes = [(-valores[3], next(orden), (funcion,), 1.0) for funcion, valores in datos.items() if not valores[4]]
+    heapq.heapify(pendientes)
+    while pendientes:
+        _, _, pila, fraccion = heapq.heappop(pendientes)
+        funcion = pila[-1]
+        _, _, propio, acumulado, _ = datos[funcion]
+        if len(pila) >= profundidad or len(pilas) + len(pendientes) >= maximo:
+            anotar(pila, acumulado * fraccion * 1e6)
+            continue
+        anotar(pila, propio * fraccion * 1e6)
+        for hijo, acumulado_arista in llamados.get(funcion, ()):
+            # Las recursiones se cortan: su tiempo queda en la primera aparición
+            if hijo in pila or not datos[hijo][3]:
+                continue
+            parte = fraccion * acumulado_arista / datos[hijo][3]
+            if parte * datos[hijo][3] * 1e6 >= 1:
+                heapq.heappush(pendientes, (-parte * datos[hijo][3], next(orden), pila + (hijo,), parte))
+    return [f"{clave} {int(micros)}" for clave, micros in sorted(pilas.items())]
+
+
+class PerfiladorMiddleware:
+    """
+    Va al final de MIDDLEWARE, así el perfil cubre la vista y el render de la plantilla.
+    Sin el parámetro ni la cookie no hace nada más que mirar request.GET/COOKIES.
+    """
+    # cProfile no admite dos perfiles activos a la vez en el mismo proceso (Python 3.12+)
+    _lock = threading.Lock()
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = perfilador()
+
+    def __call__(self, request):
+        parametro = request.GET.get(self.config['PARAMETRO'])
+        if parametro is None and not request.COOKIES.get(self.config['COOKIE']):
+            return self.get_response(request)
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_superuser:
+            return self.get_response(request)
+
+        if parametro == 'off':
+            response = self.get_response(request)
+            response.delete_cookie(self.config['COOKIE'])
+            return response
+        if not self._lock.acquire(blocking=False):
+            response = self.get_response(request)
+            response['X-Perfil'] = 'ocupado (hay otra solicitud perfilándose)'
+            return response
+
+        perfil = cProfile.Profile()
+        try:
+            inicio = time.perf_counter()
+            perfil.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                perfil.disable()
+            milisegundos = (time.perf_counter() - inicio) * 1000
+        finally:
+            self._lock.release()
+
+        try:
+            response['X-Perfil'] = self.guardar(request, perfil, milisegundos)
+        except OSError:
+            logger_perfilador.exception("No se pudo guardar el perfil de %s.", request.path)
+        if parametro == 'on':
+            response.set_cookie(self.config['COOKIE'], '1', httponly=True, samesite='Lax')
+        return response
+
+    def guardar(self, request, perfil, milisegundos):
+        """
+        Escribe <fecha>_<vista>_<ms>ms.prof y devuelve el nombre base. Colapsar las pilas de un
+        perfil grande lleva segundos: lo hace el comando colapsar_perfiles, no la solicitud.
+        """
+        coincidencia = getattr(request, 'resolver_match', None)
+        vista = re.sub(r'[^\w.-]', '_', coincidencia.view_name if coincidencia else 'sin_ruta')
+        base = f"{datetime.now():%Y%m%d-%H%M%S-%f}_{vista}_{milisegundos:.0f}ms"
+        os.makedirs(self.config['DIRECTORIO'], exist_ok=True)
+        ruta = os.path.join(self.config['DIRECTORIO'], base)
+
+        perfil.dump_stats(ruta + '.prof')
+        logger_perfilador.info("Perfil de %s %s (%.0f ms) en %s.prof", request.method, request.path, milisegundos, ruta)
+        return base
+
+
+def colapsar(ruta_prof, config=None):
+    """ Escribe junto a `ruta_prof` su .folded. Devuelve (ruta del .folded, cantidad de pilas). """
+    config = config or perfilador()
+    pilas = pilas_colapsadas(pstats.Stats(ruta_prof), config['PROFUNDIDAD'], config['PILAS'])
+    ruta = os.path.splitext(ruta_prof)[0] + '.folded'
+    with open(ruta, 'w', encoding='utf-8') as archivo:
+        archivo.write('\n'.join(pilas) + '\n')
+    return ruta, len(pilas)
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.7 on 2026-10-19 07:56
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_prediccionventa'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CorridaPrediccion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(help_text="Día desde el que se predice (el 'hoy' de la corrida)")),
+                ('estado', models.CharField(choices=[('en_curso', 'En curso'), ('publicada', 'Publicada')], default='en_curso', max_length=20)),
+                ('creada', models.DateTimeField(default=django.utils.timezone.now)),
+                ('publicada', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FragmentoPrediccion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('producto_desde', models.BigIntegerField(help_text='ID de producto inicial (inclusive)')),
+                ('producto_hasta', models.BigIntegerField(help_text='ID de producto final (inclusive)')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_curso', 'En curso'), ('completado', 'Completado')], default='pendiente', max_length=20)),
+                ('worker', models.CharField(blank=True, max_length=200)),
+                ('lease_hasta', models.DateTimeField(blank=True, null=True)),
+                ('intentos', models.PositiveIntegerField(default=0)),
+                ('corrida', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fragmentos', to='core.corridaprediccion')),
+                ('sucursal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.sucursal')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['corrida', 'estado'], name='core_fragme_corrida_1fff92_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PrediccionVentaBorrador',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('cantidad_predicha', models.DecimalField(decimal_places=2, default=0.0, max_digits=10)),
+                ('corrida', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='borradores', to='core.corridaprediccion')),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.producto')),
+                ('sucursal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.sucursal')),
+            ],
+            options={
+                'unique_together': {('corrida', 'producto', 'sucursal', 'fecha')},
+            },
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.7 on 2026-10-19 07:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_corridaprediccion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MarcaCanasta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ultima_venta_id', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CanastaDia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('transacciones', models.PositiveIntegerField(default=0)),
+                ('sucursal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.sucursal')),
+            ],
+            options={
+                'unique_together': {('sucursal', 'fecha')},
+            },
+        ),
+        migrations.CreateModel(
+            name='CoocurrenciaProductosDia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('transacciones', models.PositiveIntegerField(default=0)),
+                ('producto_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.producto')),
+                ('producto_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.producto')),
+                ('sucursal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.sucursal')),
+            ],
+            options={
+                'unique_together': {('producto_a', 'producto_b', 'sucursal', 'fecha')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SoporteProductoDia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('transacciones', models.PositiveIntegerField(default=0)),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.producto')),
+                ('sucursal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.sucursal')),
+            ],
+            options={
+                'unique_together': {('producto', 'sucursal', 'fecha')},
+            },
+        ),
+    ]
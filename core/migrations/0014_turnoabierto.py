@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-19 08:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_canasta_incremental'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TurnoAbierto',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha_inicio', models.DateTimeField()),
+                ('total_ventas_efectivo', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('total_ventas_tarjeta', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('total_ventas_qr', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('total_cobros_fiado', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('total_pagos_proveedor', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('sucursal', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='turno_abierto', to='core.sucursal')),
+            ],
+        ),
+    ]
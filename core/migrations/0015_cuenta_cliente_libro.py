@@ -0,0 +1,75 @@
+# Generated by Django 5.2.7 on 2026-10-19 08:07
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def cargar_movimientos(apps, schema_editor):
+    """ Arma el libro con las ventas fiadas y pagos que ya existían, en orden cronológico. """
+    Venta = apps.get_model('core', 'Venta')
+    PagoCliente = apps.get_model('core', 'PagoCliente')
+    Cliente = apps.get_model('core', 'Cliente')
+    MovimientoCuentaCliente = apps.get_model('core', 'MovimientoCuentaCliente')
+
+    movimientos = [
+        MovimientoCuentaCliente(cliente_id=v.cliente_id, sucursal_id=v.sucursal_id, fecha=v.fecha_hora,
+                                tipo='venta', monto=v.total, venta_id=v.id)
+        for v in Venta.objects.filter(metodo_pago='cuenta_corriente', cliente__isnull=False).iterator()
+    ] + [
+        MovimientoCuentaCliente(cliente_id=p.cliente_id, sucursal_id=p.sucursal_id, fecha=p.fecha,
+                                tipo='pago', monto=-p.monto, pago_id=p.id)
+        for p in PagoCliente.objects.iterator()
+    ]
+    movimientos.sort(key=lambda m: m.fecha)
+    MovimientoCuentaCliente.objects.bulk_create(movimientos, batch_size=1000)
+
+    # Sin cortes todavía: el primer movimiento nuevo de cada cliente con historia larga genera uno
+    for fila in MovimientoCuentaCliente.objects.values('cliente_id').annotate(n=Count('id')).order_by():
+        Cliente.objects.filter(pk=fila['cliente_id']).update(movimientos_desde_corte=fila['n'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_turnoabierto'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cliente',
+            name='movimientos_desde_corte',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='CorteSaldoCliente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hasta_movimiento_id', models.BigIntegerField()),
+                ('saldo', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('fecha', models.DateTimeField(auto_now_add=True)),
+                ('cliente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cortes_saldo', to='core.cliente')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['cliente', 'hasta_movimiento_id'], name='core_cortes_cliente_8f7448_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MovimientoCuentaCliente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateTimeField(default=django.utils.timezone.now)),
+                ('tipo', models.CharField(choices=[('venta', 'Venta fiada'), ('pago', 'Pago'), ('ajuste', 'Ajuste')], max_length=10)),
+                ('monto', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('cliente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movimientos', to='core.cliente')),
+                ('pago', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movimiento', to='core.pagocliente')),
+                ('sucursal', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.sucursal')),
+                ('venta', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.venta')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['cliente', 'id'], name='core_movimi_cliente_02c027_idx')],
+            },
+        ),
+        migrations.RunPython(cargar_movimientos, migrations.RunPython.noop),
+    ]
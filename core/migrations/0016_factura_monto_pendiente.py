@@ -0,0 +1,47 @@
+# Generated by Django 5.2.7 on 2026-10-19 08:08
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+
+def imputar_pagos_existentes(apps, schema_editor):
+    """ Todas las facturas arrancan impagas y los pagos ya hechos se imputan a las más viejas. """
+    FacturaProveedor = apps.get_model('core', 'FacturaProveedor')
+    PagoProveedor = apps.get_model('core', 'PagoProveedor')
+
+    FacturaProveedor.objects.update(monto_pendiente=F('monto_total'), pagada=False)
+    pagado_por_proveedor = PagoProveedor.objects.values('proveedor_id').annotate(total=Sum('monto')).order_by()
+    for fila in pagado_por_proveedor:
+        restante = fila['total']
+        modificadas = []
+        for factura in FacturaProveedor.objects.filter(proveedor_id=fila['proveedor_id']).order_by(
+            F('fecha_vencimiento').asc(nulls_last=True), 'fecha_factura', 'id'
+        ):
+            if restante <= 0:
+                break
+            aplicado = min(restante, factura.monto_pendiente)
+            factura.monto_pendiente -= aplicado
+            factura.pagada = factura.monto_pendiente == 0
+            restante -= aplicado
+            modificadas.append(factura)
+        FacturaProveedor.objects.bulk_update(modificadas, ['monto_pendiente', 'pagada'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_cuenta_cliente_libro'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='facturaproveedor',
+            name='monto_pendiente',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddIndex(
+            model_name='facturaproveedor',
+            index=models.Index(fields=['pagada', 'fecha_vencimiento'], name='core_factur_pagada_48e646_idx'),
+        ),
+        migrations.RunPython(imputar_pagos_existentes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.7 on 2026-10-19 08:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_factura_monto_pendiente'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='detalleventa',
+            index=models.Index(fields=['producto', 'venta'], name='detalle_producto_venta_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pagocliente',
+            index=models.Index(fields=['sucursal', 'fecha'], name='pagocliente_sucursal_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pagoproveedor',
+            index=models.Index(fields=['sucursal', 'fecha'], name='pagoprov_sucursal_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(condition=models.Q(('cantidad__gt', 0)), fields=['producto', 'sucursal', 'ubicacion', 'fecha_vencimiento'], name='stock_disponible_fefo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(condition=models.Q(('cantidad__gt', 0)), fields=['sucursal', 'fecha_vencimiento'], name='stock_disponible_venc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='venta',
+            index=models.Index(fields=['sucursal', 'fecha_hora'], name='venta_sucursal_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='venta',
+            index=models.Index(fields=['fecha_hora', 'id'], name='venta_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-19 08:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_indices_consultas_frecuentes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstadisticaSQLVista',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vista', models.CharField(max_length=200, unique=True)),
+                ('solicitudes', models.PositiveBigIntegerField(default=0)),
+                ('consultas_total', models.PositiveBigIntegerField(default=0)),
+                ('consultas_max', models.PositiveIntegerField(default=0)),
+                ('milisegundos_total', models.FloatField(default=0)),
+                ('milisegundos_max', models.FloatField(default=0)),
+                ('excedidas', models.PositiveBigIntegerField(default=0, help_text='Solicitudes que pasaron el presupuesto')),
+                ('consulta_mas_lenta', models.TextField(blank=True)),
+                ('consulta_mas_lenta_ms', models.FloatField(default=0)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'estadística SQL por vista',
+                'verbose_name_plural': 'estadísticas SQL por vista',
+            },
+        ),
+    ]
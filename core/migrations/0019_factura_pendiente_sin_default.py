@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 08:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_estadistica_sql_vista'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='facturaproveedor',
+            name='monto_pendiente',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10),
+        ),
+    ]
@@ -3,6 +3,7 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone 
 from datetime import timedelta 
+from .fechas import hoy_local
 
 
 class Sucursal(models.Model):
@@ -58,7 +59,7 @@ class Proveedor(models.Model):
         if self.dia_semana_reparto is None or self.frecuencia_reparto is None:
             return None
 
-        hoy = timezone.now().date()
+        hoy = hoy_local()
         dias_para_proximo_dia = (self.dia_semana_reparto - hoy.weekday() + 7) % 7
 
         # Calculamos la fecha del próximo día de reparto
@@ -117,6 +118,20 @@ class Stock(models.Model):
         null=True, 
         blank=True
     )
+
+    class Meta:
+        indexes = [
+            # FEFO de la venta/reposición: lotes con stock de un producto en una sucursal y ubicación, por vencimiento
+            models.Index(
+                fields=['producto', 'sucursal', 'ubicacion', 'fecha_vencimiento'],
+                condition=models.Q(cantidad__gt=0), name='stock_disponible_fefo_idx',
+            ),
+            # Alertas y vista de stock: lotes con stock de una sucursal por vencimiento
+            models.Index(
+                fields=['sucursal', 'fecha_vencimiento'],
+                condition=models.Q(cantidad__gt=0), name='stock_disponible_venc_idx',
+            ),
+        ]
     
     def __str__(self):
         if self.fecha_vencimiento:
@@ -135,6 +150,8 @@ class Cliente(models.Model):
 
     # Este campo calculará el saldo total, es más eficiente
     saldo_actual = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Movimientos desde el último CorteSaldoCliente (ver core/cuentas.py)
+    movimientos_desde_corte = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.nombre_completo
@@ -155,6 +172,14 @@ class Venta(models.Model):
     total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     cuotas = models.PositiveIntegerField(default=1, help_text="Número de cuotas si el pago es con crédito")
     sucursal = models.ForeignKey(Sucursal, on_delete=models.CASCADE)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sucursal', 'fecha_hora'], name='venta_sucursal_fecha_idx'),
+            # Historial y reportes de todas las sucursales (superusuario)
+            models.Index(fields=['fecha_hora', 'id'], name='venta_fecha_idx'),
+        ]
+
     def __str__(self):
         return f"Venta #{self.id} - {self.fecha_hora.strftime('%Y-%m-%d %H:%M')}"
 
@@ -165,6 +190,9 @@ class DetalleVenta(models.Model):
     precio_unitario = models.DecimalField(max_digits=10, decimal_places=2)
     subtotal = models.DecimalField(max_digits=10, decimal_places=2)
 
+    class Meta:
+        indexes = [models.Index(fields=['producto', 'venta'], name='detalle_producto_venta_idx')]
+
     def __str__(self):
         return f"{self.cantidad} x {self.producto.nombre} en Venta #{self.venta.id}"
     # core/models.py
@@ -212,9 +240,46 @@ class PagoCliente(models.Model):
     fecha = models.DateTimeField(default=timezone.now)
     monto = models.DecimalField(max_digits=10, decimal_places=2)
 
+    class Meta:
+        indexes = [models.Index(fields=['sucursal', 'fecha'], name='pagocliente_sucursal_fecha_idx')]
+
     def __str__(self):
         return f"Pago de {self.cliente.nombre_completo} - ${self.monto}"
     
+class MovimientoCuentaCliente(models.Model):
+    """
+    Libro de la cuenta corriente: una fila por cada venta fiada (monto positivo, debe)
+    o pago (monto negativo, haber). Nunca se edita ni se borra; el orden es el id.
+    """
+    TIPO_CHOICES = [
+        ('venta', 'Venta fiada'),
+        ('pago', 'Pago'),
+        ('ajuste', 'Ajuste'),
+    ]
+    cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE, related_name='movimientos')
+    sucursal = models.ForeignKey(Sucursal, on_delete=models.SET_NULL, null=True, blank=True)
+    fecha = models.DateTimeField(default=timezone.now)
+    tipo = models.CharField(max_length=10, choices=TIPO_CHOICES)
+    monto = models.DecimalField(max_digits=10, decimal_places=2)
+    venta = models.ForeignKey(Venta, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    pago = models.OneToOneField(PagoCliente, on_delete=models.SET_NULL, null=True, blank=True, related_name='movimiento')
+
+    class Meta:
+        indexes = [models.Index(fields=['cliente', 'id'])]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} de {self.cliente.nombre_completo} - ${self.monto}"
+
+class CorteSaldoCliente(models.Model):
+    """ Saldo del libro de un cliente hasta un movimiento: el estado de cuenta arranca desde acá. """
+    cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE, related_name='cortes_saldo')
+    hasta_movimiento_id = models.BigIntegerField()
+    saldo = models.DecimalField(max_digits=12, decimal_places=2)
+    fecha = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['cliente', 'hasta_movimiento_id'])]
+
 class FacturaProveedor(models.Model):
     """ Registra una factura (compra) que le debés a un proveedor. """
     proveedor = models.ForeignKey(Proveedor, on_delete=models.CASCADE, related_name='facturas')
@@ -224,6 +289,17 @@ class FacturaProveedor(models.Model):
     monto_total = models.DecimalField(max_digits=10, decimal_places=2)
     fecha_vencimiento = models.DateField(null=True, blank=True)
     pagada = models.BooleanField(default=False)
+    # Lo que falta pagar: los pagos al proveedor se imputan a las facturas más viejas primero.
+    # Sin valor al crearla (admin, shell, importaciones) se debe entera: ver save()
+    monto_pendiente = models.DecimalField(max_digits=10, decimal_places=2, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['pagada', 'fecha_vencimiento'])]
+
+    def save(self, *args, **kwargs):
+        if self.monto_pendiente is None:
+            self.monto_pendiente = self.monto_total
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Factura {self.numero_factura} de {self.proveedor.nombre} - ${self.monto_total}"
@@ -235,6 +311,9 @@ class PagoProveedor(models.Model):
     fecha = models.DateTimeField(default=timezone.now)
     monto = models.DecimalField(max_digits=10, decimal_places=2)
 
+    class Meta:
+        indexes = [models.Index(fields=['sucursal', 'fecha'], name='pagoprov_sucursal_fecha_idx')]
+
     def __str__(self):
         return f"Pago a {self.proveedor.nombre} - ${self.monto}"
     
@@ -263,6 +342,27 @@ class CierreTurno(models.Model):
         total_calculado_efectivo = self.total_ventas_efectivo + self.total_cobros_fiado - self.total_pagos_proveedor
         return self.monto_en_caja_declarado - total_calculado_efectivo
     
+class TurnoAbierto(models.Model):
+    """
+    Acumulador del turno en curso de cada sucursal. Cada venta y pago le suma su monto
+    (ver core/turnos.py), así cerrar el turno no tiene que recorrer los movimientos.
+    """
+    sucursal = models.OneToOneField(Sucursal, on_delete=models.CASCADE, related_name='turno_abierto')
+    fecha_inicio = models.DateTimeField()
+
+    total_ventas_efectivo = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    total_ventas_tarjeta = models.DecimalField(max_digits=10, decimal_places=2, default=0) # Suma de débito y crédito
+    total_ventas_qr = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    total_cobros_fiado = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    total_pagos_proveedor = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    @property
+    def caja_calculada(self):
+        return self.total_ventas_efectivo + self.total_cobros_fiado - self.total_pagos_proveedor
+
+    def __str__(self):
+        return f"Turno abierto de {self.sucursal.nombre} desde {self.fecha_inicio.strftime('%d/%m/%Y %H:%M')}"
+
 class PrediccionVenta(models.Model):
     producto = models.ForeignKey(Producto, on_delete=models.CASCADE)
     sucursal = models.ForeignKey(Sucursal, on_delete=models.CASCADE)
@@ -274,4 +374,134 @@ class PrediccionVenta(models.Model):
         unique_together = ('producto', 'sucursal', 'fecha')
 
     def __str__(self):
-        return f"{self.producto.nombre} ({self.sucursal.nombre}) - {self.fecha}: {self.cantidad_predicha}"
\ No newline at end of file
+        return f"{self.producto.nombre} ({self.sucursal.nombre}) - {self.fecha}: {self.cantidad_predicha}"
+
+class CorridaPrediccion(models.Model):
+    """ Una ejecución distribuida de generar_predicciones (varios workers/máquinas). """
+    ESTADO_CHOICES = [
+        ('en_curso', 'En curso'),
+        ('publicada', 'Publicada'),
+    ]
+    fecha = models.DateField(help_text="Día desde el que se predice (el 'hoy' de la corrida)")
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='en_curso')
+    creada = models.DateTimeField(default=timezone.now)
+    publicada = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Corrida #{self.id} ({self.fecha}) - {self.get_estado_display()}"
+
+
+class FragmentoPrediccion(models.Model):
+    """
+    Un pedazo del espacio (sucursal, producto) de una corrida.
+    Los workers lo toman con un 'lease' que deben renovar; si un worker muere,
+    el lease vence y otro worker lo retoma.
+    """
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('en_curso', 'En curso'),
+        ('completado', 'Completado'),
+    ]
+    corrida = models.ForeignKey(CorridaPrediccion, on_delete=models.CASCADE, related_name='fragmentos')
+    sucursal = models.ForeignKey(Sucursal, on_delete=models.CASCADE)
+    producto_desde = models.BigIntegerField(help_text="ID de producto inicial (inclusive)")
+    producto_hasta = models.BigIntegerField(help_text="ID de producto final (inclusive)")
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='pendiente')
+    worker = models.CharField(max_length=200, blank=True)
+    lease_hasta = models.DateTimeField(null=True, blank=True)
+    intentos = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['corrida', 'estado'])]
+
+    def __str__(self):
+        return f"Fragmento {self.id} de corrida #{self.corrida_id} ({self.sucursal_id}: {self.producto_desde}-{self.producto_hasta})"
+
+
+class PrediccionVentaBorrador(models.Model):
+    """ Predicciones de una corrida todavía no publicada (el dashboard no las ve). """
+    corrida = models.ForeignKey(CorridaPrediccion, on_delete=models.CASCADE, related_name='borradores')
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE)
+    sucursal = models.ForeignKey(Sucursal, on_delete=models.CASCADE)
+    fecha = models.DateField()
+    cantidad_predicha = models.DecimalField(max_digits=10, decimal_places=2, default=0.0)
+
+    class Meta:
+        unique_together = ('corrida', 'producto', 'sucursal', 'fecha')
+
+
+# --- Análisis de canasta incremental ---
+# Contadores por sucursal y día: permiten filtrar por ventana de fechas y sucursal
+# sin volver a recorrer todas las ventas.
+class CanastaDia(models.Model):
+    """ Ventas con 2 o más productos distintos ("canastas") por sucursal y día. """
+    sucursal = models.ForeignKey(Sucursal, on_delete=models.CASCADE)
+    fecha = models.DateField()
+    transacciones = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('sucursal', 'fecha')
+
+
+class SoporteProductoDia(models.Model):
+    """ En cuántas canastas apareció cada producto, por sucursal y día. """
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE)
+    sucursal = models.ForeignKey(Sucursal, on_delete=models.CASCADE)
+    fecha = models.DateField()
+    transacciones = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('producto', 'sucursal', 'fecha')
+
+
+class CoocurrenciaProductosDia(models.Model):
+    """ En cuántas canastas aparecieron juntos dos productos (producto_a.id < producto_b.id). """
+    producto_a = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='+')
+    producto_b = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='+')
+    sucursal = models.ForeignKey(Sucursal, on_delete=models.CASCADE)
+    fecha = models.DateField()
+    transacciones = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('producto_a', 'producto_b', 'sucursal', 'fecha')
+
+
+class MarcaCanasta(models.Model):
+    """ Marca de agua: última Venta.id ya volcada en los contadores de canasta (fila única). """
+    ultima_venta_id = models.BigIntegerField(default=0)
+
+    def save(self, *args, **kwargs):
+        self.pk = 1
+        super().save(*args, **kwargs)
+
+
+class EstadisticaSQLVista(models.Model):
+    """
+    Acumulado de consultas SQL por vista (url_name), volcado periódicamente por
+    core.middleware.PresupuestoSQLMiddleware. Se ve en el admin.
+    """
+    vista = models.CharField(max_length=200, unique=True)
+    solicitudes = models.PositiveBigIntegerField(default=0)
+    consultas_total = models.PositiveBigIntegerField(default=0)
+    consultas_max = models.PositiveIntegerField(default=0)
+    milisegundos_total = models.FloatField(default=0)
+    milisegundos_max = models.FloatField(default=0)
+    excedidas = models.PositiveBigIntegerField(default=0, help_text="Solicitudes que pasaron el presupuesto")
+    consulta_mas_lenta = models.TextField(blank=True)
+    consulta_mas_lenta_ms = models.FloatField(default=0)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'estadística SQL por vista'
+        verbose_name_plural = 'estadísticas SQL por vista'
+
+    @property
+    def consultas_promedio(self):
+        return round(self.consultas_total / self.solicitudes, 1) if self.solicitudes else 0
+
+    @property
+    def milisegundos_promedio(self):
+        return round(self.milisegundos_total / self.solicitudes, 1) if self.solicitudes else 0
+
+    def __str__(self):
+        return f"{self.vista}: {self.consultas_promedio} consultas / {self.milisegundos_promedio} ms promedio"
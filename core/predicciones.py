@@ -0,0 +1,334 @@
+# core/predicciones.py
+# Lógica compartida de la IA de predicción de ventas (Prophet).
+# La usan los comandos de management; las vistas solo leen PrediccionVenta.
+from datetime import timedelta
+from decimal import Decimal
+
+import pandas as pd
+from django.db import connection, transaction
+from django.db.models import Exists, F, OuterRef, Q, Sum
+from django.utils import timezone
+
+from .models import (
+    DetalleVenta, PrediccionVenta, CorridaPrediccion, FragmentoPrediccion, PrediccionVentaBorrador
+)
+from .fechas import filtro_dias, dia_truncado
+from . import metricas
+
+# Mínimo de días con ventas para que Prophet no falle matemáticamente
+MIN_DIAS_HISTORIA = 5
+DIAS_A_PREDECIR = 7
+# Los productos sin categoría se agrupan juntos (los ids reales arrancan en 1)
+SIN_CATEGORIA = 0
+
+
+def predecir_serie(df, hoy, dias=DIAS_A_PREDECIR):
+    """
+    Entrena un Prophet sobre un DataFrame con columnas 'ds' y 'y' y devuelve
+    una lista de (fecha, cantidad) desde HOY en adelante.
+    """
+    from prophet import Prophet  # Import pesado: solo cuando realmente entrenamos
+
+    try:
+        with metricas.predicciones_segundos.medir():
+            # daily_seasonality=False porque no tenemos datos hora a hora suficientes
+            # weekly_seasonality=True es CLAVE para kioscos (viernes != lunes)
+            m = Prophet(daily_seasonality=False, weekly_seasonality=True, yearly_seasonality=False)
+            m.fit(df)
+
+            future = m.make_future_dataframe(periods=dias)
+            forecast = m.predict(future)
+    except Exception:
+        metricas.predicciones_series.inc(resultado='error')
+        raise
+    metricas.predicciones_series.inc(resultado='ok')
+
+    # Filtramos solo las predicciones futuras.
+    # 'yhat' es el valor predicho. Usamos max(0, ...) porque no existen ventas negativas
+    futuras = forecast[forecast['ds'].dt.date >= hoy]
+    return [(fila.ds.date(), max(0.0, float(fila.yhat))) for fila in futuras.itertuples()]
+
+
+def _a_serie(filas, columna_fecha='fecha', columna_valor='cantidad_total'):
+    df = pd.DataFrame(filas)
+    return df.rename(columns={columna_fecha: 'ds', columna_valor: 'y'})[['ds', 'y']]
+
+
+class PrediccionJerarquica:
+    """
+    Predicción por (categoría, sucursal) + modelos propios solo para los más vendidos.
+
+    - Cada sucursal tiene sus `top_vendedores` productos con modelo propio.
+    - El resto de la categoría se predice con UN modelo (la serie de la categoría
+      menos lo que ya explican los top) y se reparte entre sus productos según
+      la participación de cada uno en las ventas de los últimos `dias_participacion`.
+    Así pasamos de (productos x sucursales) modelos a (categorías + top) x sucursales.
+    """
+
+    def __init__(self, hoy, top_vendedores=20, dias_participacion=28):
+        self.hoy = hoy
+        self.top_vendedores = top_vendedores
+        self.dias_participacion = dias_participacion
+        self.modelos_entrenados = 0
+        self.errores = []
+
+    def participaciones(self):
+        """
+        Una sola consulta: unidades vendidas por (sucursal, producto) en la ventana reciente.
+        Devuelve {sucursal_id: [(producto_id, categoria_id, cantidad), ...]} ordenado de mayor a menor.
+        """
+        inicio = self.hoy - timedelta(days=self.dias_participacion)
+        filas = DetalleVenta.objects.filter(
+            **filtro_dias('venta__fecha_hora', inicio),
+            producto__isnull=False,
+        ).values(
+            'venta__sucursal_id', 'producto_id', 'producto__categoria_id'
+        ).annotate(cantidad=Sum('cantidad')).order_by('venta__sucursal_id', '-cantidad')
+
+        por_sucursal = {}
+        for f in filas:
+            por_sucursal.setdefault(f['venta__sucursal_id'], []).append(
+                (f['producto_id'], f['producto__categoria_id'] or SIN_CATEGORIA, f['cantidad'])
+            )
+        return por_sucursal
+
+    def series_categoria(self):
+        """ Ventas diarias por (sucursal, categoría), todo el historial, en una consulta. """
+        df = pd.DataFrame(list(
+            DetalleVenta.objects.filter(producto__isnull=False).annotate(
+                fecha=dia_truncado('venta__fecha_hora')
+            ).values('venta__sucursal_id', 'producto__categoria_id', 'fecha').annotate(
+                cantidad_total=Sum('cantidad')
+            ).order_by()
+        ), columns=['venta__sucursal_id', 'producto__categoria_id', 'fecha', 'cantidad_total'])
+        df['producto__categoria_id'] = df['producto__categoria_id'].fillna(SIN_CATEGORIA).astype(int)
+        return df
+
+    def series_top(self, top_ids):
+        """ Ventas diarias de los productos top de cada sucursal, en una consulta. """
+        todos = {p for ids in top_ids.values() for p in ids}
+        if not todos:
+            return pd.DataFrame(columns=['venta__sucursal_id', 'producto_id', 'producto__categoria_id', 'fecha', 'cantidad_total'])
+        df = pd.DataFrame(list(
+            DetalleVenta.objects.filter(producto_id__in=todos).annotate(
+                fecha=dia_truncado('venta__fecha_hora')
+            ).values('venta__sucursal_id', 'producto_id', 'producto__categoria_id', 'fecha').annotate(
+                cantidad_total=Sum('cantidad')
+            ).order_by()
+        ), columns=['venta__sucursal_id', 'producto_id', 'producto__categoria_id', 'fecha', 'cantidad_total'])
+        df['producto__categoria_id'] = df['producto__categoria_id'].fillna(SIN_CATEGORIA).astype(int)
+        # Un producto puede ser top en una sucursal y no en otra
+        en_top = [p in top_ids.get(s, ()) for s, p in zip(df['venta__sucursal_id'], df['producto_id'])]
+        return df[en_top]
+
+    def _entrenar(self, filas, etiqueta):
+        if len(filas) < MIN_DIAS_HISTORIA:
+            return None
+        try:
+            resultado = predecir_serie(_a_serie(filas), self.hoy)
+            self.modelos_entrenados += 1
+            return resultado
+        except Exception as e:
+            self.errores.append(f"{etiqueta}: {e}")
+            return None
+
+    def predecir_sucursal(self, sucursal_id, ranking, df_cat, df_top):
+        """ Devuelve la lista de PrediccionVenta (sin guardar) para una sucursal. """
+        top = {p for p, _, _ in ranking[:self.top_vendedores]}
+        nuevas = []
+
+        # 1. Modelos propios para los más vendidos
+        top_suc = df_top[df_top['venta__sucursal_id'] == sucursal_id]
+        for producto_id, serie in top_suc.groupby('producto_id'):
+            resultado = self._entrenar(serie.sort_values('fecha').to_dict('records'), f"producto {producto_id}")
+            for fecha, cantidad in resultado or []:
+                nuevas.append((producto_id, fecha, cantidad))
+
+        # 2. Un modelo por categoría para "el resto" y reparto por participación
+        cat_suc = df_cat[df_cat['venta__sucursal_id'] == sucursal_id]
+        top_por_dia = top_suc.groupby(['producto__categoria_id', 'fecha'])['cantidad_total'].sum()
+
+        resto_por_categoria = {}
+        for producto_id, categoria_id, cantidad in ranking:
+            if producto_id not in top:
+                resto_por_categoria.setdefault(categoria_id, []).append((producto_id, cantidad))
+
+        for categoria_id, productos in resto_por_categoria.items():
+            serie = cat_suc[cat_suc['producto__categoria_id'] == categoria_id]
+            if serie.empty:
+                continue
+            serie = serie.sort_values('fecha')
+            descontar = [top_por_dia.get((categoria_id, f), 0) for f in serie['fecha']]
+            serie = serie.assign(cantidad_total=(serie['cantidad_total'] - descontar).clip(lower=0))
+
+            resultado = self._entrenar(serie.to_dict('records'), f"categoría {categoria_id}")
+            if not resultado:
+                continue
+
+            total_resto = sum(c for _, c in productos)
+            for producto_id, cantidad in productos:
+                participacion = cantidad / total_resto
+                for fecha, cantidad_cat in resultado:
+                    nuevas.append((producto_id, fecha, cantidad_cat * participacion))
+
+        return [
+            PrediccionVenta(
+                producto_id=producto_id,
+                sucursal_id=sucursal_id,
+                fecha=fecha,
+                cantidad_predicha=Decimal(str(round(cantidad, 2))),
+            )
+            for producto_id, fecha, cantidad in nuevas
+        ]
+
+
+# ==============================================================================
+# CORRIDAS DISTRIBUIDAS (fragmentos con lease)
+# ==============================================================================
+def planificar_corrida(hoy, tamano_fragmento=200):
+    """
+    Crea una corrida y la divide en fragmentos de hasta `tamano_fragmento` productos
+    por sucursal. Solo entran los pares (sucursal, producto) que alguna vez vendieron.
+    """
+    pares = DetalleVenta.objects.filter(producto__isnull=False).values_list(
+        'venta__sucursal_id', 'producto_id'
+    ).distinct().order_by('venta__sucursal_id', 'producto_id')
+
+    productos_por_sucursal = {}
+    for sucursal_id, producto_id in pares:
+        productos_por_sucursal.setdefault(sucursal_id, []).append(producto_id)
+
+    with transaction.atomic():
+        corrida = CorridaPrediccion.objects.create(fecha=hoy)
+        fragmentos = []
+        for sucursal_id, ids in productos_por_sucursal.items():
+            for i in range(0, len(ids), tamano_fragmento):
+                bloque = ids[i:i + tamano_fragmento]
+                fragmentos.append(FragmentoPrediccion(
+                    corrida=corrida, sucursal_id=sucursal_id,
+                    producto_desde=bloque[0], producto_hasta=bloque[-1],
+                ))
+        FragmentoPrediccion.objects.bulk_create(fragmentos, batch_size=1000)
+    return corrida
+
+
+def _disponibles(corrida, ahora):
+    # Pendientes, o tomados por un worker cuyo lease ya venció (worker muerto)
+    return FragmentoPrediccion.objects.filter(corrida=corrida).filter(
+        Q(estado='pendiente') | Q(estado='en_curso', lease_hasta__lt=ahora)
+    )
+
+
+def tomar_fragmento(corrida, worker, segundos_lease):
+    """
+    Reclama un fragmento libre para `worker`. Devuelve el fragmento o None si no queda ninguno.
+
+    En PostgreSQL usamos SELECT ... FOR UPDATE SKIP LOCKED para que los workers no se pisen.
+    En todos los motores el UPDATE condicional final es el que decide quién se lo queda
+    (si otro worker lo tomó entre medio, el UPDATE afecta 0 filas y probamos con el siguiente).
+    """
+    while True:
+        ahora = timezone.now()
+        with transaction.atomic():
+            candidatos = _disponibles(corrida, ahora).order_by('id')
+            if connection.features.has_select_for_update_skip_locked:
+                candidatos = candidatos.select_for_update(skip_locked=True)
+            ids = list(candidatos.values_list('id', flat=True)[:10])
+            if not ids:
+                return None
+
+            for fragmento_id in ids:
+                tomado = _disponibles(corrida, ahora).filter(id=fragmento_id).update(
+                    estado='en_curso',
+                    worker=worker,
+                    lease_hasta=ahora + timedelta(seconds=segundos_lease),
+                    intentos=F('intentos') + 1,
+                )
+                if tomado:
+                    return FragmentoPrediccion.objects.get(id=fragmento_id)
+
+
+def renovar_lease(fragmento, worker, segundos_lease):
+    """ Extiende el lease. Devuelve False si lo perdimos (otro worker lo retomó). """
+    return FragmentoPrediccion.objects.filter(
+        id=fragmento.id, worker=worker, estado='en_curso'
+    ).update(lease_hasta=timezone.now() + timedelta(seconds=segundos_lease)) == 1
+
+
+def completar_fragmento(fragmento, worker, predicciones):
+    """
+    Guarda los borradores del fragmento y lo marca completado, todo en una transacción.
+    Si el lease ya no es nuestro no se guarda nada (el otro worker hará el trabajo).
+    """
+    with transaction.atomic():
+        marcado = FragmentoPrediccion.objects.filter(
+            id=fragmento.id, worker=worker, estado='en_curso'
+        ).update(estado='completado', lease_hasta=None)
+        if not marcado:
+            return False
+
+        PrediccionVentaBorrador.objects.filter(
+            corrida_id=fragmento.corrida_id,
+            sucursal_id=fragmento.sucursal_id,
+            producto_id__gte=fragmento.producto_desde,
+            producto_id__lte=fragmento.producto_hasta,
+        ).delete()
+        PrediccionVentaBorrador.objects.bulk_create(predicciones, batch_size=1000)
+    return True
+
+
+def series_fragmento(fragmento):
+    """ Ventas diarias de todos los productos del fragmento, en una consulta. """
+    filas = DetalleVenta.objects.filter(
+        venta__sucursal_id=fragmento.sucursal_id,
+        producto_id__gte=fragmento.producto_desde,
+        producto_id__lte=fragmento.producto_hasta,
+    ).annotate(
+        fecha=dia_truncado('venta__fecha_hora')
+    ).values('producto_id', 'fecha').annotate(
+        cantidad_total=Sum('cantidad')
+    ).order_by('producto_id', 'fecha')
+
+    series = {}
+    for f in filas:
+        series.setdefault(f['producto_id'], []).append(f)
+    return series
+
+
+def publicar_corrida(corrida):
+    """
+    Reemplaza las predicciones visibles por las de la corrida en UNA transacción:
+    el dashboard ve las viejas o las nuevas, nunca una mezcla.
+    """
+    with transaction.atomic():
+        corrida = CorridaPrediccion.objects.select_for_update().get(id=corrida.id)
+        if corrida.estado != 'en_curso':
+            raise ValueError(f"La corrida #{corrida.id} ya está {corrida.get_estado_display().lower()}.")
+        faltantes = corrida.fragmentos.exclude(estado='completado').count()
+        if faltantes:
+            raise ValueError(f"La corrida #{corrida.id} tiene {faltantes} fragmentos sin completar.")
+
+        # Solo se reemplazan los pares (producto, sucursal) que la corrida predijo: los que no
+        # produjeron borradores (poca historia, error de Prophet) conservan su predicción anterior
+        PrediccionVenta.objects.filter(fecha__gte=corrida.fecha).filter(Exists(
+            PrediccionVentaBorrador.objects.filter(
+                corrida=corrida, producto_id=OuterRef('producto_id'), sucursal_id=OuterRef('sucursal_id')
+            )
+        )).delete()
+
+        # INSERT ... SELECT: los borradores no pasan por Python
+        destino = PrediccionVenta._meta.db_table
+        origen = PrediccionVentaBorrador._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {destino} (producto_id, sucursal_id, fecha, cantidad_predicha) "
+                f"SELECT producto_id, sucursal_id, fecha, cantidad_predicha FROM {origen} WHERE corrida_id = %s",
+                [corrida.id],
+            )
+            publicadas = cursor.rowcount
+
+        corrida.borradores.all().delete()
+        corrida.estado = 'publicada'
+        corrida.publicada = timezone.now()
+        corrida.save(update_fields=['estado', 'publicada'])
+    return publicadas
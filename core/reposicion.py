@@ -0,0 +1,145 @@
+# core/reposicion.py
+# Motor de sugerencias de compra: cuánto pedir de cada producto para cubrir la demanda
+# predicha hasta la entrega siguiente del proveedor, más un stock de seguridad.
+# Todo se calcula de una vez para todos los productos de la sucursal (vectorizado con NumPy).
+import math
+from datetime import timedelta
+
+import numpy as np
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+
+from .models import Producto, Proveedor, PrediccionVenta, DetalleVenta
+from .fechas import hoy_local, filtro_dias, dia_truncado
+
+# Si el proveedor no tiene día/frecuencia de reparto cargados asumimos entrega semanal
+DIAS_REPARTO_POR_DEFECTO = 7
+DIAS_HISTORIA = 28
+# z del nivel de servicio (1.65 ~ 95%: 1 de cada 20 ciclos podría quedar corto)
+Z_NIVEL_SERVICIO = 1.65
+
+SIN_PROVEEDOR = "Sin Proveedor Asignado"
+
+
+def _entregas_por_proveedor(hoy):
+    """
+    {proveedor_id: (días hasta la próxima entrega, días entre entregas, nombre, tiene calendario)}
+    en una consulta.
+    """
+    entregas = {}
+    for proveedor in Proveedor.objects.all():
+        ciclo = proveedor.frecuencia_reparto or DIAS_REPARTO_POR_DEFECTO
+        proxima = proveedor.proxima_fecha_entrega()
+        dias = (proxima - hoy).days if proxima else DIAS_REPARTO_POR_DEFECTO
+        # Si reparte hoy, el pedido de hoy ya no llega: entra en la entrega siguiente
+        entregas[proveedor.id] = (dias if dias > 0 else ciclo, ciclo, proveedor.nombre, proxima is not None)
+    return entregas
+
+
+def calcular_reposicion(sucursal=None, hoy=None, z=Z_NIVEL_SERVICIO, dias_historia=DIAS_HISTORIA):
+    """
+    Devuelve {proveedor_id: {'nombre': ..., 'productos': [sugerencia, ...]}} solo con los productos
+    que hay que pedir, ordenado por nombre de proveedor. Los productos sin proveedor van bajo None.
+
+    Para cada producto:
+      horizonte = días hasta la próxima entrega + un ciclo de reparto
+                  (lo que pedimos hoy tiene que durar hasta la entrega siguiente)
+      demanda   = suma de PrediccionVenta dentro del horizonte; si la predicción no llega
+                  tan lejos se extiende con su promedio diario, y si no hay predicción
+                  se usa el promedio de ventas de los últimos `dias_historia` días
+      seguridad = max(z * desvío diario * raíz(horizonte), stock_minimo)
+      pedir     = demanda + seguridad - stock actual (redondeado hacia arriba)
+    """
+    hoy = hoy or hoy_local()
+    filtro_lotes = Q(lotes__sucursal=sucursal) if sucursal else None
+
+    # 1. Productos y stock actual (una consulta)
+    productos = list(
+        Producto.objects.annotate(
+            stock_total=Coalesce(Sum('lotes__cantidad', filter=filtro_lotes), 0),
+            cantidad_lotes=Count('lotes', filter=filtro_lotes),
+        ).values('id', 'nombre', 'stock_minimo', 'proveedor_id', 'stock_total', 'cantidad_lotes').order_by('id')
+    )
+    if not productos:
+        return {}
+
+    ids = np.array([p['id'] for p in productos])
+    stock = np.array([p['stock_total'] for p in productos], dtype=float)
+    stock_minimo = np.array([p['stock_minimo'] for p in productos], dtype=float)
+    maneja_producto = np.array([p['cantidad_lotes'] > 0 for p in productos])
+
+    # 2. Calendario de entregas (una consulta)
+    entregas = _entregas_por_proveedor(hoy)
+    sin_calendario = (DIAS_REPARTO_POR_DEFECTO, DIAS_REPARTO_POR_DEFECTO, SIN_PROVEEDOR, False)
+    calendario = [entregas.get(p['proveedor_id'], sin_calendario) for p in productos]
+    dias_entrega = np.array([c[0] for c in calendario])
+    horizonte = dias_entrega + np.array([c[1] for c in calendario])
+
+    # 3. Predicciones desde hoy (una consulta) -> matriz producto x día
+    filtro = {'sucursal': sucursal} if sucursal else {}
+    predicciones = list(
+        PrediccionVenta.objects.filter(fecha__gte=hoy, **filtro).values('producto_id', 'fecha').annotate(
+            cantidad=Sum('cantidad_predicha')
+        ).order_by().values_list('producto_id', 'fecha', 'cantidad')
+    )
+    dias_pred = max([(f - hoy).days + 1 for _, f, _ in predicciones], default=1)
+    pred = np.zeros((len(ids), dias_pred))
+    tiene_dia = np.zeros((len(ids), dias_pred), dtype=bool)
+    if predicciones:
+        fila = np.searchsorted(ids, [p for p, _, _ in predicciones])
+        columna = np.array([(f - hoy).days for _, f, _ in predicciones])
+        pred[fila, columna] = [float(c) for _, _, c in predicciones]
+        tiene_dia[fila, columna] = True
+
+    # 4. Historial reciente (una consulta) -> matriz producto x día para promedio y desvío
+    inicio_historia = hoy - timedelta(days=dias_historia)
+    filtro_venta = {'venta__sucursal': sucursal} if sucursal else {}
+    historial = list(
+        DetalleVenta.objects.filter(
+            producto__isnull=False, **filtro_dias('venta__fecha_hora', inicio_historia), **filtro_venta
+        ).annotate(fecha=dia_truncado('venta__fecha_hora')).values('producto_id', 'fecha').annotate(
+            cantidad=Sum('cantidad')
+        ).order_by().values_list('producto_id', 'fecha', 'cantidad')
+    )
+    hist = np.zeros((len(ids), dias_historia))
+    historial = [h for h in historial if 0 <= (h[1] - inicio_historia).days < dias_historia]
+    if historial:
+        fila = np.searchsorted(ids, [p for p, _, _ in historial])
+        columna = np.array([(f - inicio_historia).days for _, f, _ in historial])
+        np.add.at(hist, (fila, columna), [c for _, _, c in historial])
+    tasa_historica = hist.mean(axis=1)
+    desvio = hist.std(axis=1)
+
+    # 5. Demanda dentro del horizonte (vectorizado)
+    dias_con_pred = tiene_dia.sum(axis=1)
+    tiene_pred = dias_con_pred > 0
+    tasa_pred = np.divide(pred.sum(axis=1), dias_con_pred, out=np.zeros(len(ids)), where=tiene_pred)
+    en_horizonte = np.arange(dias_pred)[None, :] < horizonte[:, None]
+    demanda_pred = (pred * en_horizonte).sum(axis=1) + tasa_pred * np.maximum(0, horizonte - dias_pred)
+    demanda = np.where(tiene_pred, demanda_pred, tasa_historica * horizonte)
+
+    seguridad = np.maximum(z * desvio * np.sqrt(horizonte), stock_minimo)
+    a_pedir = np.ceil(np.maximum(0, demanda + seguridad - stock)).astype(int)
+    # Como antes, solo productos que la sucursal maneja (tuvo lotes) o que se están vendiendo
+    a_pedir[~(maneja_producto | (demanda > 0))] = 0
+
+    # 6. Agrupamos por proveedor solo lo que hay que pedir (por id: dos proveedores pueden llamarse igual)
+    sugerencias = {}
+    for i in np.flatnonzero(a_pedir > 0):
+        producto = productos[i]
+        grupo = sugerencias.setdefault(producto['proveedor_id'], {'nombre': calendario[i][2], 'productos': []})
+        grupo['productos'].append({
+            'producto_id': producto['id'],
+            'proveedor_id': producto['proveedor_id'],
+            'nombre': producto['nombre'],
+            'stock_actual': producto['stock_total'],
+            'stock_minimo': producto['stock_minimo'],
+            'proxima_entrega': hoy + timedelta(days=int(dias_entrega[i])) if calendario[i][3] else None,
+            'demanda_estimada': math.ceil(demanda[i]),
+            'stock_seguridad': math.ceil(seguridad[i]),
+            'cantidad_sugerida': int(a_pedir[i]),
+        })
+
+    for grupo in sugerencias.values():
+        grupo['productos'].sort(key=lambda s: s['nombre'])
+    return dict(sorted(sugerencias.items(), key=lambda item: (item[1]['nombre'], item[0] or 0)))
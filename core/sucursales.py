@@ -0,0 +1,67 @@
+# core/sucursales.py
+# Sucursal activa de cada solicitud, resuelta una sola vez (la primera llamada a sucursal_activa
+# la guarda en el request) y compartida por las vistas y los context processors. Las filas de Sucursal casi no cambian:
+# se guardan en memoria del proceso; las señales limpian la copia local al guardar o borrar,
+# y los demás workers la renuevan solos cuando vence (SEGUNDOS_CACHE).
+import threading
+import time
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Sucursal, PerfilUsuario
+
+SEGUNDOS_CACHE = 300
+
+_lock = threading.Lock()
+_cache = {'sucursales': None, 'vence': 0.0}
+
+
+def todas_las_sucursales():
+    """ {id: Sucursal} de todas las sucursales, desde memoria mientras no venza. """
+    with _lock:
+        if _cache['sucursales'] is not None and time.monotonic() < _cache['vence']:
+            return _cache['sucursales']
+    sucursales = {s.id: s for s in Sucursal.objects.order_by('id')}
+    with _lock:
+        _cache['sucursales'], _cache['vence'] = sucursales, time.monotonic() + SEGUNDOS_CACHE
+    return sucursales
+
+
+def sucursal_por_id(sucursal_id):
+    try:
+        return todas_las_sucursales().get(int(sucursal_id))
+    except (TypeError, ValueError):
+        return None
+
+
+def sucursal_activa(request):
+    """
+    Devuelve la sucursal activa (o None) y la recuerda en el request.
+    - Superusuario: la elegida en la sesión; si no hay (o ya no existe), la de su perfil.
+    - Empleado: siempre la de su perfil.
+    """
+    if '_sucursal_activa' in request.__dict__:
+        return request._sucursal_activa
+
+    sucursal = None
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        if user.is_superuser:
+            sucursal = sucursal_por_id(request.session.get('sucursal_seleccionada_id'))
+        if sucursal is None:
+            # Perfil y sucursal en una sola consulta; el perfil queda cacheado en el usuario
+            # para que user.perfilusuario no vuelva a ir a la base
+            perfil = PerfilUsuario.objects.select_related('sucursal').filter(usuario=user).first()
+            user.perfilusuario = perfil
+            sucursal = perfil.sucursal if perfil else None
+
+    request._sucursal_activa = sucursal
+    return sucursal
+
+
+@receiver(post_save, sender=Sucursal)
+@receiver(post_delete, sender=Sucursal)
+def invalidar_sucursales(sender, **kwargs):
+    with _lock:
+        _cache['sucursales'] = None
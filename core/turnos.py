@@ -0,0 +1,136 @@
+# core/turnos.py
+# Totales del turno de caja. Cada sucursal tiene un TurnoAbierto que se actualiza con un
+# UPDATE ... SET campo = campo + monto en la misma transacción de cada venta o pago.
+# Cerrar el turno copia esos totales y los pone en cero: no se recorre el historial.
+from datetime import datetime
+from decimal import Decimal
+
+from django.db import transaction, IntegrityError
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from .models import Venta, PagoCliente, PagoProveedor, CierreTurno, TurnoAbierto
+
+# Método de pago -> campo del acumulador (las ventas fiadas no entran en caja)
+CAMPO_POR_METODO = {
+    'efectivo': 'total_ventas_efectivo',
+    'debito': 'total_ventas_tarjeta',
+    'credito': 'total_ventas_tarjeta',
+    'qr': 'total_ventas_qr',
+}
+CAMPOS_TOTALES = (
+    'total_ventas_efectivo', 'total_ventas_tarjeta', 'total_ventas_qr',
+    'total_cobros_fiado', 'total_pagos_proveedor',
+)
+
+
+def totales_desde(sucursal_id, desde=None):
+    """
+    Recalcula los totales del turno a partir de los movimientos: una consulta con
+    agregación condicional sobre Venta y una por cada tabla de pagos.
+    Solo se usa para inicializar el acumulador (o para auditarlo).
+    """
+    ventas = Venta.objects.filter(sucursal_id=sucursal_id)
+    pagos_clientes = PagoCliente.objects.filter(sucursal_id=sucursal_id)
+    pagos_proveedores = PagoProveedor.objects.filter(sucursal_id=sucursal_id)
+    if desde:
+        ventas = ventas.filter(fecha_hora__gt=desde)
+        pagos_clientes = pagos_clientes.filter(fecha__gt=desde)
+        pagos_proveedores = pagos_proveedores.filter(fecha__gt=desde)
+
+    totales = ventas.aggregate(
+        total_ventas_efectivo=Sum('total', filter=Q(metodo_pago='efectivo')),
+        total_ventas_tarjeta=Sum('total', filter=Q(metodo_pago__in=['debito', 'credito'])),
+        total_ventas_qr=Sum('total', filter=Q(metodo_pago='qr')),
+    )
+    totales['total_cobros_fiado'] = pagos_clientes.aggregate(total=Sum('monto'))['total']
+    totales['total_pagos_proveedor'] = pagos_proveedores.aggregate(total=Sum('monto'))['total']
+    return {campo: valor or Decimal('0') for campo, valor in totales.items()}
+
+
+def _inicializar(sucursal_id):
+    """ Crea el acumulador desde el último cierre. Devuelve (turno, creado). """
+    ultimo_cierre = CierreTurno.objects.filter(sucursal_id=sucursal_id).order_by(
+        '-fecha_cierre_turno'
+    ).values_list('fecha_cierre_turno', flat=True).first()
+    totales = totales_desde(sucursal_id, ultimo_cierre)
+    try:
+        with transaction.atomic():
+            return TurnoAbierto.objects.create(
+                sucursal_id=sucursal_id,
+                # Si nunca se cerró un turno, el primero abarca todo (como antes)
+                fecha_inicio=ultimo_cierre or timezone.make_aware(datetime.min),
+                **totales
+            ), True
+    except IntegrityError:
+        # Otro proceso lo creó al mismo tiempo
+        return TurnoAbierto.objects.get(sucursal_id=sucursal_id), False
+
+
+def obtener_turno(sucursal_id, bloquear=False):
+    turnos = TurnoAbierto.objects.select_for_update() if bloquear else TurnoAbierto.objects
+    try:
+        return turnos.get(sucursal_id=sucursal_id)
+    except TurnoAbierto.DoesNotExist:
+        turno, _ = _inicializar(sucursal_id)
+        return turnos.get(pk=turno.pk) if bloquear else turno
+
+
+def _sumar(movimiento, campo_fecha, campo, monto):
+    """
+    Llamar dentro de la transacción que creó el movimiento. El UPDATE solo suma si el turno
+    empezó antes que el movimiento: si un cierre se confirmó mientras esperábamos su bloqueo,
+    el turno nuevo empieza después de nuestra fecha y el movimiento se vuelve a fechar ahora,
+    así cae dentro del turno que lo cuenta (y totales_desde(fecha_inicio) coincide).
+    """
+    sucursal_id = movimiento.sucursal_id
+    turnos = TurnoAbierto.objects.filter(sucursal_id=sucursal_id)
+    if turnos.filter(fecha_inicio__lt=getattr(movimiento, campo_fecha)).update(**{campo: F(campo) + monto}):
+        return
+    if turnos.exists():
+        ahora = timezone.now()
+        type(movimiento).objects.filter(pk=movimiento.pk).update(**{campo_fecha: ahora})
+        setattr(movimiento, campo_fecha, ahora)
+        if turnos.update(**{campo: F(campo) + monto}):
+            return
+    # Primer movimiento desde que existe el acumulador: al inicializarlo ya se cuenta este
+    # movimiento (es visible dentro de nuestra transacción). Si lo creó otro proceso, sumamos.
+    _, creado = _inicializar(sucursal_id)
+    if not creado:
+        turnos.update(**{campo: F(campo) + monto})
+
+
+def registrar_venta_en_turno(venta):
+    campo = CAMPO_POR_METODO.get(venta.metodo_pago)
+    if campo:
+        _sumar(venta, 'fecha_hora', campo, venta.total)
+
+
+def registrar_cobro_en_turno(pago_cliente):
+    _sumar(pago_cliente, 'fecha', 'total_cobros_fiado', pago_cliente.monto)
+
+
+def registrar_pago_proveedor_en_turno(pago_proveedor):
+    _sumar(pago_proveedor, 'fecha', 'total_pagos_proveedor', pago_proveedor.monto)
+
+
+def cerrar_turno(sucursal_id, usuario, monto_declarado):
+    """ Guarda el CierreTurno con los totales acumulados y abre un turno nuevo en cero. """
+    with transaction.atomic():
+        # El bloqueo hace esperar a las ventas que quieran sumar mientras cerramos:
+        # entran al turno siguiente (refechadas después de `ahora`, ver _sumar), nunca
+        # se pierden ni se cuentan dos veces.
+        turno = obtener_turno(sucursal_id, bloquear=True)
+        ahora = timezone.now()
+        cierre = CierreTurno.objects.create(
+            sucursal_id=sucursal_id,
+            usuario_cierre=usuario,
+            fecha_inicio_turno=turno.fecha_inicio,
+            fecha_cierre_turno=ahora,
+            monto_en_caja_declarado=monto_declarado,
+            **{campo: getattr(turno, campo) for campo in CAMPOS_TOTALES}
+        )
+        TurnoAbierto.objects.filter(pk=turno.pk).update(
+            fecha_inicio=ahora, **{campo: 0 for campo in CAMPOS_TOTALES}
+        )
+    return cierre
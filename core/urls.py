@@ -24,6 +24,7 @@ urlpatterns = [
     path('ventas/detalle/<int:venta_id>/', views.detalle_venta, name='detalle_venta'),
     path('analisis/canasta/', views.analisis_canasta, name='analisis_canasta'),
     path('compras/sugerencias/', views.sugerencias_compra, name='sugerencias_compra'),
+    path('compras/sugerencias/exportar/', views.exportar_orden_compra, name='exportar_orden_compra'),
     path('inventario/contar/', views.contar_inventario, name='contar_inventario'),
     path('inventario/aplicar-ajuste/', views.aplicar_ajuste_inventario, name='aplicar_ajuste_inventario'),
 
@@ -37,6 +38,7 @@ urlpatterns = [
     path('proveedores/<int:proveedor_id>/detalle/', views.detalle_proveedor, name='detalle_proveedor'),
     path('proveedores/registrar-factura/', views.registrar_factura_proveedor, name='registrar_factura_proveedor'),
     path('proveedores/registrar-pago/', views.registrar_pago_proveedor, name='registrar_pago_proveedor'),
+    path('proveedores/antiguedad-deuda/', views.antiguedad_deuda_proveedores, name='antiguedad_deuda_proveedores'),
     # Productos
     path('productos/', views.listar_productos, name='listar_productos'),
     path('productos/nuevo/', views.crear_producto, name='crear_producto'),
@@ -64,6 +66,7 @@ urlpatterns = [
 
     # --- NUEVA RUTA PARA REPORTES ---
     path('reportes/', views.reportes_dashboard, name='reportes_dashboard'),
+    path('reportes/exportar/<str:dataset>/', views.exportar_datos, name='exportar_datos'),
 
     # --- NUEVA RUTA PARA CIERRE DE TURNO ---
     path('caja/cerrar-turno/', views.cerrar_turno, name='cerrar_turno'),
@@ -71,4 +74,11 @@ urlpatterns = [
     # --- VISTAS API ---
     path('api/buscar-productos/', views.buscar_productos, name='buscar_productos'),
     path('api/buscar-por-codigo/', views.buscar_producto_por_codigo, name='buscar_por_codigo'),
+    path('api/sugerencias-carrito/', views.sugerencias_carrito, name='sugerencias_carrito'),
+    path('api/productos/', views.api_catalogo_productos, name='api_catalogo_productos'),
+    path('api/ventas/', views.api_historial_ventas, name='api_historial_ventas'),
+    path('api/buscar-clientes/', views.api_buscar_clientes, name='api_buscar_clientes'),
+
+    # --- MÉTRICAS PARA PROMETHEUS ---
+    path('metrics', views.metricas_prometheus, name='metricas'),
 ]
\ No newline at end of file
@@ -7,18 +7,21 @@ import json
 
 # --- Imports de Django ---
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.http import JsonResponse
 from django.db import transaction, IntegrityError
 from django.contrib import messages
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 from django.db.models import Sum, Count,Case, When, IntegerField, Min, F, Q
 from django.contrib.auth.decorators import login_required
-from apyori import apriori
 
 # --- Imports de Python ---
 import json
+import hmac
 import os
 import re
+import time
 from datetime import timedelta,datetime
 from decimal import Decimal, ROUND_HALF_UP
 
@@ -31,9 +34,23 @@ except ImportError:
 
 # --- Import de Modelos Locales ---
 from .models import (
-    Producto, Stock, Venta, DetalleVenta, Configuracion, Proveedor,
+    Producto, Stock, Venta, DetalleVenta, Proveedor,
     Categoria, Sucursal, PerfilUsuario,Cliente, PagoCliente, EnvaseRetornable, StockEnvases, FacturaProveedor, PagoProveedor, CierreTurno, PrediccionVenta
 )
+from .canasta import reglas_asociacion, indice_sugerencias
+from .reposicion import calcular_reposicion
+from .catalogo import pagina_catalogo, POR_PAGINA
+from .exportaciones import DATASETS, respuesta_csv, respuesta_xlsx
+from . import turnos
+from .cuentas import bloquear_cliente, registrar_movimiento, estado_de_cuenta
+from . import cuentas_proveedores
+from .inventario import descontar_fefo, en_transaccion_con_reintentos, StockInsuficiente
+from . import metricas
+from . import fragmentos
+from . import listados
+from .sucursales import sucursal_activa
+from .configuracion import configuracion_vigente, multiplicador_pago
+from .fechas import ZONA_NEGOCIO, hoy_local, filtro_dias, rango_dias, parsear_dia, dia_truncado
 
 # --- Helper Function ---
 def obtener_sucursal_usuario(request):
@@ -41,25 +58,17 @@ def obtener_sucursal_usuario(request):
     Devuelve la sucursal activa.
     - Si es Superusuario: Busca en la sesión, luego en el perfil.
     - Si es Empleado: Busca siempre en el perfil (fijo).
+    Se resuelve una vez por solicitud (core/sucursales.py).
     """
-    # 1. Si es Superusuario, priorizamos la selección temporal (sesión)
-    if request.user.is_superuser:
-        sucursal_id_session = request.session.get('sucursal_seleccionada_id')
-        if sucursal_id_session:
-            try:
-                return Sucursal.objects.get(id=sucursal_id_session)
-            except Sucursal.DoesNotExist:
-                pass # Si falla, volvemos al perfil
-    
-    # 2. Si no hay sesión (o no es superuser), usamos el perfil de base de datos
-    try:
-        perfil = getattr(request.user, 'perfilusuario', None)
-        if perfil and perfil.sucursal:
-            return perfil.sucursal
-    except PerfilUsuario.DoesNotExist:
-        pass
-        
-    return None
+    return sucursal_activa(request)
+
+
+def unidades_vendidas_desde(dia):
+    """ {producto_id: unidades vendidas desde `dia`} en una sola consulta agrupada (todas las sucursales). """
+    return dict(
+        DetalleVenta.objects.filter(**filtro_dias('venta__fecha_hora', dia))
+        .values_list('producto_id').annotate(total=Sum('cantidad')).order_by()
+    )
 
 # ==============================================================================
 # VISTA PRINCIPAL (DASHBOARD)
@@ -68,43 +77,50 @@ def obtener_sucursal_usuario(request):
 def dashboard(request):
     context = {}
     usuario = request.user
-    hoy = timezone.now().date()
+    hoy = hoy_local()
     sucursal_usuario = obtener_sucursal_usuario(request)
 
+    # Los widgets se cachean como fragmentos del template, con una clave que cambia cuando cambian
+    # sus datos (ver core/fragmentos.py). Por eso sus datos van en SimpleLazyObject (las alertas ya
+    # son QuerySets perezosos): las consultas se hacen recién si el template no encontró el fragmento.
+    context['version_widgets'] = fragmentos.version(sucursal_usuario, hoy)
+
     # --- 1. CÁLCULO DE GRÁFICO (Ventas últimos 7 días) ---
-    # Esto faltaba en la versión anterior y por eso daba error el JS
-    ventas_semana_labels = []
-    ventas_semana_data = []
-    
-    # Iteramos los últimos 7 días (incluyendo hoy)
-    for i in range(6, -1, -1):
-        dia = hoy - timedelta(days=i)
-        # Filtramos ventas por día
-        ventas_dia_query = Venta.objects.filter(fecha_hora__date=dia)
-        
+    def grafico_semana():
+        # Una sola consulta por rango de fecha_hora, agrupada por día local
+        ventas_semana = Venta.objects.filter(**filtro_dias('fecha_hora', hoy - timedelta(days=6), hoy))
         # Si hay sucursal, filtramos. Si es superadmin global, ve todo.
         if sucursal_usuario:
-            ventas_dia_query = ventas_dia_query.filter(sucursal=sucursal_usuario)
-        
-        total_dia = ventas_dia_query.aggregate(total=Sum('total'))['total'] or 0
-        
-        ventas_semana_labels.append(dia.strftime('%d/%m')) # Etiqueta eje X
-        ventas_semana_data.append(float(total_dia)) # Dato eje Y
+            ventas_semana = ventas_semana.filter(sucursal=sucursal_usuario)
+        totales_por_dia = dict(
+            ventas_semana.annotate(dia=dia_truncado('fecha_hora')).values('dia').annotate(
+                total=Sum('total')
+            ).order_by().values_list('dia', 'total')
+        )
+
+        # Iteramos los últimos 7 días (incluyendo hoy)
+        labels, data = [], []
+        for i in range(6, -1, -1):
+            dia = hoy - timedelta(days=i)
+            labels.append(dia.strftime('%d/%m')) # Etiqueta eje X
+            data.append(float(totales_por_dia.get(dia) or 0)) # Dato eje Y
+        return {'labels': json.dumps(labels), 'data': json.dumps(data), 'total': sum(data)}
 
-    # Guardamos los datos del gráfico en el contexto
-    context['ventas_labels'] = json.dumps(ventas_semana_labels)
-    context['ventas_data'] = json.dumps(ventas_semana_data)
-    context['total_ventas_semana'] = sum(ventas_semana_data) # Esta variable faltaba
+    context['grafico'] = SimpleLazyObject(grafico_semana)
     # -----------------------------------------------------
 
     # --- 2. LÓGICA DE SUPERADMIN ---
+    ventas_de_hoy = filtro_dias('fecha_hora', hoy, hoy)
     if usuario.is_superuser:
-        ventas_hoy_todas = Venta.objects.filter(fecha_hora__date=hoy)
-        total_vendido_global = ventas_hoy_todas.aggregate(total=Sum('total'))['total'] or Decimal('0.00')
-        ventas_por_sucursal = ventas_hoy_todas.values('sucursal__nombre').annotate(total_vendido=Sum('total')).order_by('sucursal__nombre')
+        def resumen_global():
+            ventas_hoy_todas = Venta.objects.filter(**ventas_de_hoy)
+            return {
+                'total_vendido': ventas_hoy_todas.aggregate(total=Sum('total'))['total'] or Decimal('0.00'),
+                'por_sucursal': ventas_hoy_todas.values('sucursal__nombre').annotate(total_vendido=Sum('total')).order_by('sucursal__nombre'),
+            }
 
-        context['ventas_por_sucursal'] = ventas_por_sucursal
-        context['total_vendido_global'] = total_vendido_global
+        context['version_global'] = fragmentos.version(None, hoy)
+        context['resumen_global'] = SimpleLazyObject(resumen_global)
         context['es_superadmin'] = True
 
     # --- 3. LÓGICA DE SUCURSAL (Widgets y Predicciones) ---
@@ -112,15 +128,13 @@ def dashboard(request):
     if sucursal_usuario:
         context['sucursal_actual'] = sucursal_usuario
 
-        # A. Ventas del día
-        ventas_hoy_sucursal = Venta.objects.filter(fecha_hora__date=hoy, sucursal=sucursal_usuario)
-        total_vendido_hoy_sucursal = ventas_hoy_sucursal.aggregate(total=Sum('total'))['total'] or Decimal('0.00')
-        numero_ventas_hoy_sucursal = ventas_hoy_sucursal.count()
-        context['total_vendido_hoy'] = total_vendido_hoy_sucursal
-        context['numero_ventas_hoy'] = numero_ventas_hoy_sucursal
+        # A. Ventas del día (total y cantidad en una sola consulta)
+        context['ventas_hoy'] = SimpleLazyObject(lambda: Venta.objects.filter(
+            sucursal=sucursal_usuario, **ventas_de_hoy
+        ).aggregate(total=Sum('total'), cantidad=Count('id')))
 
         # B. Predicciones (IA) - CORREGIDO
-        # Buscamos predicciones desde HOY en adelante para esta sucursal
+        # No se cachea: las predicciones se cargan en lote, sin señales que avisen el cambio
         predicciones = PrediccionVenta.objects.filter(
             sucursal=sucursal_usuario,
             fecha__gte=hoy
@@ -174,49 +188,54 @@ def admin_stock_por_sucursal(request, sucursal_id):
     # --- FIN PERMISO ---
 
     sucursal = get_object_or_404(Sucursal, id=sucursal_id)
-    hoy = timezone.now().date()
+    hoy = hoy_local()
     hace_30_dias = hoy - timedelta(days=30)
 
-    # Usamos la sucursal de la URL para filtrar
-    productos_con_stock = Producto.objects.filter(
-        lotes__cantidad__gt=0,
-        lotes__sucursal=sucursal # <-- Filtro por sucursal seleccionada
-    ).annotate(
-        total_gondola=Sum(Case(When(lotes__ubicacion='gondola', lotes__sucursal=sucursal, then='lotes__cantidad'), default=0, output_field=IntegerField())),
-        total_deposito=Sum(Case(When(lotes__ubicacion='deposito', lotes__sucursal=sucursal, then='lotes__cantidad'), default=0, output_field=IntegerField())),
-        vencimiento_proximo=Min('lotes__fecha_vencimiento', filter=Q(lotes__sucursal=sucursal))
-    ).distinct()
-
-    info_consolidada = []
-    for producto in productos_con_stock:
-        dias_para_vencer = None
-        if producto.vencimiento_proximo:
-            dias_para_vencer = (producto.vencimiento_proximo - hoy).days
-
-        ventas_30_dias = DetalleVenta.objects.filter(
-            producto=producto, venta__fecha_hora__gte=hace_30_dias
-        ).aggregate(total_vendido=Sum('cantidad'))['total_vendido'] or 0
-        velocidad_venta = ventas_30_dias / 30.0 if ventas_30_dias > 0 else 0 # Evitar división por cero
-
-        en_riesgo = False
-        stock_total = (producto.total_gondola or 0) + (producto.total_deposito or 0)
-        if velocidad_venta > 0 and dias_para_vencer is not None and dias_para_vencer > 0:
-            dias_de_stock_restante = stock_total / velocidad_venta
-            if dias_de_stock_restante > dias_para_vencer:
-                en_riesgo = True
-
-        info_consolidada.append({
-            'producto': producto, 'total_gondola': producto.total_gondola,
-            'total_deposito': producto.total_deposito,
-            'vencimiento_proximo': producto.vencimiento_proximo,
-            'dias_para_vencer': dias_para_vencer,
-            'dias_para_vencer_abs': abs(dias_para_vencer) if dias_para_vencer is not None else None,
-            'en_riesgo': en_riesgo, 'velocidad_venta': round(velocidad_venta, 2)
-        })
-    info_consolidada.sort(key=lambda x: (x['dias_para_vencer'] is None, x['dias_para_vencer'] if x['dias_para_vencer'] is not None else float('inf')))
-    # Usaremos la misma plantilla que stock_detalle, pero pasándole la sucursal que estamos viendo
+    def calcular():
+        # Usamos la sucursal de la URL para filtrar
+        productos_con_stock = Producto.objects.filter(
+            lotes__cantidad__gt=0,
+            lotes__sucursal=sucursal # <-- Filtro por sucursal seleccionada
+        ).annotate(
+            total_gondola=Sum(Case(When(lotes__ubicacion='gondola', lotes__sucursal=sucursal, then='lotes__cantidad'), default=0, output_field=IntegerField())),
+            total_deposito=Sum(Case(When(lotes__ubicacion='deposito', lotes__sucursal=sucursal, then='lotes__cantidad'), default=0, output_field=IntegerField())),
+            vencimiento_proximo=Min('lotes__fecha_vencimiento', filter=Q(lotes__sucursal=sucursal))
+        ).distinct()
+
+        vendidas_30_dias = unidades_vendidas_desde(hace_30_dias)
+        info_consolidada = []
+        for producto in productos_con_stock:
+            dias_para_vencer = None
+            if producto.vencimiento_proximo:
+                dias_para_vencer = (producto.vencimiento_proximo - hoy).days
+
+            ventas_30_dias = vendidas_30_dias.get(producto.id, 0)
+            velocidad_venta = ventas_30_dias / 30.0 if ventas_30_dias > 0 else 0 # Evitar división por cero
+
+            en_riesgo = False
+            stock_total = (producto.total_gondola or 0) + (producto.total_deposito or 0)
+            if velocidad_venta > 0 and dias_para_vencer is not None and dias_para_vencer > 0:
+                dias_de_stock_restante = stock_total / velocidad_venta
+                if dias_de_stock_restante > dias_para_vencer:
+                    en_riesgo = True
+
+            info_consolidada.append({
+                'producto': producto, 'total_gondola': producto.total_gondola,
+                'total_deposito': producto.total_deposito,
+                'vencimiento_proximo': producto.vencimiento_proximo,
+                'dias_para_vencer': dias_para_vencer,
+                'dias_para_vencer_abs': abs(dias_para_vencer) if dias_para_vencer is not None else None,
+                'en_riesgo': en_riesgo, 'velocidad_venta': round(velocidad_venta, 2)
+            })
+        info_consolidada.sort(key=lambda x: (x['dias_para_vencer'] is None, x['dias_para_vencer'] if x['dias_para_vencer'] is not None else float('inf')))
+        return info_consolidada
+
+    # Usaremos la misma plantilla que stock_detalle, pero pasándole la sucursal que estamos viendo.
+    # La tabla es un fragmento cacheado (ver core/fragmentos.py); la versión es la global porque la
+    # velocidad de venta cuenta lo vendido en todas las sucursales
     return render(request, 'core/stock_detalle.html', {
-        'info_consolidada': info_consolidada,
+        'info_consolidada': SimpleLazyObject(calcular),
+        'version_widgets': fragmentos.version(None, hoy),
         'sucursal_seleccionada': sucursal # Para mostrar el nombre en la plantilla
     })
 
@@ -230,55 +249,63 @@ def stock_detalle(request):
         messages.error(request, "Tu usuario no está asignado a ninguna sucursal.")
         return render(request, 'core/stock_detalle.html', {'info_consolidada': []})
 
-    hoy = timezone.now().date()
+    hoy = hoy_local()
     hace_30_dias = hoy - timedelta(days=30)
 
-    base_query = Producto.objects.all()
-    if not request.user.is_superuser and sucursal_usuario:
-        base_query = Producto.objects.filter(lotes__sucursal=sucursal_usuario)
-
-    productos_con_stock = base_query.annotate(
-        total_gondola=Sum(Case(When(lotes__ubicacion='gondola', lotes__sucursal=sucursal_usuario, then='lotes__cantidad'), default=0, output_field=IntegerField())) if sucursal_usuario else Sum(Case(When(lotes__ubicacion='gondola', then='lotes__cantidad'), default=0, output_field=IntegerField())),
-        total_deposito=Sum(Case(When(lotes__ubicacion='deposito', lotes__sucursal=sucursal_usuario, then='lotes__cantidad'), default=0, output_field=IntegerField())) if sucursal_usuario else Sum(Case(When(lotes__ubicacion='deposito', then='lotes__cantidad'), default=0, output_field=IntegerField())),
-        vencimiento_proximo=Min('lotes__fecha_vencimiento', filter=Q(lotes__sucursal=sucursal_usuario)) if sucursal_usuario else Min('lotes__fecha_vencimiento')
-    ).distinct()
-
-    info_consolidada = []
-    for producto in productos_con_stock:
-        dias_para_vencer = None
-        if producto.vencimiento_proximo:
-            dias_para_vencer = (producto.vencimiento_proximo - hoy).days
-        ventas_30_dias = DetalleVenta.objects.filter(
-            producto=producto, venta__fecha_hora__gte=hace_30_dias
-        ).aggregate(total_vendido=Sum('cantidad'))['total_vendido'] or 0
-        velocidad_venta = ventas_30_dias / 30.0 if ventas_30_dias > 0 else 0 # Evitar división por cero
+    def calcular():
+        base_query = Producto.objects.all()
+        if not request.user.is_superuser and sucursal_usuario:
+            base_query = Producto.objects.filter(lotes__sucursal=sucursal_usuario)
+
+        productos_con_stock = base_query.annotate(
+            total_gondola=Sum(Case(When(lotes__ubicacion='gondola', lotes__sucursal=sucursal_usuario, then='lotes__cantidad'), default=0, output_field=IntegerField())) if sucursal_usuario else Sum(Case(When(lotes__ubicacion='gondola', then='lotes__cantidad'), default=0, output_field=IntegerField())),
+            total_deposito=Sum(Case(When(lotes__ubicacion='deposito', lotes__sucursal=sucursal_usuario, then='lotes__cantidad'), default=0, output_field=IntegerField())) if sucursal_usuario else Sum(Case(When(lotes__ubicacion='deposito', then='lotes__cantidad'), default=0, output_field=IntegerField())),
+            vencimiento_proximo=Min('lotes__fecha_vencimiento', filter=Q(lotes__sucursal=sucursal_usuario)) if sucursal_usuario else Min('lotes__fecha_vencimiento')
+        ).distinct()
+
+        vendidas_30_dias = unidades_vendidas_desde(hace_30_dias)
+        info_consolidada = []
+        for producto in productos_con_stock:
+            dias_para_vencer = None
+            if producto.vencimiento_proximo:
+                dias_para_vencer = (producto.vencimiento_proximo - hoy).days
+            ventas_30_dias = vendidas_30_dias.get(producto.id, 0)
+            velocidad_venta = ventas_30_dias / 30.0 if ventas_30_dias > 0 else 0 # Evitar división por cero
 
         
-        stock_total = (producto.total_gondola or 0) + (producto.total_deposito or 0)
-        en_riesgo = False
-        if stock_total == 0:
-             en_riesgo = True # ¡Alerta Roja!
+            stock_total = (producto.total_gondola or 0) + (producto.total_deposito or 0)
+            en_riesgo = False
+            if stock_total == 0:
+                 en_riesgo = True # ¡Alerta Roja!
         
-        # Caso 2: Stock bajo (menor al mínimo)
-        elif stock_total < producto.stock_minimo:
-             en_riesgo = True # Alerta Roja     
-
-        elif velocidad_venta > 0 and dias_para_vencer is not None and dias_para_vencer > 0:
-            dias_de_stock_restante = stock_total / velocidad_venta
-            if dias_de_stock_restante > dias_para_vencer:
-                en_riesgo = True
-
-        info_consolidada.append({
-            'producto': producto, 'total_gondola': producto.total_gondola,
-            'total_deposito': producto.total_deposito,
-            'vencimiento_proximo': producto.vencimiento_proximo,
-            'dias_para_vencer': dias_para_vencer,
-            'dias_para_vencer_abs': abs(dias_para_vencer) if dias_para_vencer is not None else None,
-            'en_riesgo': en_riesgo, 'velocidad_venta': round(velocidad_venta, 2)
-        })
-
-    info_consolidada.sort(key=lambda x: (x['dias_para_vencer'] is None, x['dias_para_vencer'] if x['dias_para_vencer'] is not None else float('inf'))) # Ordenar nulos al final
-    return render(request, 'core/stock_detalle.html', {'info_consolidada': info_consolidada, 'sucursal_actual': sucursal_usuario})
+            # Caso 2: Stock bajo (menor al mínimo)
+            elif stock_total < producto.stock_minimo:
+                 en_riesgo = True # Alerta Roja     
+
+            elif velocidad_venta > 0 and dias_para_vencer is not None and dias_para_vencer > 0:
+                dias_de_stock_restante = stock_total / velocidad_venta
+                if dias_de_stock_restante > dias_para_vencer:
+                    en_riesgo = True
+
+            info_consolidada.append({
+                'producto': producto, 'total_gondola': producto.total_gondola,
+                'total_deposito': producto.total_deposito,
+                'vencimiento_proximo': producto.vencimiento_proximo,
+                'dias_para_vencer': dias_para_vencer,
+                'dias_para_vencer_abs': abs(dias_para_vencer) if dias_para_vencer is not None else None,
+                'en_riesgo': en_riesgo, 'velocidad_venta': round(velocidad_venta, 2)
+            })
+
+        info_consolidada.sort(key=lambda x: (x['dias_para_vencer'] is None, x['dias_para_vencer'] if x['dias_para_vencer'] is not None else float('inf'))) # Ordenar nulos al final
+        return info_consolidada
+
+    # La tabla es un fragmento cacheado (ver core/fragmentos.py); la versión es la global porque la
+    # velocidad de venta cuenta lo vendido en todas las sucursales
+    return render(request, 'core/stock_detalle.html', {
+        'info_consolidada': SimpleLazyObject(calcular),
+        'version_widgets': fragmentos.version(None, hoy),
+        'sucursal_actual': sucursal_usuario,
+    })
 
 @login_required
 def agregar_stock(request):
@@ -368,7 +395,7 @@ def reponer_gondola(request):
             else: messages.info(request, "No se especificaron cantidades válidas para mover.")
         return redirect('stock_detalle') # Siempre redirigir, incluso si hubo warning
 
-    stock_en_deposito = Stock.objects.filter(sucursal=sucursal_usuario, ubicacion='deposito', cantidad__gt=0).order_by('producto__nombre', 'fecha_vencimiento')
+    stock_en_deposito = Stock.objects.filter(sucursal=sucursal_usuario, ubicacion='deposito', cantidad__gt=0).select_related('producto').order_by('producto__nombre', 'fecha_vencimiento')
     return render(request, 'core/reponer_gondola.html', {'stock_en_deposito': stock_en_deposito})
 
 @login_required
@@ -409,25 +436,30 @@ def contar_inventario(request):
                     messages.warning(request, f"Se recibió un dato inválido para el producto ID {key.split('_')[-1]}.")
 
         # Obtenemos el stock actual del sistema PARA ESTA SUCURSAL
-        stock_sistema_raw = Stock.objects.filter(sucursal=sucursal_usuario, cantidad__gt=0)
-        stock_sistema = {}
-        for item in stock_sistema_raw:
-            stock_sistema[item.producto_id] = stock_sistema.get(item.producto_id, 0) + item.cantidad
+        stock_sistema = dict(
+            Stock.objects.filter(sucursal=sucursal_usuario, cantidad__gt=0)
+            .values_list('producto_id').annotate(total=Sum('cantidad')).order_by()
+        )
 
         # Comparamos y calculamos discrepancias
-        discrepancias = []
         todos_los_productos_ids = set(items_contados.keys()) | set(stock_sistema.keys())
+        diferencias = {
+            prod_id: items_contados.get(prod_id, 0) - stock_sistema.get(prod_id, 0)
+            for prod_id in todos_los_productos_ids
+        }
+        # Los nombres de todos los productos con diferencia, en una sola consulta
+        nombres = dict(Producto.objects.filter(
+            id__in=[prod_id for prod_id, diferencia in diferencias.items() if diferencia != 0]
+        ).values_list('id', 'nombre'))
 
-        for prod_id in todos_los_productos_ids:
-            contado = items_contados.get(prod_id, 0)
-            sistema = stock_sistema.get(prod_id, 0)
-            diferencia = contado - sistema
-
-            if diferencia != 0: # Solo mostramos si hay diferencia
-                producto = Producto.objects.get(id=prod_id) # Obtenemos el objeto producto para el nombre
+        discrepancias = []
+        for prod_id, diferencia in diferencias.items():
+            if diferencia != 0 and prod_id in nombres: # Solo mostramos si hay diferencia
+                contado = items_contados.get(prod_id, 0)
+                sistema = stock_sistema.get(prod_id, 0)
                 discrepancias.append({
-                    'producto_id': producto.id,
-                    'producto_nombre': producto.nombre,
+                    'producto_id': prod_id,
+                    'producto_nombre': nombres[prod_id],
                     'contado': contado,
                     'sistema': sistema,
                     'diferencia': diferencia, # Positivo = sobrante, Negativo = faltante
@@ -442,9 +474,8 @@ def contar_inventario(request):
         })
 
     # --- Si es GET, mostramos la página de conteo ---
-    # Pasamos todos los productos para la búsqueda inicial (opcionalmente podríamos filtrar por los que tienen stock)
-    productos = Producto.objects.all().order_by('nombre')
-    return render(request, 'core/contar_inventario.html', {'productos': productos})
+    # Los productos se buscan contra api_catalogo_productos a medida que se tipea
+    return render(request, 'core/contar_inventario.html', {'sucursal_actual': sucursal_usuario})
 
 @login_required
 def aplicar_ajuste_inventario(request):
@@ -460,54 +491,54 @@ def aplicar_ajuste_inventario(request):
 
     try:
         with transaction.atomic(): # Si algo falla, no se guarda nada
-            for key, value in request.POST.items():
-                # Buscamos los inputs que se llamen 'ajuste_PRODUCTOID'
-                if key.startswith('ajuste_'):
-                    producto_id = int(key.split('_')[1])
-                    diferencia = int(value)
+            # Buscamos los inputs que se llamen 'ajuste_PRODUCTOID'
+            ajustes = [(int(key.split('_')[1]), int(value)) for key, value in request.POST.items() if key.startswith('ajuste_')]
+            productos = Producto.objects.in_bulk([producto_id for producto_id, _ in ajustes])
+            for producto_id, diferencia in ajustes:
+                if diferencia == 0: continue # Si no hay diferencia, saltamos
+
+                producto = productos.get(producto_id)
+                if producto is None:
+                    raise Producto.DoesNotExist(f"No existe el producto {producto_id}.")
+
+                # CASO A: FALTANTE (La diferencia es negativa, ej: -5)
+                if diferencia < 0:
+                    cantidad_a_restar = abs(diferencia)
                     
-                    if diferencia == 0: continue # Si no hay diferencia, saltamos
-
-                    producto = Producto.objects.get(id=producto_id)
-
-                    # CASO A: FALTANTE (La diferencia es negativa, ej: -5)
-                    if diferencia < 0:
-                        cantidad_a_restar = abs(diferencia)
+                    # Lógica FEFO: Buscamos lotes con stock, ordenados por vencimiento (los que vencen antes primero)
+                    lotes = Stock.objects.filter(
+                        producto=producto,
+                        sucursal=sucursal_usuario,
+                        cantidad__gt=0
+                    ).order_by(F('fecha_vencimiento').asc(nulls_last=True)) 
+
+                    for lote in lotes:
+                        if cantidad_a_restar <= 0: break
                         
-                        # Lógica FEFO: Buscamos lotes con stock, ordenados por vencimiento (los que vencen antes primero)
-                        lotes = Stock.objects.filter(
-                            producto=producto,
-                            sucursal=sucursal_usuario,
-                            cantidad__gt=0
-                        ).order_by(F('fecha_vencimiento').asc(nulls_last=True)) 
-
-                        for lote in lotes:
-                            if cantidad_a_restar <= 0: break
-                            
-                            descuento = min(lote.cantidad, cantidad_a_restar)
-                            lote.cantidad -= descuento
-                            lote.save()
-                            
-                            cantidad_a_restar -= descuento
+                        descuento = min(lote.cantidad, cantidad_a_restar)
+                        lote.cantidad -= descuento
+                        lote.save()
                         
-                        # Si después de recorrer todos los lotes todavía falta restar, es que el sistema
-                        # pensaba que tenía más de lo que realmente había en lotes.
-                        # (Podríamos crear un registro de pérdida aquí si tuviéramos ese modelo)
+                        cantidad_a_restar -= descuento
+                    
+                    # Si después de recorrer todos los lotes todavía falta restar, es que el sistema
+                    # pensaba que tenía más de lo que realmente había en lotes.
+                    # (Podríamos crear un registro de pérdida aquí si tuviéramos ese modelo)
 
-                    # CASO B: SOBRANTE (La diferencia es positiva, ej: +5)
-                    else:
-                        # Buscamos o creamos un lote "Sin Vencimiento" en Depósito
-                        lote_sobrante, created = Stock.objects.get_or_create(
-                            producto=producto,
-                            sucursal=sucursal_usuario,
-                            fecha_vencimiento=None, # Sin fecha
-                            ubicacion='deposito',   # Por defecto a depósito
-                            defaults={'cantidad': 0}
-                        )
-                        lote_sobrante.cantidad += diferencia
-                        lote_sobrante.save()
+                # CASO B: SOBRANTE (La diferencia es positiva, ej: +5)
+                else:
+                    # Buscamos o creamos un lote "Sin Vencimiento" en Depósito
+                    lote_sobrante, created = Stock.objects.get_or_create(
+                        producto=producto,
+                        sucursal=sucursal_usuario,
+                        fecha_vencimiento=None, # Sin fecha
+                        ubicacion='deposito',   # Por defecto a depósito
+                        defaults={'cantidad': 0}
+                    )
+                    lote_sobrante.cantidad += diferencia
+                    lote_sobrante.save()
 
-                    ajustes_realizados += 1
+                ajustes_realizados += 1
 
             if ajustes_realizados > 0:
                 messages.success(request, f"¡Stock actualizado! Se ajustaron {ajustes_realizados} productos.")
@@ -529,7 +560,7 @@ def registrar_venta(request):
         messages.error(request, "No puedes registrar ventas sin una sucursal asignada.")
         return redirect('dashboard')
 
-    config, created = Configuracion.objects.get_or_create(pk=1)
+    config = configuracion_vigente()
 
     if request.method == 'POST':
         try:
@@ -538,17 +569,20 @@ def registrar_venta(request):
             metodo_pago = data.get('metodo_pago', 'efectivo')
             cuotas = int(data.get('cuotas', 1))
             cliente_id = data.get('cliente_id') # <-- ¡CORRECCIÓN 1: CAPTURAR CLIENTE ID!
-            cliente = None
 
             if not carrito: 
                 return JsonResponse({'error': 'El carrito está vacío'}, status=400)
 
-            with transaction.atomic():
+            # La venta entera es una transacción; si la base la rechaza por contención con otra
+            # caja ("database is locked", deadlock) se vuelve a intentar desde cero
+            def guardar():
+                cliente = None
                 # --- Lógica de Cliente y Límite ---
                 if metodo_pago == 'cuenta_corriente':
                     if not cliente_id:
                         raise Exception('Para "Cuenta Corriente", debes seleccionar un cliente.')
-                    cliente = get_object_or_404(Cliente, id=cliente_id)
+                    # Bloqueamos al cliente: dos cajas no pueden pasar el límite a la vez
+                    cliente = get_object_or_404(Cliente.objects.select_for_update(), id=cliente_id)
                 
                 # Calculamos el subtotal de PRODUCTOS (ignorando devoluciones)
                 subtotal_productos = sum(Decimal(str(item['precio'])) * int(item['cantidad']) for item in carrito if item.get('tipo') != 'devolucion')
@@ -557,14 +591,9 @@ def registrar_venta(request):
 
                 subtotal_venta = subtotal_productos + total_devoluciones # El subtotal real
 
-                descuento_recargo = Decimal('0.00')
                 # Los recargos/descuentos se aplican solo sobre el subtotal de productos
-                if metodo_pago == 'efectivo' and config.descuento_efectivo_porcentaje > 0: 
-                    descuento_recargo = -(subtotal_productos * (config.descuento_efectivo_porcentaje / Decimal('100')))
-                elif metodo_pago == 'credito' and config.recargo_credito_porcentaje > 0: 
-                    descuento_recargo = subtotal_productos * (config.recargo_credito_porcentaje / Decimal('100'))
-                elif metodo_pago == 'qr' and config.recargo_qr_porcentaje > 0: 
-                    descuento_recargo = subtotal_productos * (config.recargo_qr_porcentaje / Decimal('100'))
+                # (el multiplicador ya viene con signo: negativo para el descuento en efectivo)
+                descuento_recargo = subtotal_productos * multiplicador_pago(metodo_pago)
 
                 total_venta = subtotal_venta + descuento_recargo
                 total_venta_quantized = total_venta.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
@@ -583,12 +612,17 @@ def registrar_venta(request):
                     cliente=cliente # Asigna el cliente (o None)
                 )
 
-                # Si fue fiado, actualizamos el saldo del cliente
+                turnos.registrar_venta_en_turno(nueva_venta)
+
+                # Si fue fiado, va al libro de la cuenta corriente (y suma al saldo)
                 if cliente:
-                    cliente.saldo_actual += total_venta_quantized
-                    cliente.save()
+                    registrar_movimiento(
+                        cliente.id, 'venta', total_venta_quantized,
+                        sucursal=sucursal_usuario, venta=nueva_venta, fecha=nueva_venta.fecha_hora
+                    )
 
-                for item in carrito:
+                # Siempre en el mismo orden (por id): dos cajas con los mismos productos no se bloquean en cruz
+                for item in sorted(carrito, key=lambda item: str(item['id'])):
                     if item.get('tipo') == 'devolucion':
                         # --- ES UNA DEVOLUCIÓN DE ENVASE ---
                         envase_id_num = int(item['id'].split('_')[1])
@@ -617,17 +651,8 @@ def registrar_venta(request):
                         producto = get_object_or_404(Producto, id=item['id'])
                         cantidad_a_vender = int(item['cantidad'])
                         
-                        lotes_disponibles = Stock.objects.filter(producto=producto, cantidad__gt=0, ubicacion='gondola', sucursal=sucursal_usuario).order_by('fecha_vencimiento')
-                        cantidad_vendida_total = 0
-                        for lote in lotes_disponibles:
-                            if cantidad_vendida_total >= cantidad_a_vender: break
-                            cantidad_a_descontar = min(lote.cantidad, cantidad_a_vender - cantidad_vendida_total)
-                            lote.cantidad -= cantidad_a_descontar
-                            lote.save()
-                            cantidad_vendida_total += cantidad_a_descontar
-
-                        if cantidad_vendida_total < cantidad_a_vender:
-                            raise Exception(f"Stock insuficiente en esta sucursal para {producto.nombre} (necesitas {cantidad_a_vender}, disponibles {cantidad_vendida_total})")
+                        # FEFO con UPDATE condicional: dos cajas no pueden vender la misma unidad
+                        descontar_fefo(producto, sucursal_usuario, cantidad_a_vender)
 
                         subtotal_detalle = Decimal(str(item['precio'])) * int(item['cantidad'])
                         DetalleVenta.objects.create(
@@ -636,8 +661,14 @@ def registrar_venta(request):
                         )
 
                 return JsonResponse({'success': True, 'venta_id': nueva_venta.id, 'mensaje': f"Venta registrada! Total: ${total_venta_quantized}"})
+
+            with metricas.venta_segundos.medir():
+                respuesta = en_transaccion_con_reintentos(guardar)
+            metricas.ventas_registradas.inc(metodo_pago=metodo_pago if metodo_pago in dict(Venta.METODO_PAGO_CHOICES) else 'otro')
+            return respuesta
         
         except Exception as e:
+            metricas.ventas_rechazadas.inc(motivo='sin_stock' if isinstance(e, StockInsuficiente) else 'error')
             return JsonResponse({'error': str(e)}, status=500)
 
     # --- LÓGICA GET (CORREGIDA) ---
@@ -658,6 +689,26 @@ def registrar_venta(request):
 
 @login_required
 def historial_ventas(request):
+    # La tabla se llena de a páginas desde api_historial_ventas (paginación por keyset)
+    sucursal_usuario = obtener_sucursal_usuario(request)
+    if not request.user.is_superuser and not sucursal_usuario:
+        messages.warning(request, "No tienes una sucursal asignada para ver el historial.")
+
+    return render(request, 'core/historial_ventas.html', {
+        'sucursal_actual': sucursal_usuario,
+        'desde_por_defecto': (hoy_local() - timedelta(days=30)).isoformat(),
+        'metodos_pago': Venta.METODO_PAGO_CHOICES,
+    })
+
+@login_required
+def api_historial_ventas(request):
+    """
+    Una página del historial, de la más nueva a la más vieja.
+    Paginación por keyset sobre (fecha_hora, id): el parámetro `cursor` es el que devolvió
+    la página anterior en 'siguiente', así cada página cuesta lo mismo sin importar cuán atrás vayamos.
+    Filtros: desde, hasta (YYYY-MM-DD), metodo_pago, cliente_id. Los totales vienen en la primera página
+    y solo si hay fecha 'desde' (sumar todo el historial obligaría a recorrer la tabla entera).
+    """
     sucursal_usuario = obtener_sucursal_usuario(request)
 
     ventas_query = Venta.objects.all()
@@ -665,10 +716,78 @@ def historial_ventas(request):
         ventas_query = ventas_query.filter(sucursal=sucursal_usuario)
     elif not request.user.is_superuser:
         ventas_query = Venta.objects.none()
-        messages.warning(request, "No tienes una sucursal asignada para ver el historial.")
 
-    ventas = ventas_query.order_by('-fecha_hora').prefetch_related('detalles__producto')
-    return render(request, 'core/historial_ventas.html', {'ventas': ventas, 'sucursal_actual': sucursal_usuario})
+    try:
+        desde_str = request.GET.get('desde')
+        hasta_str = request.GET.get('hasta')
+        ventas_query = ventas_query.filter(**filtro_dias(
+            'fecha_hora',
+            parsear_dia(desde_str) if desde_str else None,
+            parsear_dia(hasta_str) if hasta_str else None,
+        ))
+        if request.GET.get('metodo_pago'):
+            ventas_query = ventas_query.filter(metodo_pago=request.GET['metodo_pago'])
+        if request.GET.get('cliente_id'):
+            ventas_query = ventas_query.filter(cliente_id=int(request.GET['cliente_id']))
+        limite = max(1, min(int(request.GET.get('limite', 50)), 200))
+
+        cursor = request.GET.get('cursor')
+        pagina_query = ventas_query
+        if cursor:
+            fecha_cursor_str, id_cursor_str = cursor.rsplit('_', 1)
+            fecha_cursor = datetime.fromisoformat(fecha_cursor_str)
+            id_cursor = int(id_cursor_str)
+            pagina_query = ventas_query.filter(
+                Q(fecha_hora__lt=fecha_cursor) | Q(fecha_hora=fecha_cursor, id__lt=id_cursor)
+            )
+    except (ValueError, TypeError):
+        return JsonResponse({'error': 'Parámetros inválidos'}, status=400)
+
+    # Pedimos una de más para saber si hay página siguiente. Los detalles se cargan solo para esta página.
+    pagina = list(
+        pagina_query.select_related('sucursal', 'cliente').prefetch_related('detalles__producto')
+        .order_by('-fecha_hora', '-id')[:limite + 1]
+    )
+    hay_mas = len(pagina) > limite
+    pagina = pagina[:limite]
+
+    respuesta = {
+        'ventas': [
+            {
+                'id': venta.id,
+                'fecha_hora': timezone.localtime(venta.fecha_hora, ZONA_NEGOCIO).strftime('%d/%m/%Y %H:%M'),
+                'sucursal': venta.sucursal.nombre,
+                'metodo_pago': venta.get_metodo_pago_display(),
+                'cliente': venta.cliente.nombre_completo if venta.cliente else None,
+                'total': venta.total,
+                'url_detalle': reverse('detalle_venta', args=[venta.id]),
+                'detalles': [
+                    {
+                        'producto': detalle.producto.nombre if detalle.producto else 'Devolución de envase',
+                        'cantidad': detalle.cantidad,
+                        'subtotal': detalle.subtotal,
+                    }
+                    for detalle in venta.detalles.all()
+                ],
+            }
+            for venta in pagina
+        ],
+        'siguiente': f"{pagina[-1].fecha_hora.isoformat()}_{pagina[-1].id}" if hay_mas else None,
+    }
+
+    if not cursor and desde_str:
+        totales = ventas_query.aggregate(cantidad=Count('id'), total=Sum('total'))
+        nombres_metodos = dict(Venta.METODO_PAGO_CHOICES)
+        respuesta['totales'] = {
+            'cantidad': totales['cantidad'],
+            'total': totales['total'] or 0,
+            'por_metodo': [
+                {'metodo_pago': nombres_metodos.get(fila['metodo_pago'], fila['metodo_pago']), 'total': fila['total']}
+                for fila in ventas_query.values('metodo_pago').annotate(total=Sum('total')).order_by('metodo_pago')
+            ],
+        }
+
+    return JsonResponse(respuesta)
 
 @login_required
 def detalle_venta(request, venta_id):
@@ -704,6 +823,21 @@ def buscar_producto_por_codigo(request):
     except Producto.DoesNotExist:
          return JsonResponse({'error': 'Producto no encontrado'}, status=404)
 
+@login_required
+def sugerencias_carrito(request):
+    # "Los que compran esto también llevan...": se llama en cada producto agregado al carrito
+    sucursal_usuario = obtener_sucursal_usuario(request)
+    if not sucursal_usuario:
+        return JsonResponse({'error': 'Usuario sin sucursal asignada'}, status=400)
+
+    try:
+        carrito_ids = [int(i) for i in request.GET.get('productos', '').split(',') if i]
+        n = min(int(request.GET.get('n', 5)), 20)
+    except ValueError:
+        return JsonResponse({'error': 'Parámetros inválidos'}, status=400)
+
+    return JsonResponse(indice_sugerencias.sugerir(carrito_ids, sucursal_usuario.id, n), safe=False)
+
 # ==============================================================================
 # VISTAS DE IMPORTACIÓN E IA
 # ==============================================================================
@@ -720,13 +854,14 @@ def importar_stock_excel(request):
             messages.error(request, "No se seleccionó ningún archivo.")
             return redirect('importar_stock')
 
+        inicio_analisis = time.perf_counter()
         try:
             df = pd.read_excel(archivo, dtype={'codigo_barras': str})
 
             # 1. Obtenemos los datos actuales de la BD para comparar
             # Usamos diccionarios para una búsqueda rápida
             proveedores_actuales = {p.nombre.lower(): p for p in Proveedor.objects.all()}
-            productos_actuales = {p.codigo_barras: p for p in Producto.objects.filter(codigo_barras__isnull=False, codigo_barras__ne='')}
+            productos_actuales = {p.codigo_barras: p for p in Producto.objects.filter(codigo_barras__isnull=False).exclude(codigo_barras='')}
 
             filas_confirmadas = []    # Verde - Coincidencia exacta de producto
             filas_para_revisar = []     # Amarillo/Rojo - Producto nuevo o proveedor dudoso
@@ -789,6 +924,11 @@ def importar_stock_excel(request):
                     fila_data['proveedor_sugerido'] = proveedor_sugerido
                     filas_para_revisar.append(fila_data)
 
+            metricas.importacion_segundos.observar(time.perf_counter() - inicio_analisis, etapa='analisis')
+            metricas.importacion_filas.inc(len(filas_confirmadas), etapa='analizadas', tipo='stock')
+            metricas.importacion_filas.inc(len(filas_para_revisar), etapa='analizadas', tipo='nuevo_producto')
+            metricas.importacion_filas.inc(len(filas_con_problemas), etapa='analizadas', tipo='con_problemas')
+
             # 3. Enviamos los datos analizados a la nueva plantilla de confirmación
             context = {
                 'filas_confirmadas': filas_confirmadas,
@@ -839,7 +979,7 @@ def procesar_importacion_excel(request):
 
     try:
         # 2. Usamos una transacción. Si algo falla, se deshace todo.
-        with transaction.atomic():
+        with metricas.importacion_segundos.medir(etapa='procesamiento'), transaction.atomic():
             for index, data in items_a_procesar.items():
                 tipo = data.get('tipo')
                 if not tipo: continue
@@ -898,6 +1038,9 @@ def procesar_importacion_excel(request):
                     )
                     items_cargados += 1
 
+        metricas.importacion_filas.inc(items_cargados, etapa='cargadas', tipo='stock')
+        metricas.importacion_filas.inc(productos_creados, etapa='cargadas', tipo='nuevo_producto')
+
         # 4. Mostrar mensaje de éxito
         msg = f"¡Importación completada! {items_cargados} lotes de stock cargados. {productos_creados} productos nuevos creados. {proveedores_creados} proveedores nuevos creados."
         messages.success(request, msg)
@@ -938,14 +1081,17 @@ def cargar_factura_ocr(request):
             client = vision.ImageAnnotatorClient()
             content = request.FILES['imagen_factura'].read()
             image = vision.Image(content=content)
-            response = client.document_text_detection(image=image)
+            with metricas.ocr_segundos.medir():
+                response = client.document_text_detection(image=image)
             
             if response.error.message: 
                 raise Exception(f'{response.error.message}\nVerifica API.')
             
             full_text = response.text_annotations[0].description if response.text_annotations else ""
+            metricas.ocr_facturas.inc(resultado='ok')
             
         except Exception as e:
+            metricas.ocr_facturas.inc(resultado='error')
             messages.error(request, f"Error al procesar con IA: {e}")
             return redirect('cargar_factura_ocr')
 
@@ -1097,8 +1243,7 @@ def descargar_plantilla_excel(request):
 # ==============================================================================
 @login_required
 def listar_proveedores(request):
-    proveedores = Proveedor.objects.all().order_by('nombre')
-    return render(request, 'core/listar_proveedores.html', {'proveedores': proveedores})
+    return render(request, 'core/listar_proveedores.html', {'proveedores': listados.proveedores()})
 
 @login_required
 def crear_proveedor(request):
@@ -1136,7 +1281,8 @@ def editar_proveedor(request, proveedor_id):
         frecuencia = request.POST.get('frecuencia_reparto')
         proveedor.dia_semana_reparto = int(dia_semana) if dia_semana else None
         proveedor.frecuencia_reparto = int(frecuencia) if frecuencia else None
-        proveedor.save()
+        # Sin saldo_actual: lo manejan solo las facturas y pagos
+        proveedor.save(update_fields=['nombre', 'telefono', 'email', 'dia_semana_reparto', 'frecuencia_reparto'])
         messages.success(request, '¡Proveedor actualizado!')
         return redirect('listar_proveedores')
     return render(request, 'core/form_proveedor.html', {'proveedor': proveedor})
@@ -1178,6 +1324,39 @@ def detalle_proveedor(request, proveedor_id):
     }
     return render(request, 'core/detalle_proveedor.html', context)
 
+@login_required
+def antiguedad_deuda_proveedores(request):
+    if not request.user.is_superuser:
+        messages.error(request, "Acceso denegado.")
+        return redirect('dashboard')
+
+    sucursal_id = request.GET.get('sucursal_id')
+    sucursal_seleccionada = get_object_or_404(Sucursal, id=sucursal_id) if sucursal_id else None
+    filas = cuentas_proveedores.antiguedad_deuda(sucursal=sucursal_seleccionada)
+
+    # Agrupamos por sucursal con sus subtotales (sin volver a consultar)
+    claves = [clave for clave, _, _, _ in cuentas_proveedores.TRAMOS_ANTIGUEDAD] + ['total']
+    por_sucursal = {}
+    for fila in filas:
+        grupo = por_sucursal.setdefault(fila['sucursal_id'], {
+            'nombre': fila['sucursal__nombre'], 'filas': [], 'subtotal': dict.fromkeys(claves, Decimal('0')),
+        })
+        fila['tramos'] = [fila[clave] for clave in claves[:-1]]
+        grupo['filas'].append(fila)
+        for clave in claves:
+            grupo['subtotal'][clave] += fila[clave]
+    for grupo in por_sucursal.values():
+        grupo['subtotal_tramos'] = [grupo['subtotal'][clave] for clave in claves[:-1]]
+
+    context = {
+        'tramos': [titulo for _, titulo, _, _ in cuentas_proveedores.TRAMOS_ANTIGUEDAD],
+        'sucursales_deuda': por_sucursal.values(),
+        'total_general': sum((fila['total'] for fila in filas), Decimal('0')),
+        'sucursal_seleccionada': sucursal_seleccionada,
+        'todas_las_sucursales': Sucursal.objects.all(),
+    }
+    return render(request, 'core/antiguedad_deuda_proveedores.html', context)
+
 @login_required
 def registrar_factura_proveedor(request):
     if not request.user.is_superuser:
@@ -1194,19 +1373,24 @@ def registrar_factura_proveedor(request):
             monto = Decimal(monto_total_str)
 
             with transaction.atomic():
-                # 1. Creamos la factura
+                # Bloqueamos al proveedor mientras se imputan pagos a sus facturas
+                proveedor = Proveedor.objects.select_for_update().get(pk=proveedor.pk)
+
+                # 1. Creamos la factura (si teníamos crédito a favor, se descuenta de entrada)
+                credito = cuentas_proveedores.credito_sin_imputar(proveedor.id)
+                pendiente = max(Decimal('0'), monto - credito)
                 FacturaProveedor.objects.create(
                     proveedor=proveedor,
                     sucursal=sucursal,
                     numero_factura=request.POST.get('numero_factura'),
                     monto_total=monto,
-                    fecha_factura=request.POST.get('fecha_factura') or timezone.now().date(),
+                    monto_pendiente=pendiente,
+                    fecha_factura=request.POST.get('fecha_factura') or hoy_local(),
                     fecha_vencimiento=request.POST.get('fecha_vencimiento') or None,
-                    pagada=False
+                    pagada=pendiente == 0
                 )
                 # 2. Actualizamos el saldo del proveedor (aumenta nuestra deuda)
-                proveedor.saldo_actual += monto
-                proveedor.save()
+                cuentas_proveedores.sumar_saldo(proveedor.id, monto)
 
             messages.success(request, f"Factura de {proveedor.nombre} por ${monto} registrada.")
             return redirect('detalle_proveedor', proveedor_id=proveedor.id)
@@ -1238,15 +1422,19 @@ def registrar_pago_proveedor(request):
         if monto <= 0: raise ValueError("El monto debe ser positivo.")
 
         with transaction.atomic():
+            # Bloqueamos al proveedor mientras se imputa el pago a sus facturas
+            proveedor = Proveedor.objects.select_for_update().get(pk=proveedor.pk)
+
             # 1. Registramos el pago
-            PagoProveedor.objects.create(
+            pago = PagoProveedor.objects.create(
                 proveedor=proveedor, 
                 sucursal=sucursal if sucursal else Sucursal.objects.first(), # Fallback por si admin no tiene sucursal
                 monto=monto
             )
-            # 2. Actualizamos el saldo del proveedor (disminuye nuestra deuda)
-            proveedor.saldo_actual -= monto
-            proveedor.save()
+            turnos.registrar_pago_proveedor_en_turno(pago)
+            # 2. Se imputa a las facturas más viejas y baja el saldo (disminuye nuestra deuda)
+            cuentas_proveedores.imputar_a_facturas(proveedor.id, monto)
+            cuentas_proveedores.sumar_saldo(proveedor.id, -monto)
 
         messages.success(request, f"Se registró un pago de ${monto} a {proveedor.nombre}.")
     except Exception as e:
@@ -1256,8 +1444,49 @@ def registrar_pago_proveedor(request):
 
 @login_required
 def listar_productos(request):
-    productos = Producto.objects.select_related('proveedor').all().order_by('nombre')
-    return render(request, 'core/listar_productos.html', {'productos': productos})
+    # La tabla pide cada página a api_catalogo_productos; acá solo van los combos de filtros
+    return render(request, 'core/listar_productos.html', {
+        'proveedores': Proveedor.objects.order_by('nombre').values('id', 'nombre'),
+        'categorias': Categoria.objects.order_by('nombre').values('id', 'nombre'),
+    })
+
+@login_required
+def api_catalogo_productos(request):
+    """
+    Una página del catálogo. Parámetros: q (nombre o código), categoria, proveedor,
+    favorito (1/0), orden (columna, con '-' para descendente), pagina, por_pagina.
+    """
+    try:
+        favorito = request.GET.get('favorito')
+        filas, total, total_catalogo = pagina_catalogo(
+            texto=request.GET.get('q', '').strip() or None,
+            categoria_id=int(request.GET['categoria']) if request.GET.get('categoria') else None,
+            proveedor_id=int(request.GET['proveedor']) if request.GET.get('proveedor') else None,
+            favorito=(favorito == '1') if favorito in ('0', '1') else None,
+            orden=request.GET.get('orden', 'nombre'),
+            pagina=int(request.GET.get('pagina', 1)),
+            por_pagina=int(request.GET.get('por_pagina', POR_PAGINA)),
+        )
+    except ValueError:
+        return JsonResponse({'error': 'Parámetros inválidos'}, status=400)
+
+    return JsonResponse({
+        'productos': [
+            {
+                'id': fila['id'],
+                'nombre': fila['nombre'],
+                'codigo_barras': fila['codigo_barras'],
+                'precio': fila['precio_venta'],
+                'stock_minimo': fila['stock_minimo'],
+                'es_favorito': fila['es_favorito'],
+                'proveedor': fila['proveedor__nombre'],
+                'categoria': fila['categoria__nombre'],
+            }
+            for fila in filas
+        ],
+        'total': total,
+        'total_catalogo': total_catalogo,
+    })
 
 @login_required
 def crear_producto(request):
@@ -1354,8 +1583,7 @@ def eliminar_producto(request, producto_id):
 
 @login_required
 def listar_categorias(request):
-    categorias = Categoria.objects.all().order_by('nombre')
-    return render(request, 'core/listar_categorias.html', {'categorias': categorias})
+    return render(request, 'core/listar_categorias.html', {'categorias': listados.categorias()})
 
 @login_required
 def crear_categoria(request):
@@ -1441,7 +1669,8 @@ def editar_cliente(request, cliente_id):
         if request.user.is_superuser: # Solo admin puede cambiar el límite
             cliente.limite_credito = request.POST.get('limite_credito', 0)
 
-        cliente.save()
+        # Sin saldo_actual: lo manejan solo las ventas y pagos (ver core/cuentas.py)
+        cliente.save(update_fields=['nombre_completo', 'dni', 'telefono', 'limite_credito'])
         messages.success(request, '¡Cliente actualizado exitosamente!')
         return redirect('listar_clientes')
 
@@ -1451,26 +1680,18 @@ def editar_cliente(request, cliente_id):
 def estado_cuenta_cliente(request, cliente_id):
     cliente = get_object_or_404(Cliente, id=cliente_id)
 
-    # Obtenemos todas las transacciones (ventas fiadas y pagos)
-    ventas_fiadas = Venta.objects.filter(
-        cliente=cliente, 
-        metodo_pago='cuenta_corriente'
-    ).order_by('-fecha_hora')
-
-    pagos_realizados = PagoCliente.objects.filter(cliente=cliente).order_by('-fecha')
-
-    # Combinar y ordenar transacciones por fecha (opcional pero recomendado para un resumen real)
-    # Por ahora, las pasamos separadas para mostrarlas en dos tablas.
+    # Libro de ventas fiadas y pagos, paginado, con el saldo después de cada movimiento
+    pagina, movimientos = estado_de_cuenta(cliente, request.GET.get('page'))
 
     context = {
         'cliente': cliente,
-        'ventas_fiadas': ventas_fiadas,
-        'pagos_realizados': pagos_realizados,
+        'pagina': pagina,
+        'movimientos': movimientos,
     }
     return render(request, 'core/estado_cuenta_cliente.html', context)
 
 @login_required
-def registrar_pago_cliente(request):
+def registrar_pago_cliente(request, cliente_id):
     if request.method != 'POST':
         return redirect('listar_clientes')
 
@@ -1479,7 +1700,6 @@ def registrar_pago_cliente(request):
         messages.error(request, "Usuario sin sucursal asignada para registrar un pago.")
         return redirect('listar_clientes')
 
-    cliente_id = request.POST.get('cliente_id')
     monto_str = request.POST.get('monto')
     cliente = get_object_or_404(Cliente, id=cliente_id)
 
@@ -1489,15 +1709,17 @@ def registrar_pago_cliente(request):
             raise ValueError("El monto debe ser positivo.")
 
         with transaction.atomic():
+            # Primero el cliente: los movimientos de su libro se insertan de a uno (ver cuentas.tomar_corte)
+            bloquear_cliente(cliente.id)
             # 1. Registramos el pago
-            PagoCliente.objects.create(
+            pago = PagoCliente.objects.create(
                 cliente=cliente, 
                 sucursal=sucursal_usuario, 
                 monto=monto
             )
-            # 2. Actualizamos el saldo del cliente
-            cliente.saldo_actual -= monto
-            cliente.save()
+            turnos.registrar_cobro_en_turno(pago)
+            # 2. Lo anotamos en el libro del cliente (descuenta del saldo)
+            registrar_movimiento(cliente.id, 'pago', -monto, sucursal=sucursal_usuario, pago=pago, fecha=pago.fecha)
 
         messages.success(request, f"Se registró un pago de ${monto} para {cliente.nombre_completo}.")
 
@@ -1510,11 +1732,13 @@ def registrar_pago_cliente(request):
 
 @login_required
 def api_buscar_clientes(request):
-    query = request.GET.get('term', '')
-    # Filtramos por nombre o DNI
+    # Autocompletado de clientes (POS e historial de ventas): a lo sumo 10 por nombre o DNI
+    query = request.GET.get('term', '').strip()
+    if len(query) < 2:
+        return JsonResponse([], safe=False)
     clientes = Cliente.objects.filter(
         Q(nombre_completo__icontains=query) | Q(dni__icontains=query)
-    )[:10]
+    ).order_by('nombre_completo')[:10]
 
     resultados = [
         {'id': c.id, 'nombre': c.nombre_completo, 'saldo': c.saldo_actual, 'limite': c.limite_credito} 
@@ -1532,8 +1756,7 @@ def listar_envases(request):
     if not request.user.is_superuser:
         messages.error(request, "Acceso denegado.")
         return redirect('dashboard')
-    envases = EnvaseRetornable.objects.all().order_by('nombre')
-    return render(request, 'core/listar_envases.html', {'envases': envases})
+    return render(request, 'core/listar_envases.html', {'envases': listados.envases()})
 
 @login_required
 def crear_envase(request):
@@ -1579,44 +1802,35 @@ def eliminar_envase(request, envase_id):
 # ==============================================================================
 @login_required
 def analisis_canasta(request):
-    # 1. Obtener todas las ventas y sus detalles
-    ventas = Venta.objects.prefetch_related('detalles__producto').all()
-
-    # 2. Convertir las ventas en "transacciones" (listas de nombres de productos)
-    transacciones = []
-    for venta in ventas:
-        # Incluir solo ventas con más de un producto
-        if venta.detalles.count() > 1:
-            productos_en_venta = [detalle.producto.nombre for detalle in venta.detalles.all()]
-            transacciones.append(productos_en_venta)
-
-    resultados_apyori = []
-    if transacciones:
-        # 3. Ejecutar el algoritmo Apriori
-        # Ajusta min_support y min_confidence según necesites (más altos = reglas más fuertes pero menos cantidad)
-        reglas = apriori(transacciones, min_support=0.01, min_confidence=0.1, min_lift=1.1, min_length=2)
-
-        # 4. Formatear los resultados para mostrarlos
-        for regla in reglas:
-            for item_set in regla.ordered_statistics:
-                # Mostrar solo reglas simples A -> B
-                if len(item_set.items_base) == 1 and len(item_set.items_add) == 1:
-                    item_base = list(item_set.items_base)[0]
-                    item_add = list(item_set.items_add)[0]
-                    soporte = round(regla.support * 100, 2) # % de todas las transacciones
-                    confianza = round(item_set.confidence * 100, 2) # % de veces que B se compra si se compra A
-
-                    resultados_apyori.append({
-                        'base': item_base,
-                        'add': item_add,
-                        'soporte': soporte,
-                        'confianza': confianza,
-                    })
-
-    # Ordenamos por confianza (las reglas más fuertes primero)
-    resultados_apyori.sort(key=lambda x: x['confianza'], reverse=True)
-
-    return render(request, 'core/analisis_canasta.html', {'reglas': resultados_apyori})
+    # Las reglas salen de los contadores incrementales (core/canasta.py), no de recorrer todas las ventas
+    desde_str = request.GET.get('desde', '')
+    hasta_str = request.GET.get('hasta', '')
+    sucursal_id_filtro = request.GET.get('sucursal_id')
+
+    try:
+        desde = parsear_dia(desde_str) if desde_str else None
+        hasta = parsear_dia(hasta_str) if hasta_str else None
+    except ValueError:
+        messages.error(request, "Formato de fecha inválido.")
+        return redirect('analisis_canasta')
+
+    sucursal_seleccionada = None
+    if sucursal_id_filtro:
+        sucursal_seleccionada = get_object_or_404(Sucursal, id=sucursal_id_filtro)
+
+    # Ajusta min_soporte y min_confianza según necesites (más altos = reglas más fuertes pero menos cantidad)
+    reglas = reglas_asociacion(
+        sucursal=sucursal_seleccionada, desde=desde, hasta=hasta,
+        min_soporte=0.01, min_confianza=0.1, min_lift=1.1,
+    )
+
+    return render(request, 'core/analisis_canasta.html', {
+        'reglas': reglas,
+        'desde': desde_str,
+        'hasta': hasta_str,
+        'sucursal_seleccionada': sucursal_seleccionada,
+        'todas_las_sucursales': Sucursal.objects.all(),
+    })
 
 
 @login_required
@@ -1626,37 +1840,63 @@ def sugerencias_compra(request):
         messages.error(request, "Necesitas una sucursal asignada.")
         return redirect('dashboard')
 
-    # Obtenemos productos con su stock total (global o por sucursal) y proveedor
-    productos = Producto.objects.select_related('proveedor').annotate(
-        stock_total=Sum('lotes__cantidad', filter=Q(lotes__sucursal=sucursal_usuario)) if sucursal_usuario else Sum('lotes__cantidad')
-    ).filter(stock_total__isnull=False) # Solo productos con stock calculado
-
-    # Filtramos los que están bajo el mínimo
-    productos_a_pedir = productos.filter(stock_total__lt=F('stock_minimo'))
+    # Demanda predicha hasta la próxima entrega de cada proveedor + stock de seguridad (core/reposicion.py)
+    context = {
+        'sugerencias': calcular_reposicion(sucursal_usuario),
+        'sucursal_actual': sucursal_usuario
+    }
+    return render(request, 'core/sugerencias_compra.html', context)
 
-    # Agrupamos por proveedor
-    sugerencias_por_proveedor = {}
-    for producto in productos_a_pedir:
-        # Calculamos cuánto pedir (simple: para llegar al mínimo + un poco más)
-        cantidad_a_pedir = (producto.stock_minimo - producto.stock_total) + (producto.stock_minimo // 2) # Pedir para llegar al minimo + 50%
+def _nombre_hoja(nombre, usados):
+    """ Nombre de hoja válido para Excel (31 caracteres, sin []:*?/\\) que no repite uno de `usados`. """
+    base = re.sub(r'[\[\]:*?/\\]', '', nombre)[:31] or 'Proveedor'
+    hoja, n = base, 1
+    # Excel no distingue mayúsculas: "Distribuidora" y "DISTRIBUIDORA" chocan
+    while hoja.lower() in usados:
+        n += 1
+        sufijo = f' ({n})'
+        hoja = base[:31 - len(sufijo)] + sufijo
+    usados.add(hoja.lower())
+    return hoja
 
-        proveedor_nombre = producto.proveedor.nombre if producto.proveedor else "Sin Proveedor Asignado"
 
-        if proveedor_nombre not in sugerencias_por_proveedor:
-            sugerencias_por_proveedor[proveedor_nombre] = []
+@login_required
+def exportar_orden_compra(request):
+    sucursal_usuario = obtener_sucursal_usuario(request)
+    if not sucursal_usuario and not request.user.is_superuser:
+        messages.error(request, "Necesitas una sucursal asignada.")
+        return redirect('dashboard')
 
-        sugerencias_por_proveedor[proveedor_nombre].append({
-            'nombre': producto.nombre,
-            'stock_actual': producto.stock_total,
-            'stock_minimo': producto.stock_minimo,
-            'cantidad_sugerida': cantidad_a_pedir
-        })
+    sugerencias = calcular_reposicion(sucursal_usuario)
+    proveedor_filtro = request.GET.get('proveedor')
+    if proveedor_filtro:
+        # 0 = productos sin proveedor asignado
+        proveedor_id = int(proveedor_filtro) if proveedor_filtro.isdigit() and proveedor_filtro != '0' else None
+        sugerencias = {clave: grupo for clave, grupo in sugerencias.items() if clave == proveedor_id}
 
-    context = {
-        'sugerencias': sugerencias_por_proveedor,
-        'sucursal_actual': sucursal_usuario
+    columnas = {
+        'nombre': 'Producto', 'cantidad_sugerida': 'Cantidad a Pedir', 'stock_actual': 'Stock Actual',
+        'demanda_estimada': 'Demanda Estimada', 'stock_seguridad': 'Stock de Seguridad', 'proxima_entrega': 'Próxima Entrega',
     }
-    return render(request, 'core/sugerencias_compra.html', context)
+
+    # Una hoja por proveedor: cada hoja es la orden de compra de ese proveedor
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        hojas = set()
+        for grupo in sugerencias.values():
+            df = pd.DataFrame(grupo['productos'], columns=list(columnas)).rename(columns=columnas)
+            df.to_excel(writer, sheet_name=_nombre_hoja(grupo['nombre'], hojas), index=False)
+        if not sugerencias:
+            pd.DataFrame(columns=list(columnas.values())).to_excel(writer, sheet_name='Sin Sugerencias', index=False)
+
+    buffer.seek(0)
+    response = HttpResponse(
+        buffer.getvalue(),
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
+    nombre_archivo = f"orden_compra_{hoy_local().strftime('%Y%m%d')}.xlsx"
+    response['Content-Disposition'] = f'attachment; filename="{nombre_archivo}"'
+    return response
 
 # ==============================================================================
 # VISTA DE REPORTES Y CIERRE DE CAJA
@@ -1670,13 +1910,13 @@ def reportes_dashboard(request):
             return redirect('dashboard')
     
     # --- 1. FILTRADO DE FECHAS ---
-    fecha_inicio_str = request.GET.get('fecha_inicio', timezone.now().strftime('%Y-%m-%d'))
-    fecha_fin_str = request.GET.get('fecha_fin', timezone.now().strftime('%Y-%m-%d'))
+    fecha_inicio_str = request.GET.get('fecha_inicio', hoy_local().isoformat())
+    fecha_fin_str = request.GET.get('fecha_fin', hoy_local().isoformat())
     
     try:
-        fecha_inicio = datetime.strptime(fecha_inicio_str, '%Y-%m-%d').date()
-        # Ajuste: Hacemos que la fecha fin incluya el día completo (hasta las 23:59:59)
-        fecha_fin_dt = datetime.strptime(fecha_fin_str, '%Y-%m-%d') + timedelta(days=1, seconds=-1)
+        fecha_inicio = parsear_dia(fecha_inicio_str)
+        # La fecha fin incluye el día completo (rango semiabierto hasta las 00:00 del día siguiente)
+        fecha_fin = parsear_dia(fecha_fin_str)
     except ValueError:
         messages.error(request, "Formato de fecha inválido.")
         return redirect('reportes_dashboard')
@@ -1694,9 +1934,9 @@ def reportes_dashboard(request):
     # --- 3. QUERIES DE DATOS ---
     
     # Base de consultas filtradas por fecha
-    ventas_query = Venta.objects.filter(fecha_hora__range=(fecha_inicio, fecha_fin_dt))
-    pagos_clientes_query = PagoCliente.objects.filter(fecha__range=(fecha_inicio, fecha_fin_dt))
-    pagos_proveedores_query = PagoProveedor.objects.filter(fecha__range=(fecha_inicio, fecha_fin_dt))
+    ventas_query = Venta.objects.filter(**filtro_dias('fecha_hora', fecha_inicio, fecha_fin))
+    pagos_clientes_query = PagoCliente.objects.filter(**filtro_dias('fecha', fecha_inicio, fecha_fin))
+    pagos_proveedores_query = PagoProveedor.objects.filter(**filtro_dias('fecha', fecha_inicio, fecha_fin))
     
     if sucursal_seleccionada:
         ventas_query = ventas_query.filter(sucursal=sucursal_seleccionada)
@@ -1740,8 +1980,8 @@ def reportes_dashboard(request):
     
     # E. HISTORIAL DE MOVIMIENTOS
     ventas_listado = ventas_query.order_by('-fecha_hora')[:50]
-    pagos_clientes_listado = pagos_clientes_query.order_by('-fecha')[:50]
-    pagos_proveedores_listado = pagos_proveedores_query.order_by('-fecha')[:50]
+    pagos_clientes_listado = pagos_clientes_query.select_related('cliente').order_by('-fecha')[:50]
+    pagos_proveedores_listado = pagos_proveedores_query.select_related('proveedor').order_by('-fecha')[:50]
     
     context = {
         'ingresos_por_metodo': ingresos_por_metodo, # Lista procesada y traducida
@@ -1760,69 +2000,84 @@ def reportes_dashboard(request):
         'fecha_fin': fecha_fin_str,
         'sucursal_seleccionada': sucursal_seleccionada,
         'todas_las_sucursales': Sucursal.objects.all() if request.user.is_superuser else None,
+        'exportaciones': [
+            ('ventas', 'Ventas'),
+            ('detalles', 'Detalle de ventas'),
+            ('stock', 'Stock actual por lote'),
+            ('cuentas_clientes', 'Cuentas corrientes'),
+        ],
     }
     return render(request, 'core/reportes_dashboard.html', context)
 
 @login_required
-def cerrar_turno(request):
+def exportar_datos(request, dataset):
+    """
+    Descarga ventas, detalle de ventas, stock por lote o cuentas de clientes.
+    GET: formato (csv/xlsx), desde, hasta (YYYY-MM-DD) y sucursal_id (solo superusuario).
+    """
+    if dataset not in DATASETS:
+        messages.error(request, "Exportación inexistente.")
+        return redirect('reportes_dashboard')
+
     sucursal_usuario = obtener_sucursal_usuario(request)
-    if not sucursal_usuario:
-        messages.error(request, "Usuario sin sucursal asignada.")
+    if request.user.is_superuser:
+        sucursal_id = request.GET.get('sucursal_id')
+        sucursal = get_object_or_404(Sucursal, id=sucursal_id) if sucursal_id else None
+    elif sucursal_usuario:
+        sucursal = sucursal_usuario
+    else:
+        messages.error(request, "Tu usuario no está asignado a ninguna sucursal.")
         return redirect('dashboard')
 
-    # 1. Encontrar la fecha del último cierre para esta sucursal
-    ultimo_cierre = CierreTurno.objects.filter(sucursal=sucursal_usuario).order_by('-fecha_cierre_turno').first()
-    fecha_inicio = ultimo_cierre.fecha_cierre_turno if ultimo_cierre else timezone.make_aware(datetime.min) # Si no hay cierres, tomar todo
-    fecha_fin = timezone.now()
-
-    # 2. Obtener todos los movimientos desde el último cierre
-    ventas = Venta.objects.filter(sucursal=sucursal_usuario, fecha_hora__gt=fecha_inicio)
-    pagos_clientes = PagoCliente.objects.filter(sucursal=sucursal_usuario, fecha__gt=fecha_inicio)
-    pagos_proveedores = PagoProveedor.objects.filter(sucursal=sucursal_usuario, fecha__gt=fecha_inicio)
+    try:
+        desde_str = request.GET.get('desde')
+        hasta_str = request.GET.get('hasta')
+        desde, hasta = rango_dias(
+            parsear_dia(desde_str) if desde_str else None,
+            parsear_dia(hasta_str) if hasta_str else None,
+        )
+    except ValueError:
+        messages.error(request, "Formato de fecha inválido.")
+        return redirect('reportes_dashboard')
 
-    # 3. Calcular totales
-    total_efectivo = ventas.filter(metodo_pago='efectivo').aggregate(total=Sum('total'))['total'] or 0
-    total_tarjeta = ventas.filter(metodo_pago__in=['debito', 'credito']).aggregate(total=Sum('total'))['total'] or 0
-    total_qr = ventas.filter(metodo_pago='qr').aggregate(total=Sum('total'))['total'] or 0
-    total_cobros = pagos_clientes.aggregate(total=Sum('monto'))['total'] or 0
-    total_pagos = pagos_proveedores.aggregate(total=Sum('monto'))['total'] or 0
+    encabezado, filas = DATASETS[dataset](desde=desde, hasta=hasta, sucursal=sucursal)
+    nombre = f"{dataset}_{desde_str or 'inicio'}_{hasta_str or 'hoy'}"
+    if request.GET.get('formato') == 'xlsx':
+        return respuesta_xlsx(nombre, encabezado, filas)
+    return respuesta_csv(nombre, encabezado, filas)
 
-    # 4. Calcular el dinero que DEBERÍA HABER en caja (efectivo)
-    caja_calculada = total_efectivo + total_cobros - total_pagos
+@login_required
+def cerrar_turno(request):
+    sucursal_usuario = obtener_sucursal_usuario(request)
+    if not sucursal_usuario:
+        messages.error(request, "Usuario sin sucursal asignada.")
+        return redirect('dashboard')
 
     if request.method == 'POST':
         monto_declarado_str = request.POST.get('monto_en_caja_declarado')
         try:
             monto_declarado = Decimal(monto_declarado_str)
 
-            # Guardamos el cierre
-            nuevo_cierre = CierreTurno.objects.create(
-                sucursal=sucursal_usuario,
-                usuario_cierre=request.user,
-                fecha_inicio_turno=fecha_inicio,
-                fecha_cierre_turno=fecha_fin,
-                total_ventas_efectivo=total_efectivo,
-                total_ventas_tarjeta=total_tarjeta,
-                total_ventas_qr=total_qr,
-                total_cobros_fiado=total_cobros,
-                total_pagos_proveedor=total_pagos,
-                monto_en_caja_declarado=monto_declarado
-            )
+            # Guardamos el cierre con los totales acumulados del turno y empezamos uno nuevo
+            nuevo_cierre = turnos.cerrar_turno(sucursal_usuario.id, request.user, monto_declarado)
 
             messages.success(request, f"Cierre de turno guardado. Diferencia de caja: ${nuevo_cierre.diferencia_caja}")
             return redirect('dashboard')
 
-        except (ValueError, TypeError):
+        except (ValueError, TypeError, ArithmeticError):
             messages.error(request, "Monto declarado inválido.")
 
+    # Los totales vienen del acumulador del turno (se actualiza con cada venta y pago)
+    turno = turnos.obtener_turno(sucursal_usuario.id)
+
     context = {
-        'fecha_inicio_turno': fecha_inicio,
-        'total_efectivo': total_efectivo,
-        'total_tarjeta': total_tarjeta,
-        'total_qr': total_qr,
-        'total_cobros_fiado': total_cobros,
-        'total_pagos_proveedor': total_pagos,
-        'caja_calculada': caja_calculada,
+        'fecha_inicio_turno': turno.fecha_inicio,
+        'total_efectivo': turno.total_ventas_efectivo,
+        'total_tarjeta': turno.total_ventas_tarjeta,
+        'total_qr': turno.total_ventas_qr,
+        'total_cobros_fiado': turno.total_cobros_fiado,
+        'total_pagos_proveedor': turno.total_pagos_proveedor,
+        'caja_calculada': turno.caja_calculada,
     }
     return render(request, 'core/cerrar_turno.html', context)
 
@@ -1841,4 +2096,15 @@ def cambiar_sucursal_sesion(request, sucursal_id):
         messages.error(request, "Error al cambiar de sucursal.")
     
     # Volvemos a la página desde donde hizo clic (o al dashboard)
-    return redirect(request.META.get('HTTP_REFERER', 'dashboard'))
\ No newline at end of file
+    return redirect(request.META.get('HTTP_REFERER', 'dashboard'))
+
+# ==============================================================================
+# MÉTRICAS (formato de texto de Prometheus, ver core/metricas.py)
+# ==============================================================================
+def metricas_prometheus(request):
+    # Sin @login_required: Prometheus no inicia sesión, se identifica con el token (METRICAS['TOKEN'])
+    token = metricas.configuracion()['TOKEN']
+    con_token = bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not con_token and not request.user.is_superuser:
+        return HttpResponse('Acceso denegado.', status=403, content_type='text/plain; charset=utf-8')
+    return HttpResponse(metricas.exposicion(), content_type='text/plain; version=0.0.4; charset=utf-8')